@@ -2,11 +2,16 @@
 from __future__ import annotations
 
 import functools
-from typing import TYPE_CHECKING, TypeVar
+from typing import TYPE_CHECKING, TypeVar, cast
 
 from fastapi_mail import FastMail
 
 from imagesecrets import config
+from imagesecrets.core.admission import Admission
+from imagesecrets.core.cache import ResultCache
+from imagesecrets.core.executor import Executor
+from imagesecrets.core.flight import SingleFlight
+from imagesecrets.core.storage import LocalStorage, S3Storage, Storage
 from imagesecrets.database.service import DatabaseService
 
 if TYPE_CHECKING:
@@ -27,6 +32,70 @@ def get_mail() -> FastMail:
     return FastMail(config.settings.email_config())
 
 
+@functools.cache
+def get_executor() -> Executor:
+    """Return executor for blocking image processing."""
+    settings = config.settings
+    return Executor(
+        kind=settings.executor,
+        workers=settings.executor_workers,
+        queue_size=settings.executor_queue_size,
+    )
+
+
+@functools.cache
+def get_storage() -> Storage:
+    """Return storage of saved images."""
+    settings = config.settings
+    if settings.storage_backend == "s3":
+        return S3Storage(
+            endpoint=cast(str, settings.s3_endpoint),
+            bucket=cast(str, settings.s3_bucket),
+            access_key=cast(str, settings.s3_access_key),
+            secret_key=cast(str, settings.s3_secret_key),
+            region=settings.s3_region,
+            workers=settings.storage_workers,
+        )
+    return LocalStorage(
+        settings.storage_dir,
+        workers=settings.storage_workers,
+    )
+
+
+@functools.cache
+def get_decode_cache() -> ResultCache:
+    """Return cache of decoding results."""
+    settings = config.settings
+    return ResultCache(
+        max_bytes=settings.decode_cache_bytes,
+        directory=settings.decode_cache_dir,
+        max_disk_bytes=settings.decode_cache_dir_bytes,
+    )
+
+
+@functools.cache
+def get_flights() -> SingleFlight:
+    """Return encodings and decodings which are running."""
+    return SingleFlight()
+
+
+@functools.cache
+def get_admission() -> Admission:
+    """Return admission control of encodings and decodings."""
+    settings = config.settings
+    return Admission(
+        budget=settings.admission_budget,
+        user_budget=settings.admission_user_budget,
+        max_wait=settings.admission_max_wait,
+        queue_size=settings.admission_queue_size,
+    )
+
+
 __all__ = [
+    "get_admission",
     "get_config",
+    "get_decode_cache",
+    "get_executor",
+    "get_flights",
+    "get_storage",
 ]
@@ -11,6 +11,12 @@ UnsupportedMediaType = partial_init(
     detail="only .png images are supported",
 )
 
+PayloadTooLarge = partial_init(
+    HTTPException,
+    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    detail="the image has too many pixels",
+)
+
 
 class DetailExists(HTTPException):
     """Raised when user tries to claim an account detail which already exists."""
@@ -9,6 +9,8 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
 from imagesecrets.api.exceptions import DetailExists, NotAuthenticated
+from imagesecrets.core.admission import Rejected
+from imagesecrets.core.executor import QueueFull
 
 if TYPE_CHECKING:
     from typing import Any, Optional
@@ -26,6 +28,8 @@ def init(app: FastAPI) -> None:
     app.exception_handler(RequestValidationError)(validation_error)
     app.exception_handler(DetailExists)(detail_exists)
     app.exception_handler(NotAuthenticated)(not_authenticated)
+    app.exception_handler(QueueFull)(queue_full)
+    app.exception_handler(Rejected)(rejected)
 
 
 async def handler(
@@ -104,3 +108,37 @@ async def not_authenticated(
         content={"detail": "invalid access token"},
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def queue_full(req: Request, exc: QueueFull) -> JSONResponse:
+    """Return service unavailable response when no worker can take the request.
+
+    :param req: The original starlette request
+    :param exc: The exception that was raised
+
+    """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "the server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def rejected(req: Request, exc: Rejected) -> JSONResponse:
+    """Return response when a request does not fit into the admission budget.
+
+    :param req: The original starlette request
+    :param exc: The exception that was raised
+
+    """
+    if exc.user:
+        status_code = status.HTTP_429_TOO_MANY_REQUESTS
+        detail = "too many images are being processed for you, try again later"
+    else:
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        detail = "the server is busy, try again later"
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
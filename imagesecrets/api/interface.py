@@ -6,7 +6,7 @@ from fastapi import APIRouter, Depends, FastAPI, status
 import imagesecrets
 from imagesecrets import schemas
 from imagesecrets.api import dependencies, handlers, openapi, responses, tasks
-from imagesecrets.api.routers import decode, encode, user
+from imagesecrets.api.routers import decode, encode, job, metrics, user
 from imagesecrets.config import Settings
 from imagesecrets.database import base
 
@@ -16,6 +16,8 @@ def create_router() -> APIRouter:
 
     router.include_router(decode.router)
     router.include_router(encode.router)
+    router.include_router(job.router)
+    router.include_router(metrics.router)
     router.include_router(user.main)
     router.include_router(user.me)
 
@@ -41,6 +43,12 @@ def create_api(config: Settings) -> FastAPI:
     handlers.init(api)
     tasks.init(api)
 
+    @api.on_event("shutdown")
+    async def shutdown() -> None:
+        """Stop the workers processing and storing images."""
+        dependencies.get_executor().shutdown()
+        dependencies.get_storage().shutdown()
+
     @api.get(
         "/",
         response_model=schemas.base.Info,
@@ -20,6 +20,15 @@ CONFLICT: Response = {
 MEDIA: Response = {
     415: {"model": Message, "description": "Unsupported Media Type"},
 }
+TOO_LARGE: Response = {
+    413: {"model": Message, "description": "Payload Too Large"},
+}
+BUSY: Response = {
+    503: {"model": Message, "description": "Service Unavailable"},
+}
+TOO_MANY: Response = {
+    429: {"model": Message, "description": "Too Many Requests"},
+}
 VALIDATION: Response = {
     422: {"model": Field, "description": "Validation Error"},
 }
@@ -1,7 +1,10 @@
 """Message decoding router."""
 from __future__ import annotations
 
-from typing import Union
+import asyncio
+import math
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Union, cast
 
 from fastapi import (
     APIRouter,
@@ -16,14 +19,29 @@ from fastapi.responses import JSONResponse
 
 from imagesecrets.api import dependencies, exceptions, responses
 from imagesecrets.api.routers.user.main import manager
-from imagesecrets.constants import MESSAGE_DELIMITER
+from imagesecrets.constants import (
+    DECODE_STORAGE,
+    MESSAGE_DELIMITER,
+    PROBE_SIZE,
+)
 from imagesecrets.core import decode
-from imagesecrets.core.util import image
+from imagesecrets.core.admission import Admission
+from imagesecrets.core.cache import ResultCache
+from imagesecrets.core.executor import Executor, TaskStopped
+from imagesecrets.core.flight import SingleFlight
+from imagesecrets.core.storage import Storage
+from imagesecrets.core.util import buffer, image, png
 from imagesecrets.database.image import models
 from imagesecrets.database.image.services import ImageService
 from imagesecrets.database.user.models import User
 from imagesecrets.schemas import image as schemas
 
+if TYPE_CHECKING:
+    from typing import Hashable
+
+    from imagesecrets.core.util.buffer import Buffer
+
+config = dependencies.get_config()
 router = APIRouter(
     tags=["decode"],
     dependencies=[Depends(dependencies.get_config)],
@@ -55,10 +73,21 @@ async def get(
     response_model=schemas.Image,
     status_code=status.HTTP_201_CREATED,
     summary="Decode a message",
-    responses=responses.MESSAGE_NOT_FOUND | responses.MEDIA,  # type: ignore
+    responses=(
+        responses.MESSAGE_NOT_FOUND  # type: ignore
+        | responses.MEDIA
+        | responses.TOO_LARGE
+        | responses.BUSY
+        | responses.TOO_MANY
+    ),
 )
 async def post(
     image_service: ImageService = Depends(ImageService.from_session),
+    executor: Executor = Depends(dependencies.get_executor),
+    image_storage: Storage = Depends(dependencies.get_storage),
+    decode_cache: ResultCache = Depends(dependencies.get_decode_cache),
+    flights: SingleFlight = Depends(dependencies.get_flights),
+    admission: Admission = Depends(dependencies.get_admission),
     current_user: User = Depends(manager),
     file: UploadFile = File(
         ...,
@@ -77,52 +106,113 @@ async def post(
         ge=1,
         le=8,
     ),
-) -> Union[models.DecodedImage, JSONResponse]:
+    reverse: bool = Form(
+        default=False,
+        alias="reverse",
+        description="Whether the message has been encoded into the last pixels of the image.",
+    ),
+    detect: bool = Form(
+        default=False,
+        alias="auto-detect",
+        description="Try every least significant bit amount and both directions.",
+    ),
+    storage: str = Form(
+        default=config.decode_storage,
+        alias="storage",
+        description=f"""What is kept of the decoded image, one of {', '.join(DECODE_STORAGE)}:
+        the uploaded file and a history record, only the history record or nothing.""",
+        regex=f"^({'|'.join(DECODE_STORAGE)})$",
+    ),
+) -> Union[models.DecodedImage, schemas.Image, JSONResponse]:
     """Decode a message from an image.
 
     - **custom-delimiter**: String which identifies the end of the encoded message.
     - **least-significant-bit-amount**: Number of least significant bits which was used to encode the message.
+    - **reverse**: Whether the message was encoded into the last pixels of the image.
+    - **auto-detect**: Whether to detect the least significant bit amount and the direction of the message.
+    - **storage**: Whether to store the uploaded file and a history record (original),
+        only the history record (history) or nothing (ephemeral).
     - **file**: The image from which to decode a message.
 
     \f
+    :param executor: Executor which runs the decoding
+    :param image_storage: Storage of the uploaded image
+    :param decode_cache: Cache of the decoding results
+    :param flights: Decodings which are running
+    :param admission: Admission control of the decodings
     :param current_user: Current user dependency
     :param file: Source image
     :param delim: Message delimiter
     :param lsb_n: Number of lsb
+    :param reverse: Whether to decode in reverse
+    :param detect: Whether to detect lsb_n and direction
+    :param storage: What to store, one of 'DECODE_STORAGE'
 
     :raises UnsupportedMediaType: if file is not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+    :raises Rejected: if the decoding does not fit into the budget in time
 
     """
     headers = {
         "custom-delimiter": delim,
         "least-significant-bit-amount": repr(lsb_n),
+        "reverse": repr(reverse),
+        "auto-detect": repr(detect),
     }
-    image_data = await file.read()
-    assert isinstance(image_data, bytes)
+    # the spooled upload is memory mapped instead of read into memory
+    image_data = buffer.map_file(file.file)
+    png_header = read_header(image_data, headers)
 
-    if not image.png_filetype(image_data) or not isinstance(image_data, bytes):
-        raise exceptions.UnsupportedMediaType(headers=headers)  # type: ignore
-
-    try:
-        decoded, fp = decode.api(
+    # None lets the decoding detect the parameters
+    params = (None, None) if detect else (lsb_n, reverse)
+    # hashing releases the GIL, large uploads do not block the event loop
+    digest = await asyncio.to_thread(image.content_hash, image_data)
+    key = decode_cache.key(digest, delim, *params)
+    result = await decode_cache.get(key)
+    if result is None:
+        # detection searches every least significant bit amount
+        cost = admission.cost(
+            png_header.width,
+            png_header.height,
+            params[0] or 8,
+        )
+        result = await run_decoding(
+            executor,
+            flights,
+            admission,
+            key,
+            cast(int, current_user.id),
+            cost,
             image_data=image_data,
             delimiter=delim,
-            lsb_n=lsb_n,
-            reverse=False,
+            lsb_n=params[0],
+            reverse=params[1],
         )
-    except StopIteration as e:
+        await decode_cache.put(key, result)
+
+    if isinstance(result, str):
         return JSONResponse(
             status_code=status.HTTP_200_OK,
-            content={"detail": e.args[0]},
+            content={"detail": result},
             headers=headers,
         )
+
+    filename = None
+    if storage == "original":
+        filename = await store(
+            image_service, image_storage, digest, image_data
+        )
+
     db_schema = schemas.ImageCreate(
         delimiter=delim,
-        lsb_amount=lsb_n,
-        message=decoded,
+        lsb_amount=result.lsb_n,
+        message=result.text,
         image_name=file.filename,
-        filename=fp.name,
+        filename=filename,
     )
+    if storage == "ephemeral":
+        now = datetime.now()
+        return schemas.Image(**db_schema.dict(), created=now, updated=now)
     db_image = await image_service.create_decoded(
         user_id=current_user.id,
         data=db_schema,
@@ -130,6 +220,167 @@ async def post(
     return db_image
 
 
+def read_header(image_data: Buffer, headers: dict[str, str]) -> png.Header:
+    """Return the header of an uploaded image.
+
+    Only the header is parsed, oversized images are never decompressed.
+
+    :param image_data: Data of the uploaded image
+    :param headers: Headers of the error responses
+
+    :raises UnsupportedMediaType: if the data are not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+
+    """
+    try:
+        return image.png_header(image_data, max_pixels=config.max_image_pixels)
+    except image.ImageTooLarge:
+        raise exceptions.PayloadTooLarge(headers=headers)  # type: ignore
+    except ValueError:
+        raise exceptions.UnsupportedMediaType(headers=headers)  # type: ignore
+
+
+async def run_decoding(
+    executor: Executor,
+    flights: SingleFlight,
+    admission: Admission,
+    key: Hashable,
+    user_id: int,
+    cost: int,
+    **kwargs: Any,
+) -> Union[decode.Message, str]:
+    """Return the decoded message or why none was found.
+
+    :param executor: Executor which runs the decoding
+    :param flights: Decodings which are running
+    :param admission: Admission control of the decodings
+    :param key: Cache key of the decoding
+    :param user_id: Id of the user who requested the decoding
+    :param cost: Cost of the decoding
+    :param kwargs: Keyword arguments of the decoding
+
+    :raises Rejected: if the decoding does not fit into the budget in time
+
+    """
+    try:
+        # the image is decoded only once for all detected parameters,
+        # retried requests await the decoding which is already running,
+        # every user is admitted before joining it and charged only once
+        flight = ("decode.api", key)
+        async with admission.hold(user_id, cost, flight):
+            return await flights.run(
+                flight,
+                executor.run,
+                decode.api,
+                workers=config.image_workers,
+                tile_size=config.image_tile_size,
+                **kwargs,
+            )
+    except TaskStopped as e:
+        return cast(str, e.args[0])
+
+
+async def store(
+    image_service: ImageService,
+    image_storage: Storage,
+    digest: str,
+    image_data: Buffer,
+) -> str:
+    """Store an uploaded image unchanged and return its storage key.
+
+    The upload is never compressed again and identical uploads share
+    a single stored blob.
+
+    :param image_service: Database service of the blob references
+    :param image_storage: Storage of the uploaded image
+    :param digest: Content hash of the image
+    :param image_data: Data of the uploaded image
+
+    """
+    filename = image.content_filename(digest)
+    if await image_service.reference(filename) == 1:
+        await image_storage.put(filename, image_data)
+    return filename
+
+
+@router.post(
+    "/decode/probe",
+    response_model=schemas.Probe,
+    status_code=status.HTTP_200_OK,
+    summary="Check an image for a message",
+    responses=(
+        responses.MEDIA | responses.TOO_LARGE | responses.BUSY  # type: ignore
+    ),
+)
+async def probe(
+    executor: Executor = Depends(dependencies.get_executor),
+    admission: Admission = Depends(dependencies.get_admission),
+    current_user: User = Depends(manager),
+    file: UploadFile = File(
+        ...,
+        description="The image which should be checked for a message.",
+    ),
+    delim: str = Form(
+        default=MESSAGE_DELIMITER,
+        alias="custom-delimiter",
+        description="The previously defined message delimiter.",
+        min_length=1,
+    ),
+) -> dict[str, Any]:
+    """Quickly check whether an image holds a message.
+
+    Only the beginning of the image is decoded and nothing is saved.
+
+    - **custom-delimiter**: String which identifies the end of the encoded message.
+    - **file**: The image which should be checked.
+
+    \f
+    :param executor: Executor which runs the decoding
+    :param admission: Admission control of the decodings
+    :param current_user: Current user dependency
+    :param file: Source image
+    :param delim: Message delimiter
+
+    :raises UnsupportedMediaType: if file is not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+    :raises Rejected: if the probe does not fit into the budget in time
+
+    """
+    headers = {"custom-delimiter": delim}
+    # the spooled upload is memory mapped instead of read into memory
+    image_data = buffer.map_file(file.file)
+    png_header = read_header(image_data, headers)
+
+    # the probed rows are searched for every least significant bit amount
+    result: decode.Probe = await admission.run(
+        cast(int, current_user.id),
+        admission.cost(png_header.width, probe_rows(png_header), 8),
+        executor.run,
+        decode.probe,
+        image_data=image_data,
+        delimiter=delim,
+    )
+    return {
+        "found": result.format is not None,
+        "format": result.format,
+        "lsb_amount": result.lsb_n,
+        "length": result.length,
+    }
+
+
+def probe_rows(png_header: png.Header) -> int:
+    """Return the number of rows which a probe of an image decodes.
+
+    :param png_header: Header of the image
+
+    """
+    if png_header.bit_depth != 8 or png_header.interlace:
+        # the image can not be read row by row, it is decoded whole
+        return png_header.height
+    row_values = png_header.width * png_header.bands
+    return min(png_header.height, math.ceil(PROBE_SIZE / row_values))
+
+
 @router.get(
     "/decode/{image_name}",
     response_model=list[schemas.Image],
@@ -1,7 +1,10 @@
 """Message encoding router."""
 from __future__ import annotations
 
-from typing import Union
+import asyncio
+import contextlib
+import math
+from typing import TYPE_CHECKING, Any, Optional, Union, cast
 
 from fastapi import (
     APIRouter,
@@ -12,19 +15,32 @@ from fastapi import (
     UploadFile,
     status,
 )
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.background import BackgroundTasks
+from starlette.concurrency import iterate_in_threadpool
 
 from imagesecrets.api import dependencies, exceptions, responses
 from imagesecrets.api.routers.user.main import manager
 from imagesecrets.constants import MESSAGE_DELIMITER
 from imagesecrets.core import encode
-from imagesecrets.core.util import image
+from imagesecrets.core.admission import Admission
+from imagesecrets.core.executor import Executor
+from imagesecrets.core.flight import SingleFlight
+from imagesecrets.core.storage import Spool, Storage
+from imagesecrets.core.util import buffer, image
 from imagesecrets.database.image import models
 from imagesecrets.database.image.services import ImageService
 from imagesecrets.database.user.models import User
 from imagesecrets.schemas import image as schemas
 
+if TYPE_CHECKING:
+    from typing import AsyncIterator, Iterable, Iterator
+
+    import numpy as np
+
+config = dependencies.get_config()
+# parameters which make encodings of the same image interchangeable
+ENCODING_PARAMS = ("message", "delimiter", "lsb_n", "reverse", "header")
 router = APIRouter(
     tags=["encode"],
     dependencies=[Depends(dependencies.get_config)],
@@ -54,13 +70,22 @@ async def get(
 @router.post(
     "/encode",
     status_code=status.HTTP_201_CREATED,
-    response_class=FileResponse,
+    response_class=Response,
     summary="Encode a message into an image",
-    responses=responses.MEDIA,  # type: ignore
+    responses=(
+        responses.MEDIA  # type: ignore
+        | responses.TOO_LARGE
+        | responses.BUSY
+        | responses.TOO_MANY
+    ),
 )
 async def encode_message(
     background_tasks: BackgroundTasks,
     image_service: ImageService = Depends(ImageService.from_session),
+    executor: Executor = Depends(dependencies.get_executor),
+    image_storage: Storage = Depends(dependencies.get_storage),
+    flights: SingleFlight = Depends(dependencies.get_flights),
+    admission: Admission = Depends(dependencies.get_admission),
     current_user: User = Depends(manager),
     message: str = Form(
         ...,
@@ -88,7 +113,28 @@ async def encode_message(
         ge=1,
         le=8,
     ),
-) -> Union[FileResponse, JSONResponse]:
+    header: bool = Form(
+        False,
+        alias="length-header",
+        description="""Store the message length in a header at the beginning of the image
+        instead of appending the delimiter, so that the message can be decoded without scanning the image.""",
+    ),
+    reverse: bool = Form(
+        False,
+        alias="reverse",
+        description="Encode the message into the last pixels of the image.",
+    ),
+    stream: bool = Form(
+        False,
+        alias="stream",
+        description="Send the image while it is being compressed instead of after it has been saved.",
+    ),
+    save: bool = Form(
+        True,
+        alias="save-image",
+        description="Keep the image in the history of encoded images.",
+    ),
+) -> Union[Response, JSONResponse]:
     """Encode a message into an image.
 
     - **message**: The message to encode into the image
@@ -96,16 +142,30 @@ async def encode_message(
     - **custom-delimiter**: String which is going to be appended to the end of your message
         so that the message can be decoded later.
     - **least-significant-bit-amount**: Number of least significant bits to alter.
+    - **length-header**: Store the message length in a header instead of appending the delimiter.
+    - **reverse**: Encode the message into the last pixels of the image.
+    - **stream**: Send the image while it is being compressed.
+    - **save-image**: Keep the image in the history of encoded images.
 
     \f
     :param image_service: ``ImageService`` instance
+    :param executor: Executor which runs the encoding
+    :param image_storage: Storage of the encoded image
+    :param flights: Encodings which are running
+    :param admission: Admission control of the encodings
     :param current_user: Current user dependency
     :param message: Message to encode
     :param file: Source image
     :param delim: Message delimiter, defaults to 'MESSAGE_DELIMITER'
     :param lsb_n: Number of lsb to use, defaults to 1
+    :param header: Whether to use a length header, defaults to False
+    :param reverse: Whether to encode in reverse, defaults to False
+    :param stream: Whether to stream the image, defaults to False
+    :param save: Whether to save the image, defaults to True
 
     :raises UnsupportedMediaType: if file is not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+    :raises Rejected: if the encoding does not fit into the budget in time
 
     """
     headers = {
@@ -113,45 +173,380 @@ async def encode_message(
         "message": message,
         "delimiter": delim,
         "lsb_amount": repr(lsb_n),
+        "reverse": repr(reverse),
     }
-    image_data = await file.read()
+    # the spooled upload is memory mapped instead of read into memory
+    image_data = buffer.map_file(file.file)
 
-    if not image.png_filetype(image_data) or not isinstance(image_data, bytes):
-        raise exceptions.UnsupportedMediaType(headers=headers)
+    try:
+        # only the header is parsed, oversized images are never decompressed
+        png_header = image.png_header(
+            image_data,
+            max_pixels=config.max_image_pixels,
+        )
+    except image.ImageTooLarge:
+        raise exceptions.PayloadTooLarge(headers=headers)  # type: ignore
+    except ValueError:
+        raise exceptions.UnsupportedMediaType(headers=headers)  # type: ignore
 
+    cost = admission.cost(png_header.width, png_header.height, lsb_n)
+    # the charge of a streamed image is held until it is compressed and sent
+    admitted = contextlib.AsyncExitStack()
     try:
-        fp = encode.api(
+        # oversized messages are rejected before any pixel is decoded
+        encode.check_capacity(
+            math.prod(image.shape(image.read_bytes(image_data))),
+            len(message.encode("utf-8")),
+            delim,
+            lsb_n,
+            header,
+        )
+        # hashing releases the GIL, large uploads do not block the event loop
+        digest = await asyncio.to_thread(image.content_hash, image_data)
+        result = await run_encoding(
+            executor,
+            flights,
+            admission,
+            admitted if stream else None,
+            cast(int, current_user.id),
+            cost,
+            digest,
             message=message,
             file=image_data,
             delimiter=delim,
             lsb_n=lsb_n,
-            reverse=False,
+            reverse=reverse,
+            header=header,
         )
     except ValueError as e:
+        await admitted.aclose()
         return JSONResponse(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             content={"detail": e.args[0], "field": "file"},
             headers=headers,
         )
-    image_schema = schemas.ImageCreate(
-        delimiter=delim,
-        lsb_amount=lsb_n,
-        message=message,
-        image_name=file.filename,
-        filename=fp.name,
+    except BaseException:
+        await admitted.aclose()
+        raise
+
+    filename = await download_name(result, stream, save)
+    headers["content-disposition"] = (
+        "attachment"
+        if filename is None
+        else f'attachment; filename="{filename}"'
     )
-    background_tasks.add_task(
-        image_service.create_encoded,
-        user_id=current_user.id,
-        data=image_schema,
+    response: Response
+    spool: Optional[Spool] = None
+    if stream:
+        response, spool = await stream_image(
+            cast("np.ndarray", result),
+            admitted,
+            image_storage if save else None,
+            headers,
+        )
+    else:
+        response = Response(
+            content=result,
+            status_code=status.HTTP_201_CREATED,
+            media_type="image/png",
+            headers=headers,
+        )
+
+    if save:
+        image_schema = schemas.ImageCreate(
+            delimiter=delim,
+            lsb_amount=lsb_n,
+            message=message,
+            image_name=file.filename,
+        )
+        # background tasks run after the whole response, so a streamed
+        # image is stored only once all of its chunks have been sent
+        background_tasks.add_task(
+            store,
+            image_storage,
+            image_service,
+            result if spool is None else spool,
+            filename=filename,
+            user_id=current_user.id,
+            data=image_schema,
+        )
+    return response
+
+
+async def download_name(
+    result: Union[np.ndarray, bytes],
+    stream: bool,
+    save: bool,
+) -> Optional[str]:
+    """Return name under which the encoded image is downloaded.
+
+    Saved images are downloaded under the name they are stored with,
+    the name of a streamed image is known only once it was sent.
+
+    :param result: Data of the image, or its pixels if it is streamed
+    :param stream: Whether the image is streamed
+    :param save: Whether the image is saved
+
+    """
+    if not save:
+        return image.new_filename()
+    if stream:
+        return None
+    digest = await asyncio.to_thread(image.content_hash, result)
+    return image.content_filename(digest)
+
+
+async def run_encoding(
+    executor: Executor,
+    flights: SingleFlight,
+    admission: Admission,
+    admitted: Optional[contextlib.AsyncExitStack],
+    user_id: int,
+    cost: int,
+    digest: str,
+    **kwargs: Any,
+) -> Union[np.ndarray, bytes]:
+    """Return the encoded image data, or its pixels if it is streamed.
+
+    :param executor: Executor which runs the encoding
+    :param flights: Encodings which are running
+    :param admission: Admission control of the encodings
+    :param admitted: Holds the charge of a streamed image until it is sent,
+        None if the image is not streamed
+    :param user_id: Id of the user who requested the encoding
+    :param cost: Cost of the encoding
+    :param digest: Hex digest of the uploaded image
+    :param kwargs: Keyword arguments of the encoding
+
+    :raises Rejected: if the encoding does not fit into the budget in time
+
+    """
+    # retried requests await the encoding which is already running,
+    # every user is admitted before joining it and charged only once
+    key = (
+        digest,
+        *(kwargs[name] for name in ENCODING_PARAMS),
+    )
+    kwargs |= dict(
+        workers=config.image_workers,
+        tile_size=config.image_tile_size,
+    )
+    if admitted is not None:
+        flight = ("encode.array_api", *key)
+        await admitted.enter_async_context(
+            admission.hold(user_id, cost, flight),
+        )
+        return await flights.run(
+            flight,
+            executor.run,
+            encode.array_api,
+            **kwargs,
+        )
+
+    flight = ("encode.api", *key, config.png_compress_level, config.png_filter)
+    async with admission.hold(user_id, cost, flight):
+        return await flights.run(
+            flight,
+            executor.run,
+            encode.api,
+            **kwargs,
+            level=config.png_compress_level,
+            filter_type=config.png_filter,
+        )
+
+
+async def stream_image(
+    arr: np.ndarray,
+    admitted: contextlib.AsyncExitStack,
+    image_storage: Optional[Storage],
+    headers: dict[str, str],
+) -> tuple[StreamingResponse, Optional[Spool]]:
+    """Return response which streams the image while it is compressed.
+
+    :param arr: Pixels of the encoded image
+    :param admitted: Holds the charge of the encoding until it is sent
+    :param image_storage: Storage into which the image is spooled,
+        None if the image is not saved
+    :param headers: Headers of the response
+
+    """
+    spool = None
+    try:
+        chunks = image.encode_array(
+            arr,
+            level=config.png_compress_level,
+            filter_type=config.png_filter,
+            workers=config.image_workers,
+        )
+        if image_storage is not None:
+            spool = image_storage.spool()
+            chunks = collect(chunks, spool)
+        response = StreamingResponse(
+            release_after(chunks, admitted),
+            status_code=status.HTTP_201_CREATED,
+            media_type="image/png",
+            headers=headers,
+        )
+    except BaseException:
+        await admitted.aclose()
+        if spool is not None:
+            await spool.discard()
+        raise
+    return response, spool
+
+
+async def release_after(
+    chunks: Iterator[bytes],
+    admitted: contextlib.AsyncExitStack,
+) -> AsyncIterator[bytes]:
+    """Yield the chunks compressed on a thread, then release the admission.
+
+    The compression is the most expensive part of an encoding, so the charge
+    is released only once the last chunk was sent or the client went away.
+
+    :param chunks: Chunks of the image data
+    :param admitted: Holds the charge of the encoding
+
+    """
+    async with admitted:
+        async for chunk in iterate_in_threadpool(chunks):
+            yield chunk
+
+
+def collect(chunks: Iterable[bytes], spool: Spool) -> Iterator[bytes]:
+    """Yield the chunks and write every one of them into the spool.
+
+    The spool is marked as complete only once all chunks were sent.
+
+    :param chunks: Chunks of the image data
+    :param spool: Spool of the image data
+
+    """
+    for chunk in chunks:
+        spool.write(chunk)
+        yield chunk
+    spool.complete = True
+
+
+async def store(
+    image_storage: Storage,
+    image_service: ImageService,
+    image_data: Union[bytes, Spool],
+    filename: Optional[str],
+    user_id: int,
+    data: schemas.ImageCreate,
+) -> None:
+    """Store an encoded image and add it to the history of the user.
+
+    Images with the same data share a single stored blob,
+    its data are written only when the first reference is added.
+    Streamed images which were not sent completely are not stored.
+
+    :param image_storage: Storage of the encoded image
+    :param image_service: ``ImageService`` instance
+    :param image_data: Data of the image or the spool of a streamed image
+    :param filename: Name of the image data derived from their hash,
+        computed here if None
+    :param user_id: Id of the user who encoded the image
+    :param data: Image information
+
+    """
+    if isinstance(image_data, Spool):
+        spool = image_data
+        if not spool.complete:
+            # the client disconnected, the image data are truncated
+            await spool.discard()
+            return
+        filename = image.content_filename(spool.digest)
+        if await image_service.reference(filename) == 1:
+            await spool.commit(filename)
+        else:
+            await spool.discard()
+    else:
+        if filename is None:
+            filename = image.content_filename(image.content_hash(image_data))
+        if await image_service.reference(filename) == 1:
+            await image_storage.put(filename, image_data)
+    # the history record is written only once its blob is stored
+    await image_service.create_encoded(
+        user_id=user_id,
+        data=data.copy(update={"filename": filename}),
     )
-    return FileResponse(
-        path=fp,
-        status_code=status.HTTP_201_CREATED,
+
+
+@router.post(
+    "/encode/capacity",
+    response_model=schemas.Capacity,
+    status_code=status.HTTP_200_OK,
+    summary="Message capacity of an image",
+    responses=responses.MEDIA | responses.TOO_LARGE,  # type: ignore
+)
+async def capacity(
+    current_user: User = Depends(manager),
+    file: UploadFile = File(
+        ...,
         media_type="image/png",
-        filename=image_schema.filename,
-        headers=headers,
+        description="The image in which the message would be encoded.",
+    ),
+    delim: str = Form(
+        MESSAGE_DELIMITER,
+        alias="custom-delimiter",
+        description="String which would be appended to the end of the message.",
+        min_length=1,
+    ),
+    header: bool = Form(
+        False,
+        alias="length-header",
+        description="Whether the message length would be stored in a header instead of appending the delimiter.",
+    ),
+    length: Optional[int] = Form(
+        None,
+        alias="message-length",
+        description="Length of the message in bytes.",
+        ge=0,
+    ),
+) -> dict[str, Any]:
+    """Return how many bytes of a message fit into an image.
+
+    Only the image header is read, no pixels are decoded.
+
+    - **file**: The image
+    - **custom-delimiter**: String which would be appended to the end of the message.
+    - **length-header**: Whether the message length would be stored in a header.
+    - **message-length**: Length of the message in bytes, the smallest least significant bit amount which fits it is returned.
+
+    \f
+    :param current_user: Current user dependency
+    :param file: Source image
+    :param delim: Message delimiter, defaults to 'MESSAGE_DELIMITER'
+    :param header: Whether to use a length header, defaults to False
+    :param length: Length of the message in bytes, defaults to None
+
+    :raises UnsupportedMediaType: if file is not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+
+    """
+    headers = {"custom-delimiter": delim}
+    # the spooled upload is memory mapped instead of read into memory
+    image_data = buffer.map_file(file.file)
+
+    try:
+        image.png_header(image_data, max_pixels=config.max_image_pixels)
+    except image.ImageTooLarge:
+        raise exceptions.PayloadTooLarge(headers=headers)  # type: ignore
+    except ValueError:
+        raise exceptions.UnsupportedMediaType(headers=headers)  # type: ignore
+
+    result = encode.capacity(
+        image.read_bytes(image_data), length, delim, header
     )
+    height, width, _ = result.shape
+    return {
+        "width": width,
+        "height": height,
+        "capacity": result.sizes,
+        "lsb_amount": result.lsb_n,
+    }
 
 
 @router.get(
@@ -186,6 +581,7 @@ async def get_images(
 
 
 __all__ = [
+    "capacity",
     "encode_message",
     "router",
 ]
@@ -0,0 +1,496 @@
+"""Background job router."""
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+from typing import TYPE_CHECKING, Any, Optional, Union, cast
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    UploadFile,
+    status,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from imagesecrets.api import dependencies, exceptions, responses
+from imagesecrets.api.routers.user.main import manager
+from imagesecrets.constants import DECODE_STORAGE, MESSAGE_DELIMITER
+from imagesecrets.core import encode
+from imagesecrets.core.storage import Storage
+from imagesecrets.core.util import buffer, image
+from imagesecrets.database import base
+from imagesecrets.database.image.services import ImageService
+from imagesecrets.database.job.models import Job
+from imagesecrets.database.job.services import JobService
+from imagesecrets.database.user.models import User
+from imagesecrets.schemas import job as schemas
+
+if TYPE_CHECKING:
+    from typing import AsyncIterator
+
+    from imagesecrets.core.util.buffer import Buffer
+
+config = dependencies.get_config()
+router = APIRouter(
+    tags=["jobs"],
+    dependencies=[Depends(dependencies.get_config)],
+    responses=responses.AUTHORIZATION,  # type: ignore
+)
+
+
+async def upload(
+    image_service: ImageService,
+    image_storage: Storage,
+    image_data: Buffer,
+) -> str:
+    """Store an uploaded image and return its storage key.
+
+    :param image_service: ``ImageService`` instance
+    :param image_storage: Storage of the uploaded image
+    :param image_data: Data of the uploaded image
+
+    """
+    # hashing releases the GIL, large uploads do not block the event loop
+    digest = await asyncio.to_thread(image.content_hash, image_data)
+    key = image.content_filename(digest)
+    # the job holds a reference of the blob until it is deleted
+    if await image_service.reference(key) == 1:
+        await image_storage.put(key, image_data)
+    return key
+
+
+def serialize(job: Job) -> dict[str, Any]:
+    """Return the response of a job.
+
+    :param job: The job
+
+    """
+    data = schemas.Job.from_orm(job).dict()
+    if job.result_key is not None:
+        data["result_url"] = f"/api/jobs/{job.id}/result"
+    return data
+
+
+@router.post(
+    "/jobs/encode",
+    response_model=schemas.Job,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Queue encoding of a message into an image",
+    responses=(
+        responses.MEDIA  # type: ignore
+        | responses.TOO_LARGE
+        | responses.IMAGE_TOO_SMALL
+    ),
+)
+async def encode_job(
+    image_service: ImageService = Depends(ImageService.from_session),
+    job_service: JobService = Depends(JobService.from_session),
+    image_storage: Storage = Depends(dependencies.get_storage),
+    current_user: User = Depends(manager),
+    message: str = Form(
+        ...,
+        title="Message to encode",
+        description="The message to encode into the image.",
+        min_length=1,
+        example="My secret message!",
+    ),
+    file: UploadFile = File(
+        ...,
+        media_type="image/png",
+        description="The image in which to encode the message.",
+    ),
+    delim: str = Form(
+        MESSAGE_DELIMITER,
+        alias="custom-delimiter",
+        description="""String which is going to be appended to the end of your message
+        so that the message can be decoded later.""",
+        min_length=1,
+    ),
+    lsb_n: int = Form(
+        1,
+        alias="least-significant-bit-amount",
+        description="Number of least significant bits to alter.",
+        ge=1,
+        le=8,
+    ),
+    header: bool = Form(
+        False,
+        alias="length-header",
+        description="Store the message length in a header at the beginning of the image.",
+    ),
+    reverse: bool = Form(
+        False,
+        alias="reverse",
+        description="Encode the message into the last pixels of the image.",
+    ),
+    save: bool = Form(
+        True,
+        alias="save-image",
+        description="Keep the image in the history of encoded images.",
+    ),
+) -> Union[dict[str, Any], JSONResponse]:
+    """Queue encoding of a message into an image.
+
+    The image is encoded by a worker, poll the returned job
+    and download the image once it is done.
+
+    - **message**: The message to encode into the image
+    - **file**: The image
+    - **custom-delimiter**: String which is going to be appended to the end of your message
+        so that the message can be decoded later.
+    - **least-significant-bit-amount**: Number of least significant bits to alter.
+    - **length-header**: Store the message length in a header instead of appending the delimiter.
+    - **reverse**: Encode the message into the last pixels of the image.
+    - **save-image**: Keep the image in the history of encoded images.
+
+    \f
+    :param image_service: ``ImageService`` instance
+    :param job_service: ``JobService`` instance
+    :param image_storage: Storage of the uploaded image
+    :param current_user: Current user dependency
+    :param message: Message to encode
+    :param file: Source image
+    :param delim: Message delimiter, defaults to 'MESSAGE_DELIMITER'
+    :param lsb_n: Number of lsb to use, defaults to 1
+    :param header: Whether to use a length header, defaults to False
+    :param reverse: Whether to encode in reverse, defaults to False
+    :param save: Whether to save the image, defaults to True
+
+    :raises UnsupportedMediaType: if file is not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+
+    """
+    # the spooled upload is memory mapped instead of read into memory
+    image_data = buffer.map_file(file.file)
+
+    try:
+        image.png_header(image_data, max_pixels=config.max_image_pixels)
+    except image.ImageTooLarge:
+        raise exceptions.PayloadTooLarge()  # type: ignore
+    except ValueError:
+        raise exceptions.UnsupportedMediaType()  # type: ignore
+
+    try:
+        # the job is not queued if the message can never fit
+        encode.check_capacity(
+            math.prod(image.shape(image.read_bytes(image_data))),
+            len(message.encode("utf-8")),
+            delim,
+            lsb_n,
+            header,
+        )
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"detail": e.args[0], "field": "file"},
+        )
+
+    input_key = await upload(image_service, image_storage, image_data)
+    job = await job_service.create(
+        user_id=cast(int, current_user.id),
+        kind="encode",
+        image_name=file.filename,
+        input_key=input_key,
+        params={
+            "message": message,
+            "delimiter": delim,
+            "lsb_n": lsb_n,
+            "reverse": reverse,
+            "header": header,
+            "save": save,
+        },
+    )
+    return serialize(job)
+
+
+@router.post(
+    "/jobs/decode",
+    response_model=schemas.Job,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Queue decoding of a message from an image",
+    responses=responses.MEDIA | responses.TOO_LARGE,  # type: ignore
+)
+async def decode_job(
+    image_service: ImageService = Depends(ImageService.from_session),
+    job_service: JobService = Depends(JobService.from_session),
+    image_storage: Storage = Depends(dependencies.get_storage),
+    current_user: User = Depends(manager),
+    file: UploadFile = File(
+        ...,
+        description="The image from which to decode the message.",
+    ),
+    delim: str = Form(
+        default=MESSAGE_DELIMITER,
+        alias="custom-delimiter",
+        description="The previously defined message delimiter.",
+        min_length=1,
+    ),
+    lsb_n: int = Form(
+        default=1,
+        alias="least-significant-bit-amount",
+        description="Number of least significant bits which have been used to encode the message.",
+        ge=1,
+        le=8,
+    ),
+    reverse: bool = Form(
+        default=False,
+        alias="reverse",
+        description="Whether the message has been encoded into the last pixels of the image.",
+    ),
+    detect: bool = Form(
+        default=False,
+        alias="auto-detect",
+        description="Try every least significant bit amount and both directions.",
+    ),
+    storage: str = Form(
+        default=config.decode_storage,
+        alias="storage",
+        description=f"""What is kept of the decoded image, one of {', '.join(DECODE_STORAGE)}:
+        the uploaded file and a history record, only the history record or nothing.""",
+        regex=f"^({'|'.join(DECODE_STORAGE)})$",
+    ),
+) -> dict[str, Any]:
+    """Queue decoding of a message from an image.
+
+    The image is decoded by a worker, poll the returned job
+    for the decoded message.
+
+    - **custom-delimiter**: String which identifies the end of the encoded message.
+    - **least-significant-bit-amount**: Number of least significant bits which was used to encode the message.
+    - **reverse**: Whether the message was encoded into the last pixels of the image.
+    - **auto-detect**: Whether to detect the least significant bit amount and the direction of the message.
+    - **storage**: Whether to store the uploaded file and a history record (original),
+        only the history record (history) or nothing (ephemeral).
+    - **file**: The image from which to decode a message.
+
+    \f
+    :param image_service: ``ImageService`` instance
+    :param job_service: ``JobService`` instance
+    :param image_storage: Storage of the uploaded image
+    :param current_user: Current user dependency
+    :param file: Source image
+    :param delim: Message delimiter
+    :param lsb_n: Number of lsb
+    :param reverse: Whether to decode in reverse
+    :param detect: Whether to detect lsb_n and direction
+    :param storage: What to store, one of 'DECODE_STORAGE'
+
+    :raises UnsupportedMediaType: if file is not a png image
+    :raises PayloadTooLarge: if the image has too many pixels
+
+    """
+    # the spooled upload is memory mapped instead of read into memory
+    image_data = buffer.map_file(file.file)
+
+    try:
+        image.png_header(image_data, max_pixels=config.max_image_pixels)
+    except image.ImageTooLarge:
+        raise exceptions.PayloadTooLarge()  # type: ignore
+    except ValueError:
+        raise exceptions.UnsupportedMediaType()  # type: ignore
+
+    input_key = await upload(image_service, image_storage, image_data)
+    job = await job_service.create(
+        user_id=cast(int, current_user.id),
+        kind="decode",
+        image_name=file.filename,
+        input_key=input_key,
+        params={
+            "delimiter": delim,
+            # None lets the decoding detect the parameters
+            "lsb_n": None if detect else lsb_n,
+            "reverse": None if detect else reverse,
+            "storage": storage,
+        },
+    )
+    return serialize(job)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=schemas.Job,
+    status_code=status.HTTP_200_OK,
+    summary="Job status",
+    responses=responses.NOT_FOUND,  # type: ignore
+)
+async def get(
+    job_id: int,
+    current_user: User = Depends(manager),
+    wait: int = Query(
+        0,
+        description=f"""Number of seconds to wait for the job to finish,
+        at most {config.job_max_wait}.""",
+        ge=0,
+    ),
+) -> dict[str, Any]:
+    """Return a job, optionally once it is done or failed.
+
+    - **wait**: Number of seconds to wait for the job to finish.
+
+    \f
+    :param job_id: Job database id
+    :param current_user: Current user dependency
+    :param wait: Number of seconds to wait for the job to finish
+
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, config.job_max_wait)
+    while True:
+        job = await poll(job_id=job_id, user_id=cast(int, current_user.id))
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"no job with id {job_id} found",
+            )
+        finished = cast(str, job.status) in {"done", "failed"}
+        if finished or loop.time() >= deadline:
+            return serialize(job)
+        await asyncio.sleep(
+            min(config.job_poll_interval, deadline - loop.time()),
+        )
+
+
+async def poll(job_id: int, user_id: int) -> Optional[Job]:
+    """Return a job read in a session of its own.
+
+    A waiting request does not hold a database connection between polls.
+
+    :param job_id: Job database id
+    :param user_id: User database id
+
+    """
+    async with base.get_session() as session:
+        return await JobService(session=session).get(
+            job_id=job_id,
+            user_id=user_id,
+        )
+
+
+@router.get(
+    "/jobs/{job_id}/events",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    summary="Progress events of a job",
+    responses={
+        200: {
+            "content": {"text/event-stream": {}},
+            "description": "Server-sent events",
+        },
+    }
+    | responses.NOT_FOUND,  # type: ignore
+)
+async def events(
+    job_id: int,
+    current_user: User = Depends(manager),
+) -> StreamingResponse:
+    """Stream the progress of a job as server-sent events.
+
+    A ``progress`` event is sent whenever the status or the progress
+    of the job changes, the stream ends with a ``done`` or ``failed``
+    event with the whole job.
+
+    \f
+    :param job_id: Job database id
+    :param current_user: Current user dependency
+
+    """
+    if await poll(job_id=job_id, user_id=cast(int, current_user.id)) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"no job with id {job_id} found",
+        )
+    return StreamingResponse(
+        stream(job_id=job_id, user_id=cast(int, current_user.id)),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache"},
+    )
+
+
+async def stream(job_id: int, user_id: int) -> AsyncIterator[str]:
+    """Yield server-sent events with the progress of a job until it finishes.
+
+    Every poll reads the job in a session of its own, the stream does not
+    hold a database connection while it is open.
+
+    :param job_id: Job database id
+    :param user_id: User database id
+
+    """
+    last = None
+    while (job := await poll(job_id, user_id)) is not None:
+        status_ = cast(str, job.status)
+        if status_ in {"done", "failed"}:
+            yield event(status_, serialize(job))
+            return
+        state = {"status": job.status, "progress": job.progress}
+        if state != last:
+            last = state
+            yield event("progress", state)
+        # a single connection is polled here instead of by the client
+        await asyncio.sleep(config.job_poll_interval)
+
+
+def event(name: str, data: Any) -> str:
+    """Return a server-sent event.
+
+    :param name: Name of the event
+    :param data: Data of the event, serialized as JSON
+
+    """
+    return f"event: {name}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.get(
+    "/jobs/{job_id}/result",
+    status_code=status.HTTP_200_OK,
+    response_class=Response,
+    summary="Encoded image of a job",
+    responses=responses.NOT_FOUND,  # type: ignore
+)
+async def result(
+    job_id: int,
+    job_service: JobService = Depends(JobService.from_session),
+    image_storage: Storage = Depends(dependencies.get_storage),
+    current_user: User = Depends(manager),
+) -> Response:
+    """Return the encoded image of a finished job.
+
+    \f
+    :param job_id: Job database id
+    :param job_service: ``JobService`` instance
+    :param image_storage: Storage of the encoded image
+    :param current_user: Current user dependency
+
+    """
+    job: Optional[Job] = await job_service.get(
+        job_id=job_id,
+        user_id=cast(int, current_user.id),
+    )
+    if job is None or job.result_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"no encoded image of job {job_id} found",
+        )
+    data = await image_storage.get(cast(str, job.result_key))
+    return Response(
+        content=data,
+        media_type="image/png",
+        headers={
+            "content-disposition": f'attachment; filename="{job.result_key}"',
+        },
+    )
+
+
+__all__ = [
+    "decode_job",
+    "encode_job",
+    "events",
+    "router",
+]
@@ -0,0 +1,41 @@
+"""Metrics router."""
+from __future__ import annotations
+
+from typing import Any
+
+from fastapi import APIRouter, Depends, status
+
+from imagesecrets import schemas
+from imagesecrets.api import dependencies, responses
+from imagesecrets.api.routers.user.main import manager
+from imagesecrets.core.admission import Admission
+
+# the load reveals the activity of other users, it is not public
+router = APIRouter(
+    tags=["metrics"],
+    dependencies=[Depends(manager)],
+    responses=responses.AUTHORIZATION,  # type: ignore
+)
+
+
+@router.get(
+    "/metrics",
+    response_model=schemas.base.Metrics,
+    status_code=status.HTTP_200_OK,
+    summary="Current load of the API",
+)
+async def get(
+    admission: Admission = Depends(dependencies.get_admission),
+) -> dict[str, Any]:
+    """Return the cost of the running encodings and decodings.
+
+    :param admission: Admission control of the encodings and decodings
+
+    """
+    return {
+        "admission": {
+            **admission.stats._asdict(),
+            "budget": admission.budget,
+            "user_budget": admission.user_budget,
+        },
+    }
@@ -22,7 +22,11 @@ from sqlalchemy.exc import IntegrityError
 from imagesecrets import schemas
 from imagesecrets.api import dependencies, exceptions, responses
 from imagesecrets.api.routers.user.main import manager
+from imagesecrets.core.storage import Storage
 from imagesecrets.core.util import main
+from imagesecrets.database import base
+from imagesecrets.database.image.services import ImageService
+from imagesecrets.database.job.services import JobService
 from imagesecrets.database.user.models import User
 from imagesecrets.database.user.services import UserService
 
@@ -119,20 +123,48 @@ async def patch(
 )
 async def delete(
     background_tasks: BackgroundTasks,
-    user_service: UserService = Depends(UserService.from_session),
+    image_storage: Storage = Depends(dependencies.get_storage),
     current_user: User = Depends(manager),
 ) -> Optional[dict[str, str]]:
     """Delete a user and all extra information connected to it.
 
     \f
     :param background_tasks: Starlette ``BackgroundTasks`` instance
+    :param image_storage: Storage of the saved images
     :param current_user: Current user dependency
 
     """
-    background_tasks.add_task(user_service.delete, current_user.id)
+    background_tasks.add_task(
+        delete_account,
+        image_storage,
+        user_id=current_user.id,
+    )
     return {"detail": "account deleted"}
 
 
+async def delete_account(image_storage: Storage, user_id: int) -> None:
+    """Delete a user, its images and their data which are no longer used.
+
+    :param image_storage: Storage of the saved images
+    :param user_id: Id of the user to delete
+
+    """
+    # the user deletion cascades to the image and job rows, so all of them
+    # are deleted in a single transaction instead of waiting for each other
+    async with base.get_session() as session:
+        image_service = ImageService(session=session)
+        keys = await image_service.delete(user_id)
+        # blobs of the jobs are released before the user deletion cascades
+        keys += await image_service.release(
+            await JobService(session=session).delete(user_id),
+        )
+        await UserService(session=session).delete(user_id)
+    # the blobs are removed only once the deletion is committed,
+    # images with the same data uploaded by other users are kept
+    for key in keys:
+        await image_storage.delete(key)
+
+
 @router.put(
     "/me/password",
     status_code=status.HTTP_202_ACCEPTED,
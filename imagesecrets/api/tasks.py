@@ -4,8 +4,14 @@ from __future__ import annotations
 import asyncio
 import contextlib
 import functools as fn
+from datetime import timedelta
 from typing import TYPE_CHECKING, Any, Callable, Coroutine
 
+from imagesecrets.api import dependencies
+from imagesecrets.config import settings
+from imagesecrets.database import base
+from imagesecrets.database.image.services import ImageService
+from imagesecrets.database.job.services import JobService
 from imagesecrets.database.token.services import TokenService
 
 if TYPE_CHECKING:
@@ -23,6 +29,7 @@ def init(app: FastAPI) -> None:
     async def runner() -> None:
         """Run all tasks."""
         await repeat(seconds=600)(clear_tokens)()
+        await repeat(seconds=600)(clear_jobs)()
 
 
 _F = Callable[[], Coroutine[Any, Any, None]]
@@ -65,3 +72,18 @@ async def clear_tokens() -> None:
         TokenService.from_session,
     )() as token_service:
         await token_service.clear()
+
+
+async def clear_jobs() -> None:
+    """Clear finished jobs after their retention and their unused images."""
+    image_storage = dependencies.get_storage()
+    # the blob references are released together with the jobs
+    async with base.get_session() as session:
+        job_service = JobService(session=session)
+        keys = await job_service.clear(
+            older_than=timedelta(seconds=settings.job_retention),
+        )
+        orphans = await ImageService(session=session).release(keys)
+    # the blobs are deleted once their release is committed
+    for key in orphans:
+        await image_storage.delete(key)
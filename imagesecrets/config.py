@@ -2,13 +2,26 @@
 from __future__ import annotations
 
 import os
-from typing import cast
+from pathlib import Path
+from typing import Any, Optional, cast
 
 import dotenv
 from fastapi_mail import ConnectionConfig, config
 from pydantic import BaseSettings, EmailStr, HttpUrl, PostgresDsn, validator
 
-from imagesecrets.constants import MESSAGE_DELIMITER, TEMPLATES
+from imagesecrets.constants import (
+    API_IMAGES,
+    DECODE_STORAGE,
+    MAX_IMAGE_PIXELS,
+    MESSAGE_DELIMITER,
+    PNG_COMPRESS_LEVEL,
+    PNG_FILTER,
+    TEMPLATES,
+    TILE_SIZE,
+)
+from imagesecrets.core.executor import KINDS
+from imagesecrets.core.storage import BACKENDS
+from imagesecrets.core.util.png import FILTERS
 
 dotenv.load_dotenv()
 
@@ -35,6 +48,61 @@ class Settings(BaseSettings):
 
     message_delimiter: str = MESSAGE_DELIMITER
 
+    # uploaded images with more pixels are rejected
+    max_image_pixels: int = MAX_IMAGE_PIXELS
+
+    # threads used to process a single image
+    image_workers: int = 1
+    image_tile_size: int = TILE_SIZE
+
+    # compression of the encoded images
+    png_compress_level: int = PNG_COMPRESS_LEVEL
+    png_filter: str = PNG_FILTER
+
+    # default persistence of decoded images, one of 'DECODE_STORAGE'
+    decode_storage: str = "original"
+
+    # where saved images are stored, one of 'BACKENDS'
+    storage_backend: str = "local"
+    storage_dir: Path = API_IMAGES
+    storage_workers: int = 4
+    # S3-compatible object store, required by the s3 backend
+    s3_endpoint: Optional[str] = None
+    s3_bucket: Optional[str] = None
+    s3_access_key: Optional[str] = None
+    s3_secret_key: Optional[str] = None
+    s3_region: str = "us-east-1"
+
+    # results of decoding kept in memory and optionally on disk,
+    # 0 bytes disable the memory tier
+    decode_cache_bytes: int = 16 * 2 ** 20
+    decode_cache_dir: Optional[Path] = None
+    decode_cache_dir_bytes: int = 256 * 2 ** 20
+
+    # pool which runs encoding and decoding outside of the event loop
+    executor: str = "thread"
+    executor_workers: Optional[int] = None
+    executor_queue_size: int = 8
+
+    # cost (width * height * lsb) of the encodings and decodings running
+    # at the same time, requests over the budget wait up to the given
+    # number of seconds and are rejected once the waiting queue is full
+    admission_budget: int = 4 * 8 * MAX_IMAGE_PIXELS
+    admission_user_budget: int = 8 * MAX_IMAGE_PIXELS
+    admission_max_wait: float = 10.0
+    admission_queue_size: int = 32
+
+    # background jobs, running jobs are claimed again after the timeout
+    # and finished jobs are deleted after the retention, both in seconds
+    job_timeout: int = 600
+    job_max_attempts: int = 3
+    job_retention: int = 24 * 60 * 60
+    job_poll_interval: float = 1.0
+    # jobs run at the same time by a single worker process
+    job_concurrency: int = 1
+    # longest time a status request waits for a job to finish
+    job_max_wait: int = 30
+
     pg_dsn: PostgresDsn = cast(PostgresDsn, os.environ["DATABASE_URL"])
     secret_key: str = cast(str, os.environ["SECRET_KEY"])
 
@@ -47,6 +115,126 @@ class Settings(BaseSettings):
     def postgres_engine(cls, v: str) -> str:
         return asyncpg_engine_dsn(db_url=v)
 
+    @validator("executor", allow_reuse=True)
+    def executor_kind(cls, v: str) -> str:
+        if v not in KINDS:
+            raise ValueError(f"executor must be one of {KINDS!r}")
+        return v
+
+    @validator("max_image_pixels", allow_reuse=True)
+    def positive_pixels(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError("at least one pixel must be allowed")
+        return v
+
+    @validator("image_workers", allow_reuse=True)
+    def positive_workers(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError("at least one worker is required")
+        return v
+
+    @validator("image_tile_size", allow_reuse=True)
+    def whole_tiles(cls, v: int) -> int:
+        if v <= 0 or v % 8:
+            raise ValueError("tile size must be a positive multiple of 8")
+        return v
+
+    @validator("png_compress_level", allow_reuse=True)
+    def compress_level(cls, v: int) -> int:
+        if not 0 <= v <= 9:
+            raise ValueError("compression level must be between 0 and 9")
+        return v
+
+    @validator("png_filter", allow_reuse=True)
+    def png_filter_type(cls, v: str) -> str:
+        if v not in FILTERS:
+            raise ValueError(f"png filter must be one of {FILTERS!r}")
+        return v
+
+    @validator("decode_storage", allow_reuse=True)
+    def storage_mode(cls, v: str) -> str:
+        if v not in DECODE_STORAGE:
+            raise ValueError(
+                f"decode storage must be one of {DECODE_STORAGE!r}"
+            )
+        return v
+
+    @validator("storage_backend", allow_reuse=True)
+    def storage_kind(cls, v: str) -> str:
+        if v not in BACKENDS:
+            raise ValueError(f"storage backend must be one of {BACKENDS!r}")
+        return v
+
+    @validator("storage_workers", allow_reuse=True)
+    def storage_threads(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError("at least one storage worker is required")
+        return v
+
+    @validator(
+        "decode_cache_bytes", "decode_cache_dir_bytes", allow_reuse=True
+    )
+    def cache_size(cls, v: int) -> int:
+        if v < 0:
+            raise ValueError("cache size can not be negative")
+        return v
+
+    @validator(
+        "admission_budget",
+        "admission_user_budget",
+        allow_reuse=True,
+    )
+    def positive_budget(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError("admission budget must be positive")
+        return v
+
+    @validator(
+        "admission_max_wait",
+        "admission_queue_size",
+        allow_reuse=True,
+    )
+    def admission_queue(cls, v: float) -> float:
+        if v < 0:
+            raise ValueError("admission queue can not be negative")
+        return v
+
+    @validator(
+        "job_timeout",
+        "job_max_attempts",
+        "job_retention",
+        "job_poll_interval",
+        "job_concurrency",
+        allow_reuse=True,
+    )
+    def positive_job_setting(cls, v: float) -> float:
+        if v <= 0:
+            raise ValueError("job settings must be positive")
+        return v
+
+    @validator("job_max_wait", allow_reuse=True)
+    def job_wait(cls, v: int) -> int:
+        if v < 0:
+            raise ValueError("job wait can not be negative")
+        return v
+
+    @validator(
+        "s3_endpoint",
+        "s3_bucket",
+        "s3_access_key",
+        "s3_secret_key",
+        always=True,
+        allow_reuse=True,
+    )
+    def s3_required(
+        cls,
+        v: Optional[str],
+        values: dict[str, Any],
+    ) -> Optional[str]:
+        if values.get("storage_backend") == "s3" and not v:
+            raise ValueError("the s3 storage backend requires this setting")
+        return v
+
     @staticmethod
     def email_config() -> ConnectionConfig:
         """Return email connection configuration."""
@@ -14,6 +14,24 @@ ICON = _parent / "static/favicon.ico"
 TEMPLATES = _parent / "templates"
 
 MESSAGE_DELIMITER = "<{~stop-here~}>"
+# number of pixel values decoded at once, must be divisible by 8
+DECODE_CHUNK_SIZE = 2 ** 20
+# minimal number of pixel values decoded when probing for a message
+PROBE_SIZE = 2 ** 16
+# number of pixel values processed by one thread at once, must be divisible by 8
+TILE_SIZE = 2 ** 22
+# images with more pixels are rejected before they are decompressed
+MAX_IMAGE_PIXELS = 2 ** 26
+# number of uncompressed bytes of a PNG image compressed by one thread at once
+PNG_BLOCK_SIZE = 2 ** 18
+PNG_COMPRESS_LEVEL = 6
+PNG_FILTER = "adaptive"
+# what is kept of decoded images: the uploaded file and a history record,
+# only the history record or nothing at all
+DECODE_STORAGE = ("original", "history", "ephemeral")
+# kinds of background jobs and the states they go through
+JOB_KINDS = ("encode", "decode")
+JOB_STATUSES = ("queued", "running", "done", "failed")
 
 API_IMAGES = _parent / "static/images"
 API_IMAGES.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,321 @@
+"""Admission control of encodings and decodings by their cost.
+
+Every request is charged the cost of its image, ``width * height * lsb``,
+against a global budget and against the budget of its user. Requests which
+do not fit wait in a queue of their user, the queues are served in turns,
+so a user with many large images can not starve the others. Requests which
+do not fit in time are rejected and should be retried later.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import math
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from typing import (
+        AsyncIterator,
+        Awaitable,
+        Callable,
+        Deque,
+        Hashable,
+        TypeVar,
+    )
+
+    _R = TypeVar("_R")
+
+
+class Rejected(Exception):
+    """Raised when a request can not be admitted in time."""
+
+    def __init__(self, retry_after: int, user: bool) -> None:
+        """Construct the class.
+
+        :param retry_after: Number of seconds after which to retry
+        :param user: Whether the budget of the user was exceeded,
+            otherwise the global budget was
+
+        """
+        super().__init__(retry_after, user)
+        self.retry_after = retry_after
+        self.user = user
+
+
+class Stats(NamedTuple):
+    """Admission statistics.
+
+    :param in_flight: Cost of the admitted requests which are running
+    :param users: Number of users with running requests
+    :param waiting: Number of requests waiting for admission
+    :param admitted: Number of admitted requests
+    :param rejected: Number of rejected requests
+
+    """
+
+    in_flight: int
+    users: int
+    waiting: int
+    admitted: int
+    rejected: int
+
+
+class Admission:
+    """Admits requests while their cost fits into the budgets."""
+
+    def __init__(
+        self,
+        budget: int,
+        user_budget: int,
+        max_wait: float = 0.0,
+        queue_size: int = 0,
+    ) -> None:
+        """Construct the class.
+
+        :param budget: Maximal cost of all running requests
+        :param user_budget: Maximal cost of running requests of a single user
+        :param max_wait: Number of seconds a request may wait for admission,
+            defaults to 0
+        :param queue_size: Number of requests which may wait for admission,
+            defaults to 0
+
+        """
+        self.budget = budget
+        self.user_budget = min(user_budget, budget)
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._users: dict[Hashable, int] = {}
+        # waiting costs of every user, the first user is served next
+        self._queues: OrderedDict[
+            Hashable,
+            Deque[tuple[int, asyncio.Future]],
+        ] = OrderedDict()
+        self._waiting = 0
+        # charges shared by the requests of a user with the same key,
+        # with the number of requests which hold them
+        self._shared: dict[tuple[Hashable, Hashable], list[Any]] = {}
+
+    @staticmethod
+    def cost(width: int, height: int, lsb_n: int) -> int:
+        """Return the cost of an image.
+
+        :param width: Width of the image in pixels
+        :param height: Height of the image in pixels
+        :param lsb_n: Number of least significant bits which are processed
+
+        """
+        return width * height * lsb_n
+
+    @property
+    def stats(self) -> Stats:
+        """Return the admission statistics."""
+        return Stats(
+            in_flight=self.in_flight,
+            users=len(self._users),
+            waiting=self._waiting,
+            admitted=self.admitted,
+            rejected=self.rejected,
+        )
+
+    def user_in_flight(self, user: Hashable) -> int:
+        """Return the cost of the running requests of a user.
+
+        :param user: Identifier of the user
+
+        """
+        return self._users.get(user, 0)
+
+    async def run(
+        self,
+        user: Hashable,
+        cost: int,
+        func: Callable[..., Awaitable[_R]],
+        /,
+        *args: Any,
+        **kwargs: Any,
+    ) -> _R:
+        """Return result of the coroutine function once it is admitted.
+
+        :param user: Identifier of the user
+        :param cost: Cost of the request
+        :param func: The coroutine function to call
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+
+        :raises Rejected: if the request can not be admitted in time
+
+        """
+        charged = await self.acquire(user, cost)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self.release(user, charged)
+
+    @contextlib.asynccontextmanager
+    async def hold(
+        self,
+        user: Hashable,
+        cost: int,
+        key: Hashable,
+    ) -> AsyncIterator[None]:
+        """Hold the charged cost of a request while the block runs.
+
+        Requests of the same user with the same key, like a retried request
+        which joins its running computation, are charged only once.
+        The cost is released when the last of them leaves the block.
+
+        :param user: Identifier of the user
+        :param cost: Cost of the request
+        :param key: Identifier of the computation
+
+        :raises Rejected: if the request can not be admitted in time
+
+        """
+        shared = self._shared.get((user, key))
+        if shared is None:
+            charge = asyncio.ensure_future(self.acquire(user, cost))
+            shared = self._shared[user, key] = [charge, 0]
+        charge = shared[0]
+        shared[1] += 1
+        try:
+            # a cancelled request does not cancel the charge of the others
+            await asyncio.shield(charge)
+            yield
+        finally:
+            shared[1] -= 1
+            if not shared[1]:
+                del self._shared[user, key]
+                if not charge.done():
+                    charge.cancel()
+                elif not charge.cancelled() and charge.exception() is None:
+                    self.release(user, charge.result())
+
+    async def acquire(self, user: Hashable, cost: int) -> int:
+        """Wait until the cost fits into the budgets, charge and return it.
+
+        Requests which cost more than the budget of a user are charged
+        the whole budget, they run only when nothing else of the user does.
+
+        :param user: Identifier of the user
+        :param cost: Cost of the request
+
+        :raises Rejected: if the request can not be admitted in time
+
+        """
+        cost = min(cost, self.user_budget)
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append((cost, future))
+        self._waiting += 1
+        self._dispatch()
+
+        if not future.done() and self._waiting > self.queue_size:
+            self._withdraw(user, future)
+            raise self._reject(user, cost)
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self._withdraw(user, future)
+            raise self._reject(user, cost) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(user, cost)
+            else:
+                self._withdraw(user, future)
+            raise
+        return cost
+
+    def release(self, user: Hashable, cost: int) -> None:
+        """Return the charged cost of a finished request.
+
+        :param user: Identifier of the user
+        :param cost: The charged cost
+
+        """
+        self.in_flight -= cost
+        self._users[user] -= cost
+        if not self._users[user]:
+            del self._users[user]
+        self._dispatch()
+
+    def _fits(self, user: Hashable, cost: int) -> bool:
+        """Return whether the cost fits into the budgets.
+
+        :param user: Identifier of the user
+        :param cost: Cost of the request
+
+        """
+        return (
+            self.in_flight + cost <= self.budget
+            and self.user_in_flight(user) + cost <= self.user_budget
+        )
+
+    def _dispatch(self) -> None:
+        """Admit the waiting requests which fit, one of every user in turn."""
+        changed = True
+        while changed:
+            changed = False
+            for user in list(self._queues):
+                queue = self._queues[user]
+                cost, future = queue[0]
+                if not future.done() and not self._fits(user, cost):
+                    continue
+
+                queue.popleft()
+                self._waiting -= 1
+                if queue:
+                    self._queues.move_to_end(user)
+                else:
+                    del self._queues[user]
+                changed = True
+                # the request was cancelled while it was waiting
+                if future.done():
+                    continue
+
+                self.in_flight += cost
+                self._users[user] = self.user_in_flight(user) + cost
+                self.admitted += 1
+                future.set_result(None)
+
+    def _withdraw(self, user: Hashable, future: asyncio.Future) -> None:
+        """Remove a request which is no longer waiting from the queue.
+
+        :param user: Identifier of the user
+        :param future: Future of the request
+
+        """
+        queue = self._queues.get(user, deque())
+        for item in queue:
+            if item[1] is future:
+                queue.remove(item)
+                self._waiting -= 1
+                break
+        if not queue:
+            self._queues.pop(user, None)
+        # the following request of the user may fit
+        self._dispatch()
+
+    def _reject(self, user: Hashable, cost: int) -> Rejected:
+        """Return exception of a rejected request.
+
+        :param user: Identifier of the user
+        :param cost: Cost of the request
+
+        """
+        self.rejected += 1
+        return Rejected(
+            retry_after=max(1, math.ceil(self.max_wait)),
+            user=self.user_in_flight(user) + cost > self.user_budget,
+        )
+
+
+__all__ = [
+    "Admission",
+    "Rejected",
+    "Stats",
+]
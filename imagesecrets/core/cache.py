@@ -0,0 +1,277 @@
+"""Cache of decoding results.
+
+Results are keyed by a hash of the image data and of the decoding
+parameters, so an image which was already decoded is never decompressed
+and searched again. Both found messages and the reasons why no message
+was found are cached.
+
+Recent results are kept in memory, the memory tier is bounded by the size
+of the results in bytes and evicts the least recently used ones. An optional
+directory keeps the results on disk, it can be shared by several processes
+and survives restarts. The disk tier is bounded the same way, its least
+recently used results are found by their modification time.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, NamedTuple, Optional, Union
+
+from imagesecrets.core.decode import Message
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+# cached result, either the decoded message or why none was found
+Result = Union[Message, str]
+
+
+class Stats(NamedTuple):
+    """Counters of a result cache.
+
+    :param hits: Number of results found in memory
+    :param disk_hits: Number of results found only on disk
+    :param misses: Number of results which were not cached
+    :param entries: Number of results in memory
+    :param size: Size of the results in memory in bytes
+    :param disk_size: Size of the results on disk in bytes
+
+    """
+
+    hits: int
+    disk_hits: int
+    misses: int
+    entries: int
+    size: int
+    disk_size: int = 0
+
+
+class ResultCache:
+    """Cache of decoding results with a memory and an optional disk tier."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        directory: Optional[Path] = None,
+        max_disk_bytes: int = 256 * 2 ** 20,
+    ) -> None:
+        """Construct the class.
+
+        :param max_bytes: Maximal size of the results kept in memory,
+            0 keeps nothing in memory
+        :param directory: Directory of the disk tier, it is created if
+            it does not exist, defaults to None (no disk tier)
+        :param max_disk_bytes: Maximal size of the results kept on disk,
+            defaults to 256 MiB
+
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        # results in memory with their size, the oldest one first
+        self._entries: OrderedDict[str, tuple[Result, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            # results written by previous processes count as well
+            self._disk_size = sum(size for _, _, size in self._files())
+
+    @staticmethod
+    def key(
+        digest: str,
+        delimiter: str,
+        lsb_n: Optional[int],
+        reverse: Optional[bool],
+    ) -> str:
+        """Return key of the result of decoding with the given parameters.
+
+        :param digest: Hex digest of the image data
+        :param delimiter: Message end identifier
+        :param lsb_n: Number of least significant bits, None if detected
+        :param reverse: Reverse decoding bool, None if detected
+
+        """
+        params = json.dumps([digest, delimiter, lsb_n, reverse])
+        return hashlib.sha256(params.encode()).hexdigest()
+
+    @property
+    def stats(self) -> Stats:
+        """Return the current counters."""
+        with self._lock:
+            return Stats(
+                hits=self.hits,
+                disk_hits=self.disk_hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                size=self._size,
+                disk_size=self._disk_size,
+            )
+
+    async def get(self, key: str) -> Optional[Result]:
+        """Return the cached result or None if there is none.
+
+        Only the disk tier is read outside of the event loop,
+        results in memory are returned right away.
+
+        :param key: Key of the result
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.directory is not None:
+            data = await asyncio.to_thread(self._read, key)
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                result = loads(data)
+                self._remember(key, result, len(data))
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, result: Result) -> None:
+        """Cache the result.
+
+        :param key: Key of the result
+        :param result: The decoded message or why none was found
+
+        """
+        data = dumps(result)
+        self._remember(key, result, len(data))
+        if self.directory is not None:
+            await asyncio.to_thread(self._write, key, data)
+
+    def clear(self) -> None:
+        """Remove all results from memory and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.disk_hits = self.misses = 0
+
+    def _remember(self, key: str, result: Result, size: int) -> None:
+        """Keep the result in memory, evicting the least recently used ones.
+
+        :param key: Key of the result
+        :param result: The result
+        :param size: Size of the serialized result
+
+        """
+        size += len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (result, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def _read(self, key: str) -> Optional[bytes]:
+        """Return the serialized result from the disk tier."""
+        fp = self.directory / key  # type: ignore
+        try:
+            data = fp.read_bytes()
+            # the modification time orders the results by their last use
+            os.utime(fp)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write(self, key: str, data: bytes) -> None:
+        """Write the serialized result into the disk tier."""
+        if len(data) > self.max_disk_bytes:
+            return
+        fp = self.directory / key  # type: ignore
+        # other processes never read a partially written result
+        part = fp.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            part.write_bytes(data)
+            part.replace(fp)
+        finally:
+            part.unlink(missing_ok=True)
+
+        with self._disk_lock:
+            self._disk_size += len(data)
+            if self._disk_size > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _files(self) -> list[tuple[float, Path, int]]:
+        """Return modification time, path and size of the results on disk."""
+        files = []
+        for fp in self.directory.iterdir():  # type: ignore
+            if fp.name.startswith("."):
+                continue  # partially written result
+            try:
+                stat = fp.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            files.append((stat.st_mtime, fp, stat.st_size))
+        return files
+
+    def _evict_disk(self) -> None:
+        """Remove the least recently used results over the disk budget.
+
+        The size is counted again, the directory may be shared by other
+        processes and results may have been replaced.
+
+        """
+        files = sorted(self._files())
+        size = sum(file_size for _, _, file_size in files)
+        for _, fp, file_size in files:
+            if size <= self.max_disk_bytes:
+                break
+            fp.unlink(missing_ok=True)
+            size -= file_size
+        self._disk_size = size
+
+
+def dumps(result: Result) -> bytes:
+    """Serialize a result.
+
+    :param result: The decoded message or why none was found
+
+    """
+    if isinstance(result, str):
+        return json.dumps({"detail": result}).encode()
+    return json.dumps({"message": list(result)}).encode()
+
+
+def loads(data: bytes) -> Result:
+    """Deserialize a result.
+
+    :param data: The serialized result
+
+    """
+    obj = json.loads(data)
+    if "detail" in obj:
+        detail: str = obj["detail"]
+        return detail
+    return Message(*obj["message"])
+
+
+__all__ = [
+    "Result",
+    "ResultCache",
+    "Stats",
+]
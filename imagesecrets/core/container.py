@@ -0,0 +1,118 @@
+"""Self-describing container format for encoded messages.
+
+The container starts with a fixed size header stored in the first pixel
+values with a single least significant bit, so it can be read without knowing
+how the rest of the message was encoded. The header is followed by the
+UTF-8 encoded message itself.
+
+"""
+from __future__ import annotations
+
+import math
+import struct
+import zlib
+from typing import NamedTuple
+
+MAGIC = b"ISEC"
+VERSION = 1
+
+# no flags are defined in the current version
+KNOWN_FLAGS = 0
+
+HEADER_LSB = 1
+
+_STRUCT = struct.Struct(">4sBBBII")
+HEADER_SIZE = _STRUCT.size
+HEADER_PIXELS = HEADER_SIZE * 8 // HEADER_LSB
+
+
+class Header(NamedTuple):
+    """Header of the message container.
+
+    :param version: Version of the container format
+    :param lsb_n: Number of least significant bits used for the message
+    :param flags: Bit flags with additional information about the message
+    :param length: Length of the encoded message in bytes
+    :param crc: CRC32 checksum of the encoded message
+
+    """
+
+    version: int
+    lsb_n: int
+    flags: int
+    length: int
+    crc: int
+
+    @classmethod
+    def create(cls, data: bytes, lsb_n: int, flags: int = 0) -> Header:
+        """Return a new header describing the given message data.
+
+        :param data: The encoded message
+        :param lsb_n: Number of least significant bits used for the message
+        :param flags: Bit flags, defaults to 0
+
+        """
+        return cls(
+            version=VERSION,
+            lsb_n=lsb_n,
+            flags=flags,
+            length=len(data),
+            crc=zlib.crc32(data),
+        )
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Header:
+        """Return a header parsed from its binary representation.
+
+        :param data: At least ``HEADER_SIZE`` bytes with the header
+
+        :raises ValueError: if the data do not contain a supported header
+
+        """
+        try:
+            magic, *fields = _STRUCT.unpack(data[:HEADER_SIZE])
+        except struct.error as e:
+            raise ValueError("not enough data for a message header") from e
+        if magic != MAGIC:
+            raise ValueError("invalid message header magic")
+
+        header = cls(*fields)
+        if header.version != VERSION:
+            raise ValueError(
+                f"unsupported message header version {header.version!r}",
+            )
+        if not 1 <= header.lsb_n <= 8:
+            raise ValueError(
+                f"invalid message header lsb amount {header.lsb_n!r}",
+            )
+        if header.flags & ~KNOWN_FLAGS:
+            raise ValueError(
+                f"unsupported message header flags {header.flags!r}",
+            )
+        return header
+
+    def pack(self) -> bytes:
+        """Return binary representation of the header."""
+        return _STRUCT.pack(MAGIC, *self)
+
+    def payload_pixels(self) -> int:
+        """Return the number of pixel values which hold the message."""
+        return math.ceil(self.length * 8 / self.lsb_n)
+
+    def verify(self, data: bytes) -> None:
+        """Verify that the given message data match the header.
+
+        :param data: The decoded message
+
+        :raises ValueError: if the length or the checksum does not match
+
+        """
+        if len(data) != self.length or zlib.crc32(data) != self.crc:
+            raise ValueError("message does not match its header checksum")
+
+
+__all__ = [
+    "HEADER_PIXELS",
+    "HEADER_SIZE",
+    "Header",
+]
@@ -1,67 +1,310 @@
 """Module with functions to decode text from images."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import math
+from typing import TYPE_CHECKING, NamedTuple, Optional
 
 import numpy as np
 
-from imagesecrets.constants import API_IMAGES, MESSAGE_DELIMITER
-from imagesecrets.core.util import image
+from imagesecrets.constants import (
+    DECODE_CHUNK_SIZE,
+    MESSAGE_DELIMITER,
+    PROBE_SIZE,
+    TILE_SIZE,
+)
+from imagesecrets.core import progress as progress_
+from imagesecrets.core.container import HEADER_LSB, HEADER_PIXELS, Header
+from imagesecrets.core.util import array as array_util
+from imagesecrets.core.util import image, parallel
 
 if TYPE_CHECKING:
-    from pathlib import Path
+    from typing import Callable, Iterable, Iterator, Union
 
-    from numpy.typing import ArrayLike
+    from imagesecrets.core.progress import Report
+    from imagesecrets.core.util.buffer import Buffer
+
+# number of bytes checked when guessing whether the bits hold text
+TEXT_SAMPLE_SIZE = 64
+
+
+class Message(NamedTuple):
+    """Decoded message together with the parameters used to encode it.
+
+    :param text: The decoded message
+    :param lsb_n: Number of least significant bits used for the message
+    :param reverse: Whether the message was encoded in reverse
+
+    """
+
+    text: str
+    lsb_n: int
+    reverse: bool
+
+
+class Probe(NamedTuple):
+    """Result of a quick check for a message at the beginning of an image.
+
+    :param format: How the message was recognized, ``header`` and ``delimiter``
+        describe the message exactly, ``text`` means that the bits look like
+        text but the end of the message was not found, None if nothing was found
+    :param lsb_n: Likely number of least significant bits used for the message
+    :param length: Length of the message in bytes, None if unknown
+
+    """
+
+    format: Optional[str] = None
+    lsb_n: Optional[int] = None
+    length: Optional[int] = None
 
 
 def api(
-    image_data: bytes,
+    image_data: Buffer,
     delimiter: str,
-    lsb_n: int,
-    reverse: bool,
+    lsb_n: Optional[int],
+    reverse: Optional[bool],
     *,
-    image_dir: Path = API_IMAGES,
-) -> tuple[str, Path]:
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+    progress: Optional[Report] = None,
+) -> Message:
     """Function to be used by the corresponding decode API endpoint.
 
+    Storing the uploaded image is up to the caller.
+
     :param image_data: Data of the image uploaded by user
     :param delimiter: Message end identifier
-    :param lsb_n: Number of least significant bits to decode
-    :param reverse: Reverse decoding bool
-    :param image_dir: Directory where to save the image
+    :param lsb_n: Number of least significant bits to decode,
+        None to detect it
+    :param reverse: Reverse decoding bool, None to detect it
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+    :param progress: Called with the completed fraction of every stage,
+        defaults to None
+
+    """
+    data = image.read_bytes(image_data)
+    # pixel rows are decompressed only until the message is found
+    _, arr, load = image.lazy_data(data)
+    if progress is not None:
+        progress("header", 1.0)
+    return search(
+        arr,
+        delimiter,
+        lsb_n,
+        reverse,
+        workers=workers,
+        tile_size=tile_size,
+        load=load,
+        progress=progress,
+    )
+
+
+def probe(
+    image_data: Buffer,
+    delimiter: str = MESSAGE_DELIMITER,
+    *,
+    size: int = PROBE_SIZE,
+) -> Probe:
+    """Function to be used by the corresponding probe API endpoint.
+
+    Only the first rows of the image are decoded.
+
+    :param image_data: Data of the image uploaded by user
+    :param delimiter: Message end identifier, defaults to 'MESSAGE_DELIMITER'
+    :param size: Minimal number of pixel values to check,
+        defaults to 'PROBE_SIZE'
 
     """
     data = image.read_bytes(image_data)
-    _, arr = image.data(data)
-    text = main(arr, delimiter, lsb_n, reverse)
-    fp = image.save_array(arr, image_dir=image_dir)
-    return text, fp
+    shape, arr = image.head(data, size)
+    return probe_array(arr, delimiter, math.prod(shape))
 
 
 def main(
-    array: ArrayLike,
+    array: np.ndarray,
     delimiter: str = MESSAGE_DELIMITER,
-    lsb_n: int = 1,
-    reverse: bool = False,
+    lsb_n: Optional[int] = 1,
+    reverse: Optional[bool] = False,
+    *,
+    chunk_size: int = DECODE_CHUNK_SIZE,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+    load: Optional[Callable[[int], None]] = None,
+    progress: Optional[Report] = None,
 ) -> str:
     """Decode text from an image.
 
+    If the image starts with a container header, exactly the amount of pixels
+    described by it is decoded. Otherwise the pixels are processed in chunks
+    and decoding stops as soon as the delimiter is found, so the memory used
+    is bounded by the chunk size.
+
+    :param array: Numpy array with pixel image data
+    :param delimiter: Message end identifier, defaults to the one in .settings
+    :param lsb_n: Number of least significant bits to decode, defaults to 1,
+        None to try every amount
+    :param reverse: Reverse decoding bool, defaults to False,
+        None to try both directions
+    :param chunk_size: Number of pixel values to decode at once,
+        defaults to 'DECODE_CHUNK_SIZE'
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+    :param load: Function which makes sure that the given number of pixel
+        values at the beginning of the array is decoded,
+        defaults to None (the whole array is decoded)
+    :param progress: Called with the fraction of decoded pixel values,
+        defaults to None
+
+    :raises StopIteration: if nothing was found in the array
+
+    """
+    message = search(
+        array,
+        delimiter,
+        lsb_n,
+        reverse,
+        chunk_size=chunk_size,
+        workers=workers,
+        tile_size=tile_size,
+        load=load,
+        progress=progress,
+    )
+    return message.text
+
+
+def search(
+    array: np.ndarray,
+    delimiter: str = MESSAGE_DELIMITER,
+    lsb_n: Optional[int] = None,
+    reverse: Optional[bool] = None,
+    *,
+    chunk_size: int = DECODE_CHUNK_SIZE,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+    load: Optional[Callable[[int], None]] = None,
+    progress: Optional[Report] = None,
+) -> Message:
+    """Decode a message trying every given combination of parameters.
+
+    The image is decoded only once, all least significant bit amounts and
+    directions are then searched for the delimiter chunk by chunk from the
+    same array. The message which ends in the fewest pixels wins.
+
+    With more than one worker, the following chunks are decoded on other
+    threads while the current one is searched and the message itself
+    is decoded in tiles.
+
+    If the array is filled lazily, the chunks searched first are small
+    and grow up to the chunk size, so short messages at the beginning
+    of the image are found without decoding the rest of it.
+
     :param array: Numpy array with pixel image data
     :param delimiter: Message end identifier, defaults to the one in .settings
-    :param lsb_n: Number of least significant bits to decode, defaults to 1
-    :param reverse: Reverse decoding bool, defaults to False
+    :param lsb_n: Number of least significant bits to decode,
+        defaults to None (try every amount)
+    :param reverse: Reverse decoding bool, defaults to None (try both)
+    :param chunk_size: Number of pixel values to decode at once,
+        defaults to 'DECODE_CHUNK_SIZE'
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+    :param load: Function which makes sure that the given number of pixel
+        values at the beginning of the array is decoded,
+        defaults to None (the whole array is decoded)
+    :param progress: Called with the fraction of decoded pixel values,
+        defaults to None
+
+    :raises StopIteration: if nothing was found in the array
 
     """
-    arr = prepare_array(array, lsb_n, reverse)
-    return decode_text(arr, delimiter)
+    arr = array_util.low_bytes(array).reshape(-1)
+    if progress is not None:
+        load = progress_.loading(load, arr.size, progress)
+    directions = (False, True) if reverse is None else (reverse,)
+    views = {
+        direction: arr[::-1] if direction else arr for direction in directions
+    }
+    if load is not None and any(directions):
+        load(arr.size)  # reversed messages start at the end of the image
+
+    for direction, view in views.items():
+        if load is not None:
+            load(HEADER_PIXELS)
+        try:
+            header = read_header(view)
+        except ValueError:
+            continue  # no header, the message ends with the delimiter
+        if load is not None:
+            load(HEADER_PIXELS + header.payload_pixels())
+        text = decode_container(
+            view,
+            header,
+            workers=workers,
+            tile_size=tile_size,
+        )
+        return Message(text=text, lsb_n=header.lsb_n, reverse=direction)
+
+    delim = delimiter.encode("utf-8")
+    candidates = [
+        (amount, direction)
+        for direction in directions
+        for amount in (range(1, 9) if lsb_n is None else (lsb_n,))
+    ]
+    scans = [
+        scan_delimiter(
+            iter_chunks(
+                views[direction],
+                amount,
+                chunk_size,
+                workers=workers,
+                load=load,
+            ),
+            delim,
+        )
+        for amount, direction in candidates
+    ]
+
+    # all scans advance over the same pixels at once
+    for indexes in zip(*scans):
+        found = [
+            (math.ceil((index + len(delim)) * 8 / amount), amount, direction)
+            for (amount, direction), index in zip(candidates, indexes)
+            if index is not None
+        ]
+        if found:
+            pixels, amount, direction = min(found)
+            # only the pixels which contain the message are decoded again
+            message_arr = prepare_array(
+                views[direction][:pixels],
+                amount,
+                False,
+                workers=workers,
+                tile_size=tile_size,
+            )
+            text = decode_text(message_arr, delimiter)
+            return Message(text=text, lsb_n=amount, reverse=direction)
+
+    raise StopIteration("No message found after scanning the whole image.")
 
 
-def prepare_array(array: ArrayLike, lsb_n: int, reverse: bool) -> ArrayLike:
+def prepare_array(
+    array: np.ndarray,
+    lsb_n: int,
+    reverse: bool,
+    *,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+) -> np.ndarray:
     """Prepare an array into a form from which it is easy to decode text.
 
     :param array: The array to work with
     :param lsb_n: How many lsb to use
     :param reverse: Whether the array should be flipped or not
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
 
     """
     if not 1 <= lsb_n <= 8:
@@ -69,16 +312,18 @@ def prepare_array(array: ArrayLike, lsb_n: int, reverse: bool) -> ArrayLike:
             f"{lsb_n!r} is not a valid amount of least significant bits, must be within {range(1,9)!r}.",
         )
 
-    shape = (-1, 8)
-    if reverse:  # pragma: no cover
-        array = np.flip(array)
-    arr = np.unpackbits(array).reshape(shape)
-    # cut unnecessary bits and pack the rest
-    return_arr: ArrayLike = np.packbits(arr[:, -lsb_n:])
-    return return_arr
+    arr = array_util.low_bytes(array).reshape(-1)
+    if reverse:
+        arr = arr[::-1]
+    return parallel.extract_bytes(
+        arr,
+        lsb_n,
+        workers=workers,
+        tile_size=tile_size,
+    )
 
 
-def decode_text(array: ArrayLike, delimiter: str) -> str:
+def decode_text(array: np.ndarray, delimiter: str) -> str:
     """Decode text from the given array.
 
     :param array: The array from which to decode the text
@@ -87,13 +332,216 @@ def decode_text(array: ArrayLike, delimiter: str) -> str:
     :raises StopIteration: if nothing was found in the array
 
     """
-    text = ""
-    delim_len = len(delimiter)
-
-    # iterating is faster than vectorizing 'chr' on the whole array,
-    # many slow string operation are avoided
-    for num in array:  # type: ignore
-        text += chr(num)  # type: ignore
-        if text.endswith(delimiter):
-            return text[:-delim_len]
+    data = np.ascontiguousarray(array, dtype=np.uint8).tobytes()
+
+    # search for the encoded delimiter in the raw bytes,
+    # only the message itself needs to be decoded afterwards
+    index = data.find(delimiter.encode("utf-8"))
+    if index == -1:
+        raise StopIteration("No message found after scanning the whole image.")
+    return data[:index].decode("utf-8", errors="replace")
+
+
+def iter_chunks(
+    array: np.ndarray,
+    lsb_n: int,
+    chunk_size: int = DECODE_CHUNK_SIZE,
+    *,
+    workers: int = 1,
+    load: Optional[Callable[[int], None]] = None,
+) -> Iterator[np.ndarray]:
+    """Yield packed least significant bits of consecutive chunks of the array.
+
+    :param array: Flat array with pixel image data
+    :param lsb_n: How many lsb to use
+    :param chunk_size: Number of pixel values in one chunk,
+        defaults to 'DECODE_CHUNK_SIZE'
+    :param workers: Number of threads decoding the following chunks,
+        defaults to 1
+    :param load: Function which makes sure that the given number of pixel
+        values at the beginning of the array is decoded, defaults to None,
+        the chunks then start at 'PROBE_SIZE' and double up to the chunk size
+
+    :raises ValueError: if the chunk size is not divisible by 8
+
+    """
+    # every chunk must produce whole bytes so they can be joined together
+    if chunk_size <= 0 or chunk_size % 8:
+        raise ValueError(
+            f"{chunk_size!r} is not a valid chunk size, must be a positive multiple of 8.",
+        )
+
+    def bounds() -> Iterator[slice]:
+        # runs in this thread, so the lazy array is never filled concurrently
+        size = array.size
+        step = chunk_size if load is None else min(PROBE_SIZE, chunk_size)
+        start = 0
+        while start < size:
+            end = min(start + step, size)
+            if load is not None:
+                load(end)
+            yield slice(start, end)
+            start, step = end, min(step * 2, chunk_size)
+
+    def prepare(part: slice) -> np.ndarray:
+        return prepare_array(array[part], lsb_n, False)
+
+    yield from parallel.imap(prepare, bounds(), workers)
+
+
+def find_delimiter(chunks: Iterable[np.ndarray], delimiter: bytes) -> int:
+    """Return the index of the first byte of the delimiter in the chunks.
+
+    :param chunks: Arrays with consecutive packed bytes
+    :param delimiter: Encoded message end identifier
+
+    :raises StopIteration: if the delimiter is not in any of the chunks
+
+    """
+    for index in scan_delimiter(chunks, delimiter):
+        if index is not None:
+            return index
     raise StopIteration("No message found after scanning the whole image.")
+
+
+def scan_delimiter(
+    chunks: Iterable[np.ndarray],
+    delimiter: bytes,
+) -> Iterator[Union[int, None]]:
+    """Yield after every chunk the index of the delimiter if it was found.
+
+    None is yielded for every chunk without the delimiter,
+    the generator stops after the index is yielded.
+
+    :param chunks: Arrays with consecutive packed bytes
+    :param delimiter: Encoded message end identifier
+
+    """
+    overlap = len(delimiter) - 1
+    # bytes at the end of the previous chunk which could be
+    # the beginning of a delimiter split between two chunks
+    tail = b""
+    offset = 0
+
+    for chunk in chunks:
+        data = tail + np.ascontiguousarray(chunk, dtype=np.uint8).tobytes()
+        index = data.find(delimiter)
+        if index != -1:
+            yield offset + index
+            return
+        yield None
+
+        keep = min(overlap, len(data))
+        offset += len(data) - keep
+        tail = data[len(data) - keep :]
+
+
+def read_header(array: np.ndarray, size: Optional[int] = None) -> Header:
+    """Return the container header stored at the beginning of the array.
+
+    :param array: Flat array with pixel image data
+    :param size: Number of pixel values in the whole image,
+        defaults to None (size of the array)
+
+    :raises ValueError: if the array does not start with a valid header
+
+    """
+    data = array_util.extract_bytes(
+        array[:HEADER_PIXELS],
+        HEADER_LSB,
+    )
+    header = Header.unpack(data.tobytes())
+
+    if size is None:
+        size = array.size
+    if HEADER_PIXELS + header.payload_pixels() > size:
+        raise ValueError("message length in the header exceeds the image size")
+    return header
+
+
+def decode_container(
+    array: np.ndarray,
+    header: Header,
+    *,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+) -> str:
+    """Decode text described by the container header from the array.
+
+    :param array: Flat array with pixel image data
+    :param header: The header stored at the beginning of the array
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+
+    :raises StopIteration: if the message does not match the header checksum
+
+    """
+    payload = array[HEADER_PIXELS : HEADER_PIXELS + header.payload_pixels()]
+    data = parallel.extract_bytes(
+        payload,
+        header.lsb_n,
+        workers=workers,
+        tile_size=tile_size,
+    )[: header.length]
+
+    try:
+        header.verify(data.tobytes())
+    except ValueError as e:
+        raise StopIteration(
+            "The message header was found but the message is corrupted.",
+        ) from e
+    return data.tobytes().decode("utf-8", errors="replace")  # type: ignore
+
+
+def probe_array(
+    array: np.ndarray,
+    delimiter: str = MESSAGE_DELIMITER,
+    size: Optional[int] = None,
+) -> Probe:
+    """Check whether the beginning of an image holds a message.
+
+    :param array: Numpy array with pixel data of the beginning of the image
+    :param delimiter: Message end identifier, defaults to 'MESSAGE_DELIMITER'
+    :param size: Number of pixel values in the whole image,
+        defaults to None (size of the array)
+
+    """
+    arr = array_util.low_bytes(array).reshape(-1)
+
+    try:
+        header = read_header(arr, size)
+    except ValueError:
+        pass  # no header, the message might end with the delimiter
+    else:
+        return Probe(format="header", lsb_n=header.lsb_n, length=header.length)
+
+    delim = delimiter.encode("utf-8")
+    text = Probe()
+
+    for lsb_n in range(1, 9):
+        data = array_util.extract_bytes(arr, lsb_n).tobytes()
+        if (index := data.find(delim)) != -1:
+            return Probe(format="delimiter", lsb_n=lsb_n, length=index)
+        if text.format is None and text_like(data[:TEXT_SAMPLE_SIZE]):
+            text = Probe(format="text", lsb_n=lsb_n)
+
+    return text
+
+
+def text_like(data: bytes, threshold: float = 0.9) -> bool:
+    """Return whether the data look like UTF-8 encoded text.
+
+    :param data: The data to check
+    :param threshold: Minimal ratio of printable characters, defaults to 0.9
+
+    """
+    text = data.decode("utf-8", errors="replace")
+    if not text:
+        return False
+
+    printable = sum(
+        char != "\ufffd" and (char.isprintable() or char.isspace())
+        for char in text
+    )
+    return printable / len(text) >= threshold
@@ -1,103 +1,342 @@
 """Module with functions to encode text into images."""
 from __future__ import annotations
 
+import math
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, NamedTuple, Optional
 
 import numpy as np
 
-from imagesecrets.constants import API_IMAGES, MESSAGE_DELIMITER
-from imagesecrets.core.util import array, image
+from imagesecrets.constants import (
+    MESSAGE_DELIMITER,
+    PNG_COMPRESS_LEVEL,
+    PNG_FILTER,
+    TILE_SIZE,
+)
+from imagesecrets.core.container import HEADER_LSB, HEADER_PIXELS, Header
+from imagesecrets.core.util import array, image, parallel
 
 if TYPE_CHECKING:
     from typing import Union
 
     from _io import BytesIO
-    from numpy.typing import ArrayLike
+
+    from imagesecrets.core.progress import Report
+    from imagesecrets.core.util.buffer import Buffer, BufferIO
+
+# the container header stores the message length as an unsigned 32 bit integer
+MAX_HEADER_LENGTH = 2 ** 32 - 1
+
+
+class Capacity(NamedTuple):
+    """Number of message bytes which fit into an image.
+
+    :param shape: Shape of the pixel array of the image
+    :param sizes: Maximal message length in bytes for every number
+        of least significant bits
+    :param lsb_n: The smallest number of least significant bits which fits
+        the message, None if the message does not fit or no length was given
+
+    """
+
+    shape: tuple[int, int, int]
+    sizes: dict[int, int]
+    lsb_n: Optional[int] = None
 
 
 def api(
     message: str,
-    file: bytes,
+    file: Buffer,
     delimiter: str,
     lsb_n: int,
     reverse: bool,
+    header: bool = False,
     *,
-    image_dir: Path = API_IMAGES,
-) -> Path:
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+    level: int = PNG_COMPRESS_LEVEL,
+    filter_type: str = PNG_FILTER,
+    progress: Optional[Report] = None,
+) -> bytes:
     """Encode interface for the corresponding API endpoint.
 
+    The data of the final png image are returned, storing them is up to
+    the caller.
+
     :param message: Message to encode
     :param file: Data of the image uploaded by user
     :param delimiter: Message end identifier
     :param lsb_n: Number of least significant bits to use
     :param reverse: Reverse encoding bool
-    :param image_dir: Directory where to save the final image
+    :param header: Whether to store the message length in a header,
+        defaults to False
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+    :param level: zlib compression level of the final image,
+        defaults to 'PNG_COMPRESS_LEVEL'
+    :param filter_type: PNG row filter of the final image,
+        defaults to 'PNG_FILTER'
+    :param progress: Called with the completed fraction of every stage,
+        defaults to None
 
     """
-    data = image.read_bytes(file)
-    arr = main(message, data, delimiter, lsb_n, reverse)
-    return image.save_array(arr, image_dir=image_dir)
+    arr = array_api(
+        message,
+        file,
+        delimiter,
+        lsb_n,
+        reverse,
+        header,
+        workers=workers,
+        tile_size=tile_size,
+        progress=progress,
+    )
+    return b"".join(
+        image.encode_array(
+            arr,
+            level=level,
+            filter_type=filter_type,
+            workers=workers,
+            progress=progress,
+        ),
+    )
+
+
+def array_api(
+    message: str,
+    file: Buffer,
+    delimiter: str,
+    lsb_n: int,
+    reverse: bool,
+    header: bool = False,
+    *,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+    progress: Optional[Report] = None,
+) -> np.ndarray:
+    """Encode interface for API endpoints which compress the image themselves.
+
+    :param message: Message to encode
+    :param file: Data of the image uploaded by user
+    :param delimiter: Message end identifier
+    :param lsb_n: Number of least significant bits to use
+    :param reverse: Reverse encoding bool
+    :param header: Whether to store the message length in a header,
+        defaults to False
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+    :param progress: Called with the completed fraction of every stage,
+        defaults to None
+
+    """
+    return main(
+        message,
+        image.read_bytes(file),
+        delimiter,
+        lsb_n,
+        reverse,
+        header,
+        workers=workers,
+        tile_size=tile_size,
+        progress=progress,
+    )
 
 
 def main(
     message: str,
-    data: Union[BytesIO, Path],
+    data: Union[BytesIO, BufferIO, Path],
     delimiter: str = MESSAGE_DELIMITER,
     lsb_n: int = 1,
     reverse: bool = False,
-) -> ArrayLike:
+    header: bool = False,
+    *,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+    progress: Optional[Report] = None,
+) -> np.ndarray:
     """Main encoding interface.
 
+    The message is written directly into the decoded pixel data,
+    only the pixels which hold the message are modified.
+
     :param message: Message to encode
     :param data: Pixel image data which can be converted to numpy array by PIL
     :param delimiter: Message end identifier, defaults to 'MESSAGE_DELIMITER'
     :param lsb_n: Number of least significant bits to decode, defaults to 1
     :param reverse: Reverse decoding bool, defaults to False
+    :param header: Whether to store the message in a container with
+        a length header instead of appending the delimiter, defaults to False
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values processed by one thread at once,
+        defaults to 'TILE_SIZE'
+    :param progress: Called with the completed fraction of every stage,
+        defaults to None
 
     :raises ValueError: if the message is too long for the image
 
     """
-    msg_arr, msg_len = array.message_bit(message, delimiter, lsb_n)
-    shape, img_arr, unpacked_arr = prepare_image(data, msg_len)
+    # the capacity is known from the image header before any pixel is decoded
+    check_capacity(
+        math.prod(image.shape(data)),
+        len(message.encode("utf-8")),
+        delimiter,
+        lsb_n,
+        header,
+    )
+    if progress is not None:
+        progress("header", 1.0)
 
-    if (size := img_arr.size * lsb_n) < (msg_len := len(message)):  # type: ignore
-        raise ValueError(
-            f"The image size ({size:,.0f}) is not enough for the message ({msg_len:,.0f})",
+    payloads = prepare_payloads(message, delimiter, lsb_n, header)
+    _, img_arr = image.data(data)
+    flat = array.low_bytes(img_arr).reshape(-1)
+    if progress is not None:
+        progress("pixels", 1.0)
+
+    if reverse:
+        flat = flat[::-1]
+
+    total = sum(payload.size for payload, _ in payloads)
+    start = 0
+    for payload, bits in payloads:
+        parallel.embed_payload(
+            flat[start:],
+            payload,
+            bits,
+            workers=workers,
+            tile_size=tile_size,
         )
+        start += payload.size
+        if progress is not None:
+            progress("embed", start / total)
+
+    return img_arr
 
-    if reverse:  # pragma: no cover
-        msg_arr, img_arr = np.flip(msg_arr), np.flip(
-            img_arr,
-        )  # all axes get flipped
 
-    enc_arr = array.edit_column(
-        unpacked_arr,
-        msg_arr,
-        column_num=lsb_n,
-        start_from_end=True,
+def capacity(
+    data: Union[BytesIO, BufferIO, Path],
+    length: Optional[int] = None,
+    delimiter: str = MESSAGE_DELIMITER,
+    header: bool = False,
+) -> Capacity:
+    """Return how many message bytes fit into an image.
+
+    Only the image header is read, no pixels are decoded.
+
+    :param data: The image
+    :param length: Length of a message in bytes, defaults to None
+    :param delimiter: Message end identifier, defaults to 'MESSAGE_DELIMITER'
+    :param header: Whether the message is stored in a container with
+        a length header instead of appending the delimiter, defaults to False
+
+    """
+    shape = image.shape(data)
+    size = math.prod(shape)
+    sizes = {
+        lsb_n: max_length(size, lsb_n, delimiter, header)
+        for lsb_n in range(1, 9)
+    }
+    fitting = (
+        lsb_n
+        for lsb_n, max_ in sizes.items()
+        if length is not None and length <= max_
     )
-    final_arr = array.pack_and_concatenate(enc_arr, img_arr, shape)
+    return Capacity(shape=shape, sizes=sizes, lsb_n=next(fitting, None))
 
-    return final_arr if not reverse else np.flip(final_arr)
 
+def max_length(size: int, lsb_n: int, delimiter: str, header: bool) -> int:
+    """Return the maximal length of a message in bytes which fits into the pixels.
 
-def prepare_image(
-    data: BytesIO,
-    message_len: int,
-) -> tuple[tuple[int, int, int], ArrayLike, ArrayLike]:
-    """Prepare an image for encoding.
+    :param size: Number of pixel values
+    :param lsb_n: Number of least significant bits to use
+    :param delimiter: Message end identifier
+    :param header: Whether the message is stored in a container with
+        a length header instead of appending the delimiter
 
-    :param data: Pixel image data which can be converted to numpy array by PIL
-    :param message_len: Length of the message which will be encoded
+    """
+    if header:
+        length = (size - HEADER_PIXELS) * lsb_n // 8
+        return max(0, min(length, MAX_HEADER_LENGTH))
+    return max(0, size * lsb_n // 8 - len(delimiter.encode("utf-8")))
+
+
+def payload_pixels(
+    length: int,
+    delimiter: str,
+    lsb_n: int,
+    header: bool,
+) -> int:
+    """Return the number of pixel values which hold a message of the given length.
+
+    :param length: Length of the message in bytes
+    :param delimiter: Message end identifier
+    :param lsb_n: Number of least significant bits to use
+    :param header: Whether the message is stored in a container with
+        a length header instead of appending the delimiter
 
     """
-    shape, arr = image.data(data)
+    if header:
+        return HEADER_PIXELS + math.ceil(length * 8 / lsb_n)
+    return math.ceil((length + len(delimiter.encode("utf-8"))) * 8 / lsb_n)
 
-    arr = arr.ravel()  # type: ignore
-    unpacked_arr = np.unpackbits(
-        # unpack only needed ones, instead of millions
-        arr[:message_len],
-    )
 
-    return shape, arr[message_len:], unpacked_arr.reshape(-1, 8)
+def check_capacity(
+    size: int,
+    length: int,
+    delimiter: str,
+    lsb_n: int,
+    header: bool,
+) -> None:
+    """Check that a message of the given length fits into the pixels.
+
+    :param size: Number of pixel values
+    :param length: Length of the message in bytes
+    :param delimiter: Message end identifier
+    :param lsb_n: Number of least significant bits to use
+    :param header: Whether the message is stored in a container with
+        a length header instead of appending the delimiter
+
+    :raises ValueError: if the message is too long for the image
+
+    """
+    if length > max_length(size, lsb_n, delimiter, header):
+        msg_len = payload_pixels(length, delimiter, lsb_n, header)
+        raise ValueError(
+            f"The image size ({size:,.0f}) is not enough for the message ({msg_len:,.0f})",
+        )
+
+
+def prepare_payloads(
+    message: str,
+    delimiter: str,
+    lsb_n: int,
+    header: bool,
+) -> list[tuple[np.ndarray, int]]:
+    """Return consecutive payloads to embed with the amount of bits they use.
+
+    :param message: Message to encode
+    :param delimiter: Message end identifier
+    :param lsb_n: Number of least significant bits to use
+    :param header: Whether to prepend a container header instead of
+        appending the delimiter
+
+    """
+    if not header:
+        return [(array.message_payload(message, delimiter, lsb_n), lsb_n)]
+
+    byte_msg = message.encode("utf-8")
+    byte_header = Header.create(byte_msg, lsb_n).pack()
+    return [
+        (
+            array.split_bytes(
+                np.frombuffer(byte_header, dtype=np.uint8),
+                HEADER_LSB,
+            ),
+            HEADER_LSB,
+        ),
+        (
+            array.split_bytes(np.frombuffer(byte_msg, dtype=np.uint8), lsb_n),
+            lsb_n,
+        ),
+    ]
@@ -0,0 +1,429 @@
+"""Executor which runs blocking image processing outside of the event loop.
+
+Tasks run either on a thread pool or on a process pool. The number of tasks
+which are running or waiting for a worker is bounded, new tasks are refused
+right away once the limit is reached.
+
+Process workers receive large buffers through shared memory and return
+large results the same way, so the images are not pickled and sent
+through a pipe.
+Their progress events are sent back through a queue shared by the pool.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, cast
+
+import numpy as np
+
+from imagesecrets.core.progress import Progress
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor as _Executor
+    from concurrent.futures import Future
+    from multiprocessing.queues import Queue
+    from typing import Callable, TypeVar
+
+    _R = TypeVar("_R")
+
+KINDS = ("thread", "process")
+
+# smaller buffers are cheaper to pickle than to put into shared memory
+SHARED_MEMORY_MIN = 2 ** 16
+
+
+class QueueFull(Exception):
+    """Raised when the executor can not accept any more tasks."""
+
+
+class TaskStopped(Exception):
+    """Raised instead of StopIteration which can not be set on a future."""
+
+
+class SharedBytes(NamedTuple):
+    """Bytes stored in a shared memory block.
+
+    :param name: Name of the shared memory block
+    :param size: Number of bytes
+
+    """
+
+    name: str
+    size: int
+
+
+class SharedArray(NamedTuple):
+    """Numpy array stored in a shared memory block.
+
+    :param name: Name of the shared memory block
+    :param shape: Shape of the array
+    :param dtype: Data type of the array
+
+    """
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class ProgressRef(NamedTuple):
+    """Progress of a task which runs in a process worker.
+
+    :param key: Key of the progress in the executor
+
+    """
+
+    key: int
+
+
+# progress events of the tasks in a process worker, set by the initializer
+_events: Optional[Queue] = None
+
+
+class Executor:
+    """Bounded pool of workers for blocking functions."""
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        workers: Optional[int] = None,
+        queue_size: int = 8,
+    ) -> None:
+        """Construct the class.
+
+        :param kind: Either ``thread`` or ``process``, defaults to ``thread``
+        :param workers: Number of workers, defaults to None
+            (the same default as the standard library executors)
+        :param queue_size: Number of tasks which may wait for a worker,
+            defaults to 8
+
+        :raises ValueError: if the kind is not supported
+
+        """
+        if kind not in KINDS:
+            raise ValueError(
+                f"{kind!r} is not a valid executor kind, must be one of {KINDS!r}.",
+            )
+        if workers is None:
+            cpus = os.cpu_count() or 1
+            workers = cpus if kind == "process" else min(32, cpus + 4)
+
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self.pending = 0
+        self._pool: Optional[_Executor] = None
+
+        self._events: Optional[Queue] = None
+        self._progress: dict[int, Progress] = {}
+        self._keys = itertools.count()
+
+    @property
+    def limit(self) -> int:
+        """Return the maximal number of running and waiting tasks."""
+        return self.workers + self.queue_size
+
+    @property
+    def pool(self) -> _Executor:
+        """Return the underlying executor, it is created on the first use."""
+        if self._pool is None:
+            if self.kind == "process":
+                self._events = multiprocessing.Queue()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=init_worker,
+                    initargs=(self._events,),
+                )
+                threading.Thread(
+                    target=self._relay,
+                    args=(self._events,),
+                    daemon=True,
+                ).start()
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _relay(self, events: Queue) -> None:
+        """Pass progress events from the process workers to their tasks.
+
+        :param events: Queue of the events, None stops the relay
+
+        """
+        while (event := events.get()) is not None:
+            key, stage, fraction = event
+            if stage is None:
+                # the task has finished, all of its events were passed
+                del self._progress[key]
+            else:
+                self._progress[key](stage, fraction)
+
+    def _register(self, value: Any) -> Any:
+        """Return a reference to the value if it is a progress.
+
+        :param value: Argument of a task
+
+        """
+        if not isinstance(value, Progress):
+            return value
+        key = next(self._keys)
+        self._progress[key] = value
+        return ProgressRef(key)
+
+    async def run(
+        self, func: Callable[..., _R], /, *args: Any, **kwargs: Any
+    ) -> _R:
+        """Run the function in the pool and return its result.
+
+        :param func: The function to run, it must be picklable for process pools
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+
+        :raises QueueFull: if too many tasks are already running or waiting
+        :raises TaskStopped: if the function raised StopIteration
+
+        """
+        if self.pending >= self.limit:
+            raise QueueFull(f"{self.pending} tasks are already queued")
+
+        blocks: list[shared_memory.SharedMemory] = []
+        self.pending += 1
+        try:
+            if self.kind == "process":
+                args = tuple(
+                    share(self._register(arg), blocks) for arg in args
+                )
+                kwargs = {
+                    key: share(self._register(value), blocks)
+                    for key, value in kwargs.items()
+                }
+
+            future = self.pool.submit(
+                call,
+                func,
+                args,
+                kwargs,
+                shared=self.kind == "process",
+            )
+            try:
+                result = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # the shared result of the running task is never collected
+                future.add_done_callback(discard)
+                raise
+            return cast("_R", collect(result))
+        finally:
+            self.pending -= 1
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def shutdown(self) -> None:
+        """Shut the underlying executor down if it was created.
+
+        Queued tasks are cancelled. Process workers are waited for, so the
+        shared memory of their running tasks is released before exit.
+
+        """
+        if self._pool is not None:
+            self._pool.shutdown(
+                wait=self.kind == "process",
+                cancel_futures=True,
+            )
+            self._pool = None
+        if self._events is not None:
+            self._events.put(None)
+            self._events = None
+            self._progress.clear()
+
+
+def init_worker(events: Queue) -> None:
+    """Store the queue of progress events in a new process worker.
+
+    :param events: Queue of the progress events
+
+    """
+    global _events
+    _events = events
+
+
+def report(key: int, stage: Optional[str], fraction: float) -> None:
+    """Send a progress event from a process worker.
+
+    :param key: Key of the progress in the executor
+    :param stage: The reported stage, None once the task has finished
+    :param fraction: Completed fraction of the stage
+
+    """
+    if _events is not None:
+        _events.put((key, stage, fraction))
+
+
+def share(value: Any, blocks: list[shared_memory.SharedMemory]) -> Any:
+    """Return a reference to a copy of the value in shared memory.
+
+    Values which are not large buffers are returned unchanged.
+
+    :param value: The value to share
+    :param blocks: List into which the newly created block is appended
+
+    """
+    if isinstance(value, np.ndarray):
+        if value.nbytes < SHARED_MEMORY_MIN:
+            return value
+        block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        blocks.append(block)
+        shared: np.ndarray = np.ndarray(
+            value.shape,
+            dtype=value.dtype,
+            buffer=block.buf,
+        )
+        shared[...] = value
+        return SharedArray(block.name, value.shape, value.dtype.str)
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        size = memoryview(value).nbytes
+        if size < SHARED_MEMORY_MIN:
+            return bytes(value)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        blocks.append(block)
+        block.buf[:size] = memoryview(value).cast("B")
+        return SharedBytes(block.name, size)
+
+    return value
+
+
+def call(
+    func: Callable[..., _R],
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+    *,
+    shared: bool = False,
+) -> _R:
+    """Call the function with values from shared memory in a worker.
+
+    :param func: The function to call
+    :param args: Positional arguments, possibly stored in shared memory
+    :param kwargs: Keyword arguments, possibly stored in shared memory
+    :param shared: Whether a large result is returned in shared memory,
+        only results of process workers are, defaults to False
+
+    :raises TaskStopped: if the function raised StopIteration
+
+    """
+    blocks: list[shared_memory.SharedMemory] = []
+    refs = [
+        value
+        for value in (*args, *kwargs.values())
+        if isinstance(value, ProgressRef)
+    ]
+    try:
+        args = tuple(attach(arg, blocks) for arg in args)
+        kwargs = {key: attach(value, blocks) for key, value in kwargs.items()}
+        result = func(*args, **kwargs)
+        if not shared:
+            return result
+        # the result is copied before the views of the arguments are released
+        return cast("_R", share_result(result))
+    except BaseException as e:
+        # frames of the traceback would keep the views alive
+        traceback.clear_frames(e.__traceback__)  # type: ignore
+        if isinstance(e, StopIteration):
+            raise TaskStopped(*e.args) from None
+        raise
+    finally:
+        args, kwargs = (), {}
+        for block in blocks:
+            block.close()
+        # the events are queued in order, this one is passed as the last
+        for ref in refs:
+            report(ref.key, None, 1.0)
+
+
+def share_result(value: Any) -> Any:
+    """Return a reference to a copy of a result in shared memory.
+
+    The block is only closed in the worker, it is unlinked by the caller.
+
+    :param value: The result of a task
+
+    """
+    blocks: list[shared_memory.SharedMemory] = []
+    value = share(value, blocks)
+    for block in blocks:
+        block.close()
+    return value
+
+
+def attach(value: Any, blocks: list[shared_memory.SharedMemory]) -> Any:
+    """Return a read-only view of the value stored in shared memory.
+
+    The data are not copied, the view must not be used
+    once the block is closed.
+
+    :param value: Possibly a reference to shared memory or to a progress
+    :param blocks: List into which the attached block is appended
+
+    """
+    if isinstance(value, ProgressRef):
+        return functools.partial(report, value.key)
+    if not isinstance(value, (SharedBytes, SharedArray)):
+        return value
+
+    block = shared_memory.SharedMemory(name=value.name)
+    blocks.append(block)
+    if isinstance(value, SharedBytes):
+        return block.buf[: value.size].toreadonly()
+
+    arr: np.ndarray = np.ndarray(
+        value.shape,
+        dtype=value.dtype,
+        buffer=block.buf,
+    )
+    arr.flags.writeable = False
+    return arr
+
+
+def collect(value: Any) -> Any:
+    """Return a result stored in shared memory and unlink its block.
+
+    :param value: Result of a task, possibly a reference to shared memory
+
+    """
+    if not isinstance(value, (SharedBytes, SharedArray)):
+        return value
+
+    block = shared_memory.SharedMemory(name=value.name)
+    try:
+        if isinstance(value, SharedBytes):
+            return bytes(block.buf[: value.size])
+        shared: np.ndarray = np.ndarray(
+            value.shape,
+            dtype=value.dtype,
+            buffer=block.buf,
+        )
+        arr = shared.copy()
+        del shared
+        return arr
+    finally:
+        block.close()
+        block.unlink()
+
+
+def discard(future: Future) -> None:
+    """Unlink the shared result of a task which nobody awaits.
+
+    :param future: Future of the task
+
+    """
+    if not future.cancelled() and future.exception() is None:
+        collect(future.result())
@@ -0,0 +1,80 @@
+"""Coalescing of identical computations which run at the same time.
+
+Clients retry slow requests, so the same image is often processed by
+several requests at once. Calls with the same key share a single running
+computation instead of each one occupying a worker.
+
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable, Hashable, TypeVar
+
+    _R = TypeVar("_R")
+
+
+class SingleFlight:
+    """Runs at most one computation for every key at the same time."""
+
+    def __init__(self) -> None:
+        """Construct the class."""
+        self._flights: dict[Hashable, asyncio.Future] = {}
+        # number of calls which awaited an already running computation
+        self.joined = 0
+
+    def __len__(self) -> int:
+        """Return the number of running computations."""
+        return len(self._flights)
+
+    async def run(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[_R]],
+        /,
+        *args: Any,
+        **kwargs: Any,
+    ) -> _R:
+        """Return result of the coroutine function called with the arguments.
+
+        The function is not called if a computation with the same key
+        is already running, its result or exception is shared instead.
+
+        :param key: Identifier of the computation, calls with equal keys
+            must be interchangeable
+        :param func: The coroutine function to call
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(func(*args, **kwargs))
+            self._flights[key] = flight
+            flight.add_done_callback(
+                lambda done: self._land(key, done),
+            )
+        else:
+            self.joined += 1
+        # a cancelled caller does not cancel the computation of the others
+        return await asyncio.shield(flight)
+
+    def _land(self, key: Hashable, flight: asyncio.Future) -> None:
+        """Forget a finished computation.
+
+        :param key: Identifier of the computation
+        :param flight: The finished computation
+
+        """
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            # the exception is retrieved even if every caller was cancelled
+            flight.exception()
+
+
+__all__ = [
+    "SingleFlight",
+]
@@ -0,0 +1,129 @@
+"""Progress of long running encodings and decodings.
+
+The core functions accept an optional ``progress`` callback which is called
+with the name of a stage and the completed fraction of it. ``Progress``
+collects those calls from any thread, so they can be awaited on the event
+loop while the computation runs on a worker.
+
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from typing import AsyncIterator, Callable
+
+    Report = Callable[[str, float], None]
+
+# header parsed, pixels decoded, payload embedded, image compressed
+STAGES = ("header", "pixels", "embed", "compress")
+
+
+class Event(NamedTuple):
+    """Completed fraction of a stage.
+
+    :param stage: One of 'STAGES'
+    :param fraction: Completed fraction of the stage, between 0 and 1
+
+    """
+
+    stage: str
+    fraction: float
+
+
+class Progress:
+    """Latest progress of a computation, it may be reported from any thread."""
+
+    def __init__(self) -> None:
+        """Construct the class, it must be constructed on the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self.last: Optional[Event] = None
+        self.closed = False
+
+    def __call__(self, stage: str, fraction: float) -> None:
+        """Report the completed fraction of a stage.
+
+        :param stage: One of 'STAGES'
+        :param fraction: Completed fraction of the stage
+
+        """
+        event = Event(stage, round(min(max(fraction, 0.0), 1.0), 4))
+        self._loop.call_soon_threadsafe(self._update, event)
+
+    def _update(self, event: Event) -> None:
+        """Store the latest event and wake up the listeners.
+
+        :param event: The reported event
+
+        """
+        if self.closed or event == self.last:
+            return
+        self.last = event
+        self._notify()
+
+    def _notify(self) -> None:
+        """Wake up every listener."""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def close(self) -> None:
+        """Mark the computation as finished."""
+        self.closed = True
+        self._notify()
+
+    async def changes(self) -> AsyncIterator[Event]:
+        """Yield the latest event every time it changes until closed.
+
+        Events reported while the previous one is processed are coalesced,
+        only the latest one is yielded.
+
+        """
+        seen = None
+        while True:
+            changed = self._changed
+            if self.last is not None and self.last != seen:
+                seen = self.last
+                yield seen
+            if self.closed:
+                return
+            await changed.wait()
+
+
+def loading(
+    load: Optional[Callable[[int], None]],
+    size: int,
+    report: Report,
+) -> Optional[Callable[[int], None]]:
+    """Return function which loads pixel values and reports their fraction.
+
+    :param load: Function which makes sure that the given number of pixel
+        values is decoded, None if the whole array is already decoded
+    :param size: Number of all pixel values
+    :param report: The progress callback
+
+    """
+    if load is None:
+        report("pixels", 1.0)
+        return None
+    fill = load
+    loaded = 0
+
+    def wrapper(count: int) -> None:
+        nonlocal loaded
+        fill(count)
+        # values at the beginning of the array may be requested again
+        if count > loaded:
+            loaded = count
+            report("pixels", min(count, size) / size)
+
+    return wrapper
+
+
+__all__ = [
+    "Event",
+    "Progress",
+    "STAGES",
+    "loading",
+]
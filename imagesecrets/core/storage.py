@@ -0,0 +1,472 @@
+"""Asynchronous storage of saved images.
+
+Images are stored under keys, either in a local directory or in an
+S3-compatible object store, so several application nodes can share them.
+The blocking file and network calls run on a small thread pool,
+never on the event loop.
+
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import datetime
+import functools
+import hashlib
+import hmac
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+from urllib.parse import quote, urlsplit
+
+import requests
+
+from imagesecrets.core.util import buffer
+
+if TYPE_CHECKING:
+    from typing import IO, Callable, Mapping, TypeVar
+
+    from imagesecrets.core.util.buffer import Buffer
+
+    _R = TypeVar("_R")
+
+BACKENDS = ("local", "s3")
+
+# hash of an empty payload, used by requests without a body
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+class StorageError(Exception):
+    """Raised when the storage backend fails to process a request."""
+
+
+class Storage(abc.ABC):
+    """Base class of storage backends."""
+
+    def __init__(self, workers: int = 4) -> None:
+        """Construct the class.
+
+        :param workers: Number of threads running the blocking calls,
+            defaults to 4
+
+        """
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        """Return the thread pool, it is created on the first use."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="imagesecrets-storage",
+            )
+        return self._pool
+
+    async def _run(
+        self, func: Callable[..., _R], /, *args: Any, **kwargs: Any
+    ) -> _R:
+        """Run a blocking function on the thread pool.
+
+        :param func: The function to run
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool,
+            functools.partial(func, *args, **kwargs),
+        )
+
+    async def put(self, key: str, data: Buffer) -> None:
+        """Store the data under the key, replacing any previous data.
+
+        :param key: Name of the stored object
+        :param data: Data to store
+
+        """
+        await self._run(self._put, key, data)
+
+    async def get(self, key: str) -> bytes:
+        """Return the data stored under the key.
+
+        :param key: Name of the stored object
+
+        :raises FileNotFoundError: if nothing is stored under the key
+
+        """
+        return await self._run(self._get, key)
+
+    async def delete(self, key: str) -> None:
+        """Remove the data stored under the key, missing keys are ignored.
+
+        :param key: Name of the stored object
+
+        """
+        await self._run(self._delete, key)
+
+    async def exists(self, key: str) -> bool:
+        """Return whether any data are stored under the key.
+
+        :param key: Name of the stored object
+
+        """
+        return await self._run(self._exists, key)
+
+    def spool(self) -> Spool:
+        """Return a spool into which data are written piece by piece."""
+        return Spool(self)
+
+    def shutdown(self) -> None:
+        """Shut the thread pool down if it was created."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    @abc.abstractmethod
+    def _put(self, key: str, data: Buffer) -> None:
+        """Store the data, blocking version of ``put``."""
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> bytes:
+        """Return the data, blocking version of ``get``."""
+
+    @abc.abstractmethod
+    def _delete(self, key: str) -> None:
+        """Remove the data, blocking version of ``delete``."""
+
+    @abc.abstractmethod
+    def _exists(self, key: str) -> bool:
+        """Check the key, blocking version of ``exists``."""
+
+    def _spool_file(self) -> IO[bytes]:
+        """Return a new temporary file of a spool."""
+        return tempfile.TemporaryFile()
+
+    def _commit(self, file: IO[bytes], key: str) -> None:
+        """Store the data of a spool file under the key.
+
+        :param file: The spool file
+        :param key: Name of the stored object
+
+        """
+        file.flush()
+        file.seek(0)
+        self._put(key, buffer.map_file(file))
+
+    def _discard(self, file: IO[bytes]) -> None:
+        """Remove a spool file.
+
+        :param file: The spool file
+
+        """
+        file.close()
+
+
+class Spool:
+    """Data written piece by piece and stored once they are complete.
+
+    The pieces are written into a temporary file and hashed as they arrive,
+    so the whole data are never held in memory.
+
+    """
+
+    def __init__(self, storage: Storage) -> None:
+        """Construct the class.
+
+        :param storage: Storage in which the data are stored
+
+        """
+        self.storage = storage
+        self.size = 0
+        # set by the writer once all pieces were written
+        self.complete = False
+        self._hash = hashlib.sha256()
+        self._file = storage._spool_file()
+
+    @property
+    def digest(self) -> str:
+        """Return hex digest of the sha256 hash of the written data."""
+        return self._hash.hexdigest()
+
+    def write(self, data: Buffer) -> None:
+        """Append data to the spool, the call blocks.
+
+        :param data: The next piece of the data
+
+        """
+        self._hash.update(data)
+        self._file.write(data)  # type: ignore
+        self.size += memoryview(data).nbytes
+
+    async def commit(self, key: str) -> None:
+        """Store the written data under the key and remove the spool.
+
+        :param key: Name of the stored object
+
+        """
+        try:
+            await self.storage._run(self.storage._commit, self._file, key)
+        finally:
+            await self.discard()
+
+    async def discard(self) -> None:
+        """Remove the spool without storing its data."""
+        await self.storage._run(self.storage._discard, self._file)
+
+
+class LocalStorage(Storage):
+    """Storage in a directory of the local filesystem."""
+
+    def __init__(self, directory: Path, workers: int = 4) -> None:
+        """Construct the class.
+
+        :param directory: Directory with the stored files,
+            it is created if it does not exist
+        :param workers: Number of threads running the file operations,
+            defaults to 4
+
+        """
+        super().__init__(workers)
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        """Return path of the file with the given key.
+
+        :param key: Name of the stored object
+
+        :raises ValueError: if the key is not a plain file name
+
+        """
+        if not key or Path(key).name != key or key in (".", ".."):
+            raise ValueError(f"{key!r} is not a valid storage key")
+        return self.directory / key
+
+    def _put(self, key: str, data: Buffer) -> None:
+        fp = self.path(key)
+        # readers never see a partially written file
+        part = fp.with_name(f".{key}.part")
+        try:
+            part.write_bytes(data)  # type: ignore
+            part.replace(fp)
+        finally:
+            part.unlink(missing_ok=True)
+
+    def _get(self, key: str) -> bytes:
+        return self.path(key).read_bytes()
+
+    def _delete(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    def _exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def _spool_file(self) -> IO[bytes]:
+        # the file is renamed once complete, so it is never copied
+        return tempfile.NamedTemporaryFile(
+            dir=self.directory,
+            prefix=".",
+            suffix=".part",
+            delete=False,
+        )
+
+    def _commit(self, file: IO[bytes], key: str) -> None:
+        file.flush()
+        Path(file.name).replace(self.path(key))
+
+    def _discard(self, file: IO[bytes]) -> None:
+        file.close()
+        Path(file.name).unlink(missing_ok=True)
+
+
+class S3Storage(Storage):
+    """Storage in a bucket of an S3-compatible object store.
+
+    Requests use path style addressing and are signed
+    with AWS Signature Version 4, which is also accepted by MinIO.
+
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        workers: int = 4,
+        timeout: float = 30,
+    ) -> None:
+        """Construct the class.
+
+        :param endpoint: URL of the object store, such as ``http://minio:9000``
+        :param bucket: Name of an existing bucket
+        :param access_key: Access key id
+        :param secret_key: Secret access key
+        :param region: Region of the bucket, defaults to ``us-east-1``
+        :param workers: Number of threads sending the requests, defaults to 4
+        :param timeout: Timeout of a single request in seconds,
+            defaults to 30
+
+        """
+        super().__init__(workers)
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def url(self, key: str) -> str:
+        """Return URL of the object with the given key.
+
+        :param key: Name of the stored object
+
+        """
+        return f"{self.endpoint}/{quote(self.bucket)}/{quote(key, safe='')}"
+
+    def _request(
+        self,
+        method: str,
+        key: str,
+        data: Optional[Buffer] = None,
+    ) -> requests.Response:
+        """Send a signed request for the object with the given key.
+
+        :param method: HTTP method
+        :param key: Name of the object
+        :param data: Body of the request, defaults to None
+
+        :raises StorageError: if the object store can not be reached
+            or responds with an unexpected error
+
+        """
+        url = self.url(key)
+        payload = (
+            EMPTY_SHA256 if data is None else hashlib.sha256(data).hexdigest()
+        )
+        headers = sign(
+            method,
+            url,
+            {"x-amz-content-sha256": payload},
+            payload,
+            access_key=self.access_key,
+            secret_key=self.secret_key,
+            region=self.region,
+        )
+        try:
+            response = self._session.request(
+                method,
+                url,
+                # memory views are sent as a stream instead of being copied
+                data=None if data is None else buffer.stream(data),
+                headers=headers,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise StorageError(f"{method} {url} failed: {e}") from e
+        if response.status_code >= 300 and response.status_code != 404:
+            raise StorageError(
+                f"{method} {url} failed with status {response.status_code}",
+            )
+        return response
+
+    def _put(self, key: str, data: Buffer) -> None:
+        response = self._request("PUT", key, data)
+        if response.status_code == 404:
+            raise StorageError(f"bucket {self.bucket!r} does not exist")
+
+    def _get(self, key: str) -> bytes:
+        response = self._request("GET", key)
+        if response.status_code == 404:
+            raise FileNotFoundError(key)
+        content: bytes = response.content
+        return content
+
+    def _delete(self, key: str) -> None:
+        self._request("DELETE", key)
+
+    def _exists(self, key: str) -> bool:
+        status: int = self._request("HEAD", key).status_code
+        return status != 404
+
+
+def sign(
+    method: str,
+    url: str,
+    headers: Mapping[str, str],
+    payload: str,
+    *,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    service: str = "s3",
+    now: Optional[datetime.datetime] = None,
+) -> dict[str, str]:
+    """Return the headers of a request signed with AWS Signature Version 4.
+
+    :param method: HTTP method
+    :param url: URL of the request, the path must be already quoted
+    :param headers: Headers to sign, the host and date headers are added
+    :param payload: Hex encoded sha256 hash of the body
+    :param access_key: Access key id
+    :param secret_key: Secret access key
+    :param region: Region of the service
+    :param service: Name of the service, defaults to ``s3``
+    :param now: Time of the request, defaults to None (current time)
+
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    timestamp = now.strftime("%Y%m%dT%H%M%SZ")
+    date = timestamp[:8]
+    parts = urlsplit(url)
+
+    signed = {key.lower(): value.strip() for key, value in headers.items()}
+    signed["host"] = parts.netloc
+    signed["x-amz-date"] = timestamp
+    names = sorted(signed)
+    signed_headers = ";".join(names)
+
+    query = "&".join(
+        sorted(
+            part if "=" in part else f"{part}="
+            for part in parts.query.split("&")
+            if part
+        ),
+    )
+    canonical = "\n".join(
+        (
+            method,
+            parts.path or "/",
+            query,
+            "".join(f"{name}:{signed[name]}\n" for name in names),
+            signed_headers,
+            payload,
+        ),
+    )
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(
+        (
+            "AWS4-HMAC-SHA256",
+            timestamp,
+            scope,
+            hashlib.sha256(canonical.encode()).hexdigest(),
+        ),
+    )
+
+    key = f"AWS4{secret_key}".encode()
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(
+        key, string_to_sign.encode(), hashlib.sha256
+    ).hexdigest()
+
+    signed["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return signed
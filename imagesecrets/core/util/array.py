@@ -1,19 +1,148 @@
 """Utility functions for working with numpy arrays."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import math
+import sys
+from typing import NamedTuple
 
 import numpy as np
 
-if TYPE_CHECKING:
-    from numpy.typing import ArrayLike
+
+class LSBTable(NamedTuple):
+    """Precomputed shifts between the least significant bits of 8 pixel values and bytes.
+
+    8 pixel values hold exactly ``bits`` bytes, every item of ``shifts`` describes
+    one overlap of a pixel value with a byte of such group.
+
+    :param bits: Amount of bits per pixel
+    :param mask: Mask of the least significant bits
+    :param shifts: Tuples of byte index, pixel index and left shift
+        which moves the pixel bits into their place in the byte
+
+    """
+
+    bits: int
+    mask: np.uint8
+    shifts: tuple[tuple[int, int, int], ...]
+
+
+def lsb_table(bits: int) -> LSBTable:
+    """Return a new table for the given amount of bits.
+
+    :param bits: Amount of bits per pixel
+
+    """
+    shifts = []
+    for byte in range(bits):
+        for pixel in range(8):
+            start, end = pixel * bits, (pixel + 1) * bits
+            if end > byte * 8 and start < (byte + 1) * 8:
+                shifts.append((byte, pixel, (byte + 1) * 8 - end))
+
+    return LSBTable(
+        bits=bits,
+        mask=np.uint8((1 << bits) - 1),
+        shifts=tuple(shifts),
+    )
+
+
+LSB_TABLES: dict[int, LSBTable] = {
+    bits: lsb_table(bits) for bits in range(1, 9)
+}
+
+
+def extract_bytes(pixels: np.ndarray, bits: int) -> np.ndarray:
+    """Return the least significant bits of the pixel values grouped into bytes.
+
+    The last byte is padded with zeros.
+
+    :param pixels: Array with pixel values
+    :param bits: Amount of bits per pixel
+
+    """
+    table = LSB_TABLES[bits]
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1)
+    size = math.ceil(pixels.size * bits / 8)
+
+    if bits == 8:
+        return pixels.copy()
+
+    # reversed views are processed in the order of their memory with
+    # mirrored pixel groups, numpy is much slower on decreasing addresses
+    reverse = pixels.strides[0] < 0
+    if reverse:
+        pixels = pixels[::-1]
+    elif bits == 1:
+        packed: np.ndarray = np.packbits(pixels & table.mask)
+        return packed
+
+    # the padding of the reversed view is at the beginning of the memory
+    pad = -pixels.size % 8
+    values = np.zeros(pixels.size + pad, dtype=np.uint8)
+    np.bitwise_and(
+        pixels,
+        table.mask,
+        out=values[pad:] if reverse else values[: pixels.size],
+    )
+    if bits == 1:
+        return np.packbits(values, bitorder="little")[::-1].copy()  # type: ignore
+
+    groups = values.reshape(-1, 8)
+    result = np.zeros((groups.shape[0], bits), dtype=np.uint8)
+    shifted = np.empty(groups.shape[0], dtype=np.uint8)
+    for byte, pixel, shift in table.shifts:
+        column = groups[:, 7 - pixel if reverse else pixel]
+        if shift >= 0:
+            np.left_shift(column, shift, out=shifted)
+        else:
+            np.right_shift(column, -shift, out=shifted)
+        np.bitwise_or(result[:, byte], shifted, out=result[:, byte])
+
+    if reverse:
+        result = result[::-1]
+    return result.reshape(-1)[:size]  # type: ignore
+
+
+def split_bytes(data: np.ndarray, bits: int) -> np.ndarray:
+    """Return bytes split into values of the given amount of bits.
+
+    The last value is padded with zeros.
+
+    :param data: Array with bytes to split
+    :param bits: Amount of bits per pixel
+
+    """
+    table = LSB_TABLES[bits]
+    data = np.asarray(data, dtype=np.uint8).reshape(-1)
+    length = math.ceil(data.size * 8 / bits)
+
+    if bits == 8:
+        return data.copy()
+    if bits == 1:
+        unpacked: np.ndarray = np.unpackbits(data)
+        return unpacked
+
+    groups = np.zeros((math.ceil(data.size / bits), bits), dtype=np.uint8)
+    groups.reshape(-1)[: data.size] = data
+
+    values = np.zeros((groups.shape[0], 8), dtype=np.uint8)
+    shifted = np.empty(groups.shape[0], dtype=np.uint8)
+    for byte, pixel, shift in table.shifts:
+        if shift >= 0:
+            np.right_shift(groups[:, byte], shift, out=shifted)
+        else:
+            np.left_shift(groups[:, byte], -shift, out=shifted)
+        np.bitwise_or(values[:, pixel], shifted, out=values[:, pixel])
+    values &= table.mask
+
+    return values.reshape(-1)[:length]  # type: ignore
 
 
 def message_bit(
     message: str,
     delimiter: str,
     bits: int,
-) -> tuple[ArrayLike, int]:
+) -> tuple[np.ndarray, int]:
     """Return a message turned into bits in an array.
 
     :param message: Main message to encode
@@ -34,40 +163,58 @@ def message_bit(
     return lsbits_arr, msg_len
 
 
-def edit_column(
-    base: ArrayLike,
-    new: ArrayLike,
-    column_num: int,
-    start_from_end: bool = False,
-) -> ArrayLike:
-    """Replace elements in base array with a new array.
+def message_payload(
+    message: str,
+    delimiter: str,
+    bits: int,
+) -> np.ndarray:
+    """Return a message split into values which fit into the given amount of bits.
+
+    Every value is meant to be put into the least significant bits of one
+    pixel value, the last one is padded with zeros.
+
+    :param message: Main message to encode
+    :param delimiter: Message end identifier
+    :param bits: Amount of bits per pixel
 
-    :param base: Main array to edit
-    :param new: New data to put into the main array
-    :param column_num: Number of columns of the main base array to edit
-    :param start_from_end: If indexing of cols should start from the last column
-        rather than from first one, defaults to False
+    """
+    byte_msg: bytes = (message + delimiter).encode("utf-8")
+    return split_bytes(np.frombuffer(byte_msg, dtype=np.uint8), bits)
+
+
+def embed_payload(base: np.ndarray, payload: np.ndarray, bits: int) -> None:
+    """Replace the least significant bits of the base array with the payload in place.
+
+    :param base: Writable array with pixel values, at least as long as the payload
+    :param payload: Values to put into the least significant bits
+    :param bits: Amount of bits per pixel
 
     """
-    if start_from_end:
-        base[:, -column_num:] = new  # type: ignore
-    else:
-        base[:, :column_num] = new  # type: ignore
-    return base
+    view = base[: payload.size]
+    if view.strides[0] < 0:
+        # write reversed views in the order of their memory
+        view, payload = view[::-1], payload[::-1]
+    view &= ~LSB_TABLES[bits].mask
+    view |= payload
+
 
+def low_bytes(pixels: np.ndarray) -> np.ndarray:
+    """Return a view of the least significant byte of every pixel value.
 
-def pack_and_concatenate(
-    unpacked: ArrayLike,
-    base: ArrayLike,
-    final_shape: tuple,
-) -> ArrayLike:
-    """Pack bits of the first array and then concatenate it with the base one, lastly reshape it.
+    8 bit pixel values are returned unchanged. Wider values must be
+    C-contiguous to share their memory with the view, so writes into it
+    change the original array, other arrays are copied first.
 
-    :param unpacked: The packed array with the encoded data
-    :param base: Main array with the pixel data
-    :param final_shape: Shape of the original image array
+    :param pixels: Array with unsigned integer pixel values
 
     """
-    packed_arr = np.packbits(unpacked)
-    final: ArrayLike = np.concatenate((packed_arr, base)).reshape(final_shape)
-    return final
+    arr = np.asarray(pixels)
+    if arr.itemsize == 1:
+        return arr
+    arr = np.ascontiguousarray(arr)
+    little = arr.dtype.byteorder == "<" or (
+        arr.dtype.byteorder == "=" and sys.byteorder == "little"
+    )
+    start = 0 if little else arr.itemsize - 1
+    view = arr.reshape(*arr.shape, 1).view(np.uint8)
+    return view[..., start]  # type: ignore
@@ -0,0 +1,140 @@
+"""Utility functions for reading uploaded data without copying them.
+
+Uploaded files are spooled by Starlette, small ones are kept in memory
+and larger ones are written into a temporary file. The temporary files are
+memory mapped, so their pages are shared with the page cache instead of
+being read into a new ``bytes`` object.
+
+"""
+from __future__ import annotations
+
+import io
+import mmap
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from array import array
+    from typing import IO, Union
+
+    Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+    WritableBuffer = Union[bytearray, memoryview, array, mmap.mmap]
+
+
+class BufferIO(io.RawIOBase):
+    """Read only binary stream over a buffer.
+
+    Unlike ``io.BytesIO`` the stream does not copy buffers which are not
+    ``bytes``, such as memory views of memory mapped files.
+
+    """
+
+    def __init__(self, buffer: Buffer) -> None:
+        """Construct the class.
+
+        :param buffer: The data of the stream
+
+        """
+        super().__init__()
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        """Return True, the stream can be read."""
+        return True
+
+    def seekable(self) -> bool:
+        """Return True, the stream supports random access."""
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        """Read and return at most the given number of bytes.
+
+        :param size: Maximal number of bytes, defaults to -1 (all)
+
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        start = min(self._position, len(self._view))
+        end = len(self._view) if size < 0 else start + size
+        data = self._view[start:end].tobytes()
+        self._position = start + len(data)
+        return data
+
+    def readinto(self, buffer: WritableBuffer) -> int:
+        """Read bytes into the given writable buffer.
+
+        :param buffer: The buffer to fill
+
+        """
+        target = memoryview(buffer).cast("B")
+        data = self._view[self._position :][: len(target)]
+        target[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Change the stream position and return the new one.
+
+        :param offset: Offset relative to the position given by ``whence``
+        :param whence: One of the ``io.SEEK_*`` constants,
+            defaults to ``io.SEEK_SET``
+
+        :raises ValueError: if the new position would be negative
+
+        """
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"invalid whence ({whence!r})")
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset!r}")
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        """Return the current stream position."""
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        """Return a view of the whole buffer, like ``io.BytesIO.getbuffer``."""
+        return self._view[:]
+
+
+def stream(data: Buffer) -> Union[io.BytesIO, BufferIO]:
+    """Return a binary stream over the data which does not copy them.
+
+    ``io.BytesIO`` shares the memory of ``bytes`` objects,
+    other buffers are wrapped by a ``BufferIO``.
+
+    :param data: The data to read
+
+    """
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    return BufferIO(data)
+
+
+def map_file(file: IO[bytes]) -> Buffer:
+    """Return the data of an uploaded file without reading them into memory.
+
+    Files which are already kept in memory are returned as ``bytes``,
+    their size is bounded by the spooling limit. Files on disk are
+    memory mapped and returned as a read only memory view of the mapping.
+
+    :param file: The uploaded, possibly spooled, file
+
+    """
+    # the private buffer is used because 'fileno' moves spooled data to disk
+    raw = getattr(file, "_file", file)
+    if isinstance(raw, io.BytesIO):
+        return raw.getvalue()
+
+    raw.flush()
+    fd = raw.fileno()
+    if not os.fstat(fd).st_size:
+        return b""
+    # the mapping is closed when the last view of it is garbage collected
+    return memoryview(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
@@ -1,66 +1,328 @@
 """Utility functions for working with images."""
 from __future__ import annotations
 
+import hashlib
+import math
 from io import BytesIO
 from typing import TYPE_CHECKING, cast
 
-import magic
 import numpy as np
 from PIL import Image
 
-from imagesecrets.constants import API_IMAGES
-from imagesecrets.core.util import main
+from imagesecrets.constants import API_IMAGES, PNG_COMPRESS_LEVEL, PNG_FILTER
+from imagesecrets.core.util import buffer, main, png
+from imagesecrets.core.util.buffer import BufferIO
 
 if TYPE_CHECKING:
     from pathlib import Path
-    from typing import Union
+    from typing import Callable, Iterator, Optional, Union
 
     from _io import BytesIO as TBytesIO
-    from numpy.typing import ArrayLike
 
+    from imagesecrets.core.progress import Report
+    from imagesecrets.core.util.buffer import Buffer
 
-def png_filetype(data_: bytes, /) -> bool:
-    """Check that the given file data are part of a png image.
+# modes of 16 bit grayscale images, Pillow opens such PNG images in mode I
+WIDE_MODES = ("I", "I;16", "I;16B", "I;16L")
 
-    :param data_: Image data to check
+
+class ImageTooLarge(ValueError):
+    """Raised when an image has more pixels than allowed."""
+
+
+def png_header(
+    data_: Buffer,
+    /,
+    *,
+    max_pixels: Optional[int] = None,
+) -> png.Header:
+    """Return the header of a png image without decompressing any pixels.
+
+    Only the signature and the IHDR chunk at the beginning are read.
+
+    :param data_: Image data, at least the first 'png.HEADER_SIZE' bytes
+    :param max_pixels: Maximal number of pixels in the image,
+        defaults to None (no limit)
+
+    :raises ValueError: if the data do not start with a valid png header
+    :raises ImageTooLarge: if the image has more than ``max_pixels`` pixels
+
+    """
+    header = png.read_header(bytes(data_[: png.HEADER_SIZE]))
+    if max_pixels is not None and header.pixels > max_pixels:
+        raise ImageTooLarge(
+            f"The image size ({header.pixels:,.0f} pixels) exceeds the limit ({max_pixels:,.0f} pixels)",
+        )
+    return header
+
+
+def read_bytes(data_: Buffer, /) -> Union[TBytesIO, BufferIO]:
+    """Return a binary stream over the data of ``UploadFile`` without copying them.
+
+    :param data_: The data to read, ``bytes`` or a memory mapped buffer
+
+    """
+    return buffer.stream(data_)
+
+
+def shape(file: Union[TBytesIO, BufferIO, Path], /) -> tuple[int, int, int]:
+    """Return shape of the numpy array of the given image without decoding it.
+
+    :param file: The path to the image or the image itself
+
+    """
+    if isinstance(file, (BytesIO, BufferIO)):
+        with file.getbuffer() as view:
+            start = view[: png.HEADER_SIZE].tobytes()
+    else:
+        with file.open("rb") as f:
+            start = f.read(png.HEADER_SIZE)
+
+    try:
+        header = png_header(start)
+    except ValueError:
+        with Image.open(file) as img:  # only the header is read
+            width, height = img.size
+            channels = Image.getmodebands(native_mode(img.mode))
+    else:
+        width, height, channels = header.width, header.height, header.bands
+    return height, width, channels
+
+
+def native_mode(mode: str, /) -> str:
+    """Return the mode in which images of the given mode are processed.
+
+    Grayscale, RGB and images with alpha keep their mode,
+    bilevel images become grayscale and all other images RGB.
+
+    :param mode: Pillow mode of the image
 
     """
-    result: bool = magic.from_buffer(buffer=data_, mime=True) == "image/png"
-    return result
+    if mode in png.MODES.values() or mode in WIDE_MODES:
+        return mode
+    return "L" if mode == "1" else "RGB"
 
 
-def read_bytes(data_: bytes, /) -> TBytesIO:
-    """Read and return the bytes created by ``FileUpload``.
+def pixels(img: Image.Image, /, *, writable: bool = True) -> np.ndarray:
+    """Return numpy array of shape (height, width, channels) of the image.
 
-    :param data_: The data to read
+    16 bit grayscale images are returned as unsigned 16 bit integers.
+    Unless the array must be writable, it uses the data decoded by Pillow
+    without another copy.
+
+    :param img: The image
+    :param writable: Whether the array must be writable, defaults to True
 
     """
-    return BytesIO(data_)
+    if img.mode in WIDE_MODES:
+        arr = np.asarray(img).astype(np.uint16)
+    else:
+        mode = native_mode(img.mode)
+        arr = np.asarray(img if img.mode == mode else img.convert(mode))
+        if writable and not arr.flags.writeable:
+            arr = arr.copy()
+    return arr.reshape(img.height, img.width, -1)
 
 
 def data(
-    file: Union[TBytesIO, Path],
+    file: Union[TBytesIO, BufferIO, Path],
     /,
-) -> tuple[tuple[int, int, int], ArrayLike]:
-    """Return numpy array of the given image.
+    *,
+    writable: bool = True,
+) -> tuple[tuple[int, int, int], np.ndarray]:
+    """Return numpy array of the given image in its own color mode.
 
     :param file: The path to the image from which to extract the data
+    :param writable: Whether the array must be writable, defaults to True
 
     """
-    with Image.open(file).convert("RGB") as img:
-        arr = np.array(img, dtype=np.uint8)
+    with Image.open(file) as img:
+        arr = pixels(img, writable=writable)
     shape = cast(tuple[int, int, int], arr.shape)
     return shape, arr
 
 
-def save_array(arr: ArrayLike, /, *, image_dir: Path = API_IMAGES) -> Path:
-    """Save a new image.
+def head(
+    file: Union[TBytesIO, BufferIO, Path],
+    size: int,
+    /,
+) -> tuple[tuple[int, int, int], np.ndarray]:
+    """Return shape of the whole image and numpy array of its first rows.
+
+    Only the rows which hold at least ``size`` pixel values are decompressed
+    and un-filtered if the image is a non-interlaced 8 bit PNG, other images
+    are decoded whole by Pillow.
+
+    :param file: The path to the image from which to extract the data
+    :param size: Minimal number of pixel values to return
+
+    """
+    try:
+        reader = png.Reader(read_all(file))
+    except ValueError:
+        pass  # not readable row by row, let Pillow decode the image
+    else:
+        rows = reader.rows_of(size)
+        reader.load_rows(rows)
+        return reader.shape, reader.array[:rows]
+
+    shape, arr = data(file, writable=False)
+    height, width, channels = shape
+    rows = min(height, math.ceil(size / (width * channels)))
+    return shape, arr[:rows]
+
+
+def lazy_data(
+    file: Union[TBytesIO, BufferIO, Path],
+    /,
+) -> tuple[tuple[int, int, int], np.ndarray, Callable[[int], None]]:
+    """Return numpy array of the given image and a function which fills it.
+
+    Non-interlaced PNG images are decoded only as far as the returned
+    function is asked to, the array is filled completely for other images.
+
+    :param file: The path to the image from which to extract the data
+
+    """
+    try:
+        reader = png.Reader(read_all(file))
+    except ValueError:
+        shape, arr = data(file, writable=False)
+        return shape, arr, _loaded
+    return reader.shape, reader.array, reader.load
+
+
+def read_all(file: Union[TBytesIO, BufferIO, Path], /) -> Buffer:
+    """Return all bytes of the given file.
 
-    :param arr: The numpy array with the pixel data
+    Streams are not copied, ``BufferIO`` returns a view of its buffer.
+
+    :param file: The path to the file or the file itself
+
+    """
+    if isinstance(file, BytesIO):
+        return file.getvalue()
+    if isinstance(file, BufferIO):
+        return file.getbuffer()
+    return file.read_bytes()
+
+
+def new_filename() -> str:
+    """Return a new random name of a png image."""
+    return f"{main.token_hex(16)}.png"
+
+
+def content_hash(data: Buffer) -> str:
+    """Return hex digest of the sha256 hash of image data.
+
+    :param data: The image data
+
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_filename(digest: str) -> str:
+    """Return name of a png image derived from the hash of its data.
+
+    Images with the same data always get the same name,
+    so they are stored only once.
+
+    :param digest: Hex digest of the image data, see ``content_hash``
+
+    """
+    return f"{digest}.png"
+
+
+def new_path(image_dir: Path = API_IMAGES, /) -> Path:
+    """Return a new random path of a png image.
+
+    :param image_dir: Directory of the image, defaults to 'API_IMAGES'
+
+    """
+    return image_dir / new_filename()
+
+
+def encode_array(
+    arr: np.ndarray,
+    /,
+    *,
+    level: int = PNG_COMPRESS_LEVEL,
+    filter_type: str = PNG_FILTER,
+    workers: int = 1,
+    progress: Optional[Report] = None,
+) -> Iterator[bytes]:
+    """Yield data of a png image in the color mode given by the shape of the array.
+
+    :param arr: The numpy array with the pixel data,
+        16 bit integers are saved as 16 bit grayscale
+    :param level: zlib compression level, defaults to 'PNG_COMPRESS_LEVEL'
+    :param filter_type: PNG row filter, defaults to 'PNG_FILTER'
+    :param workers: Number of threads compressing the image, defaults to 1
+    :param progress: Called with the fraction of compressed rows,
+        defaults to None
+
+    """
+    pixels_ = np.asarray(arr)
+    if pixels_.dtype != np.uint16:
+        pixels_ = pixels_.astype(np.uint8, copy=False)
+    if pixels_.ndim == 2:
+        pixels_ = pixels_[..., np.newaxis]
+    if pixels_.ndim != 3 or pixels_.shape[-1] not in png.MODES:
+        with Image.fromarray(np.uint8(arr)).convert("RGB") as img:
+            pixels_ = np.asarray(img)
+
+    yield from png.encode(
+        pixels_,
+        level=level,
+        filter_type=filter_type,
+        workers=workers,
+        progress=progress,
+    )
+
+
+def save_array(
+    arr: np.ndarray,
+    /,
+    *,
+    image_dir: Path = API_IMAGES,
+    level: int = PNG_COMPRESS_LEVEL,
+    filter_type: str = PNG_FILTER,
+    workers: int = 1,
+) -> Path:
+    """Save a new image in the color mode given by the shape of the array.
+
+    :param arr: The numpy array with the pixel data,
+        16 bit integers are saved as 16 bit grayscale
+    :param image_dir: Directory where to save the image
+    :param level: zlib compression level, defaults to 'PNG_COMPRESS_LEVEL'
+    :param filter_type: PNG row filter, defaults to 'PNG_FILTER'
+    :param workers: Number of threads compressing the image, defaults to 1
+
+    """
+    fp = new_path(image_dir)
+    with fp.open("wb") as f:
+        f.writelines(
+            encode_array(
+                arr,
+                level=level,
+                filter_type=filter_type,
+                workers=workers,
+            ),
+        )
+    return fp
+
+
+def save_bytes(data_: Buffer, /, *, image_dir: Path = API_IMAGES) -> Path:
+    """Save the data of an already encoded image.
+
+    :param data_: The image data
     :param image_dir: Directory where to save the image
 
     """
-    filename = f"{main.token_hex(16)}.png"
-    fp = image_dir / filename
-    Image.fromarray(np.uint8(arr)).convert("RGB").save(str(fp))  # type: ignore
+    fp = new_path(image_dir)
+    fp.write_bytes(data_)  # type: ignore
     return fp
+
+
+def _loaded(size: int, /) -> None:
+    """Do nothing, the whole image is already decoded."""
@@ -0,0 +1,176 @@
+"""Utility functions for processing pixel arrays in tiles on multiple threads.
+
+The heavy lifting is done by numpy which releases the GIL, so the tiles
+of a single image can be processed by a pool of threads at once. Every tile
+is written directly into its place in the result array.
+
+"""
+from __future__ import annotations
+
+import functools
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, TypeVar
+
+import numpy as np
+
+from imagesecrets.constants import TILE_SIZE
+from imagesecrets.core.util import array
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Iterator
+
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
+
+@functools.cache
+def get_executor(workers: int) -> ThreadPoolExecutor:
+    """Return a thread pool shared by all calls with the same amount of workers.
+
+    :param workers: Number of threads in the pool
+
+    """
+    return ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix="imagesecrets-tile",
+    )
+
+
+def tiles(size: int, tile_size: int = TILE_SIZE) -> list[slice]:
+    """Return slices which split an array of the given size into tiles.
+
+    :param size: Size of the whole array
+    :param tile_size: Maximal size of one tile, must be a multiple of 8
+
+    :raises ValueError: if the tile size is not divisible by 8
+
+    """
+    # every tile must hold whole groups of 8 pixel values,
+    # so the bytes of a tile never overlap with the next one
+    if tile_size <= 0 or tile_size % 8:
+        raise ValueError(
+            f"{tile_size!r} is not a valid tile size, must be a positive multiple of 8.",
+        )
+    return [
+        slice(start, min(start + tile_size, size))
+        for start in range(0, size, tile_size)
+    ]
+
+
+def run(
+    func: Callable[[_T], _R],
+    items: Iterable[_T],
+    workers: int = 1,
+) -> list[_R]:
+    """Return results of the function called with every item.
+
+    :param func: Function to call
+    :param items: Arguments for the function
+    :param workers: Number of threads to use, defaults to 1
+
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    return list(get_executor(workers).map(func, items))
+
+
+def imap(
+    func: Callable[[_T], _R],
+    items: Iterable[_T],
+    workers: int = 1,
+) -> Iterator[_R]:
+    """Yield results of the function in order, computing at most ``workers`` ahead.
+
+    Unlike ``Executor.map`` the items are not all submitted at once,
+    so stopping the iteration early wastes at most ``workers - 1`` calls.
+
+    :param func: Function to call
+    :param items: Arguments for the function
+    :param workers: Number of threads to use, defaults to 1
+
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    executor = get_executor(workers)
+    pending: deque = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_bytes(
+    pixels: np.ndarray,
+    bits: int,
+    *,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+) -> np.ndarray:
+    """Return the least significant bits of the pixel values grouped into bytes.
+
+    :param pixels: Array with pixel values
+    :param bits: Amount of bits per pixel
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values in one tile,
+        defaults to 'TILE_SIZE'
+
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1)
+    parts = tiles(pixels.size, tile_size)
+    if workers <= 1 or len(parts) <= 1:
+        return array.extract_bytes(pixels, bits)
+
+    result = np.empty(math.ceil(pixels.size * bits / 8), dtype=np.uint8)
+
+    def extract(part: slice) -> None:
+        start = part.start * bits // 8
+        data = array.extract_bytes(pixels[part], bits)
+        result[start : start + data.size] = data
+
+    run(extract, parts, workers)
+    return result
+
+
+def embed_payload(
+    base: np.ndarray,
+    payload: np.ndarray,
+    bits: int,
+    *,
+    workers: int = 1,
+    tile_size: int = TILE_SIZE,
+) -> None:
+    """Replace the least significant bits of the base array with the payload in place.
+
+    :param base: Writable array with pixel values, at least as long as the payload
+    :param payload: Values to put into the least significant bits
+    :param bits: Amount of bits per pixel
+    :param workers: Number of threads to use, defaults to 1
+    :param tile_size: Number of pixel values in one tile,
+        defaults to 'TILE_SIZE'
+
+    """
+    parts = tiles(payload.size, tile_size)
+    if workers <= 1 or len(parts) <= 1:
+        array.embed_payload(base, payload, bits)
+        return
+
+    def embed(part: slice) -> None:
+        array.embed_payload(
+            base[part.start :],
+            payload[part],
+            bits,
+        )
+
+    run(embed, parts, workers)
@@ -0,0 +1,596 @@
+"""Incremental reader and parallel writer of non-interlaced PNG images.
+
+The IDAT chunks are fed through a single zlib decompressor and the rows are
+un-filtered only when they are requested, so the decoding of an image can
+stop as soon as the first rows are known to hold the whole message.
+
+Only images with 8 bits per sample are read row by row, other images
+are decoded whole by Pillow.
+
+When writing, groups of rows are filtered and compressed on a thread pool.
+Every group ends on a zlib full flush boundary like in pigz, so the
+compressed groups join into a single valid zlib stream.
+
+"""
+from __future__ import annotations
+
+import math
+import struct
+import zlib
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from imagesecrets.constants import (
+    PNG_BLOCK_SIZE,
+    PNG_COMPRESS_LEVEL,
+    PNG_FILTER,
+)
+from imagesecrets.core.util import buffer, parallel
+
+if TYPE_CHECKING:
+    from typing import Iterator, Optional
+
+    from imagesecrets.core.progress import Report
+    from imagesecrets.core.util.buffer import Buffer
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# number of samples in one pixel of every color type
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# color type of images with the given number of samples in one pixel
+COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+# Pillow mode of 8 bit images with the given number of samples in one pixel
+MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+# row filters in the order of their PNG filter types,
+# the adaptive strategy chooses the best one for every row
+FILTERS = ("none", "sub", "up", "average", "paeth", "adaptive")
+# filters the adaptive strategy chooses from, they are reversed by whole
+# rows at once, so the written images can be read lazily
+ADAPTIVE_FILTERS = ("none", "sub", "up")
+
+# every compressed group of rows is primed with this much of
+# the preceding data, so the compression ratio barely suffers
+WINDOW_SIZE = 2 ** 15
+
+# un-filtering rows in python is much slower than decoding the whole
+# image by Pillow, rows are read lazily only until this fraction of the image
+# and at most this number of pixel values
+LAZY_FRACTION = 32
+LAZY_MAX_SIZE = 2 ** 20
+# filters which depend on the un-filtered left neighbour can not be reversed
+# by whole rows at once, images which use them are decoded by Pillow
+SLOW_FILTERS = (3, 4)
+
+_CHUNK = struct.Struct(">I4s")
+_IHDR = struct.Struct(">IIBBBBB")
+
+# number of bytes at the beginning of every PNG image which hold the header
+HEADER_SIZE = len(SIGNATURE) + _CHUNK.size + _IHDR.size + 4
+
+
+class Header(NamedTuple):
+    """Data of the IHDR chunk.
+
+    :param width: Width of the image in pixels
+    :param height: Height of the image in pixels
+    :param bit_depth: Number of bits per sample
+    :param color_type: PNG color type
+    :param interlace: PNG interlace method
+
+    """
+
+    width: int
+    height: int
+    bit_depth: int
+    color_type: int
+    interlace: int
+
+    @property
+    def pixels(self) -> int:
+        """Return the number of pixels in the image."""
+        return self.width * self.height
+
+    @property
+    def channels(self) -> int:
+        """Return the number of samples in one pixel."""
+        return CHANNELS[self.color_type]
+
+    @property
+    def bands(self) -> int:
+        """Return the number of values in one decoded pixel.
+
+        Palette images are decoded as RGB, other images keep their channels.
+
+        """
+        return 3 if self.color_type == 3 else self.channels
+
+    @property
+    def row_size(self) -> int:
+        """Return the number of bytes in one row without the filter type."""
+        return math.ceil(self.width * self.channels * self.bit_depth / 8)
+
+
+def chunks(data: Buffer) -> Iterator[tuple[bytes, memoryview]]:
+    """Yield type and data of every chunk up to the IEND chunk.
+
+    :param data: The PNG image
+
+    :raises ValueError: if the data are not a PNG image or are truncated
+
+    """
+    if data[: len(SIGNATURE)] != SIGNATURE:
+        raise ValueError("not a PNG image")
+
+    view = memoryview(data)
+    offset = len(SIGNATURE)
+    while offset + _CHUNK.size <= len(data):
+        length, kind = _CHUNK.unpack_from(data, offset)
+        start = offset + _CHUNK.size
+        if start + length + 4 > len(data):
+            raise ValueError(f"truncated {kind!r} chunk")
+        if kind == b"IEND":
+            return
+        yield kind, view[start : start + length]
+        offset = start + length + 4  # crc
+
+    raise ValueError("missing IEND chunk")
+
+
+def read_header(data: Buffer) -> Header:
+    """Return the header of a PNG image.
+
+    :param data: The PNG image
+
+    :raises ValueError: if the data do not start with a valid IHDR chunk
+
+    """
+    for kind, chunk in chunks(data):
+        if kind != b"IHDR" or len(chunk) != _IHDR.size:
+            break
+        width, height, depth, color, _, _, interlace = _IHDR.unpack(chunk)
+        if color not in CHANNELS:
+            raise ValueError(f"invalid PNG color type {color!r}")
+        if not width or not height:
+            raise ValueError("PNG image without any pixels")
+        return Header(width, height, depth, color, interlace)
+    raise ValueError("missing IHDR chunk")
+
+
+def unfilter(
+    filter_type: int,
+    row: np.ndarray,
+    previous: np.ndarray,
+    bpp: int,
+) -> np.ndarray:
+    """Return a row with the PNG filter reversed.
+
+    :param filter_type: The PNG filter type of the row
+    :param row: The filtered row without the filter type byte
+    :param previous: The previous un-filtered row, zeros for the first row
+    :param bpp: Number of bytes per complete pixel
+
+    :raises ValueError: if the filter type is not valid
+
+    """
+    row = np.asarray(row, dtype=np.uint8)
+
+    if filter_type == 0:
+        return row.copy()
+    if filter_type == 1:
+        return np.cumsum(row.reshape(-1, bpp), axis=0, dtype=np.uint8).ravel()
+    if filter_type == 2:
+        return row + previous  # type: ignore
+    if filter_type not in SLOW_FILTERS:
+        raise ValueError(f"invalid PNG filter type {filter_type!r}")
+
+    # both filters depend on the already un-filtered left neighbour
+    out = bytearray(row.tobytes())
+    up = bytes(np.asarray(previous, dtype=np.uint8).tobytes())
+    if filter_type == 3:
+        _unfilter_average(out, up, bpp)
+    else:
+        _unfilter_paeth(out, up, bpp)
+    return np.frombuffer(out, dtype=np.uint8)  # type: ignore
+
+
+def _unfilter_average(out: bytearray, up: bytes, bpp: int) -> None:
+    """Reverse the average filter of a row in place.
+
+    :param out: The filtered row
+    :param up: The previous un-filtered row
+    :param bpp: Number of bytes per complete pixel
+
+    """
+    for i in range(len(out)):
+        left = out[i - bpp] if i >= bpp else 0
+        out[i] = (out[i] + ((left + up[i]) >> 1)) & 0xFF
+
+
+def _unfilter_paeth(out: bytearray, up: bytes, bpp: int) -> None:
+    """Reverse the Paeth filter of a row in place.
+
+    :param out: The filtered row
+    :param up: The previous un-filtered row
+    :param bpp: Number of bytes per complete pixel
+
+    """
+    for i in range(bpp):
+        out[i] = (out[i] + up[i]) & 0xFF
+    for i in range(bpp, len(out)):
+        a, b, c = out[i - bpp], up[i], up[i - bpp]
+        p = a + b - c
+        pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+        if pa <= pb and pa <= pc:
+            predictor = a
+        elif pb <= pc:
+            predictor = b
+        else:
+            predictor = c
+        out[i] = (out[i] + predictor) & 0xFF
+
+
+class Reader:
+    """Lazily decoded pixel array of a PNG image in its own color mode."""
+
+    def __init__(self, data: Buffer, *, lazy_limit: Optional[int] = None):
+        """Construct the class.
+
+        :param data: The PNG image
+        :param lazy_limit: Maximal number of pixel values which are decoded
+            row by row, defaults to None (``LAZY_FRACTION`` of the image,
+            at most ``LAZY_MAX_SIZE``)
+
+        :raises ValueError: if the image can not be read row by row
+
+        """
+        header = read_header(data)
+        if header.interlace:
+            raise ValueError("interlaced PNG images are not supported")
+        if header.bit_depth != 8:
+            raise ValueError(
+                f"PNG images with bit depth {header.bit_depth!r} are not supported",
+            )
+
+        self.data = data
+        self.header = header
+        self.shape = (header.height, header.width, header.bands)
+        self.array = np.empty(self.shape, dtype=np.uint8)
+        self.rows = 0
+
+        size = math.prod(self.shape)
+        self.lazy_limit = (
+            min(size // LAZY_FRACTION, LAZY_MAX_SIZE)
+            if lazy_limit is None
+            else lazy_limit
+        )
+
+        palette = b""
+        idat = []
+        for kind, chunk in chunks(data):
+            if kind == b"PLTE":
+                palette = bytes(chunk)
+            elif kind == b"IDAT":
+                idat.append(chunk)
+        if header.color_type == 3 and not palette:
+            raise ValueError("missing PLTE chunk")
+
+        # indexes outside of the palette are black
+        self._palette = np.zeros((256, 3), dtype=np.uint8)
+        colors = np.frombuffer(palette, dtype=np.uint8)[: 256 * 3]
+        self._palette.reshape(-1)[: colors.size] = colors
+
+        self._idat = iter(idat)
+        self._inflate = zlib.decompressobj()
+        self._buffer = bytearray()
+        self._pending = b""
+        self._previous = np.zeros(header.row_size, dtype=np.uint8)
+
+    @property
+    def size(self) -> int:
+        """Return the number of pixel values which are already decoded."""
+        return self.rows * self.shape[1] * self.shape[2]
+
+    def load(self, size: int) -> None:
+        """Decode rows until at least the given number of pixel values is ready.
+
+        :param size: Number of pixel values from the beginning of the image
+
+        :raises ValueError: if the image data are truncated or corrupted
+
+        """
+        if size <= self.size:
+            return
+        if size > self.lazy_limit:
+            self.load_all()
+            return
+
+        rows = self.rows_of(size)
+        while self.rows < rows:
+            filter_type, filtered = self._inflate_row()
+            if filter_type in SLOW_FILTERS:
+                self.load_all()
+                return
+            self._store_row(filter_type, filtered)
+
+    def load_rows(self, rows: int) -> None:
+        """Decode the given number of rows from the beginning of the image.
+
+        Unlike ``load``, the rows are never decoded by Pillow, rows with
+        slow filters are reversed in python, so only few rows should be read.
+
+        :param rows: Number of rows to decode
+
+        :raises ValueError: if the image data are truncated or corrupted
+
+        """
+        while self.rows < min(rows, self.shape[0]):
+            self._store_row(*self._inflate_row())
+
+    def rows_of(self, size: int) -> int:
+        """Return the number of rows which hold the given number of values.
+
+        :param size: Number of pixel values from the beginning of the image
+
+        """
+        row_values = self.shape[1] * self.shape[2]
+        return min(self.shape[0], math.ceil(size / row_values))
+
+    def load_all(self) -> None:
+        """Decode the whole image by Pillow."""
+        if self.rows == self.shape[0]:
+            return
+        mode = MODES[self.shape[2]]
+        with Image.open(buffer.stream(self.data)) as img:
+            if img.mode == mode:
+                pixels = np.asarray(img)
+            else:
+                with img.convert(mode) as converted:
+                    pixels = np.asarray(converted)
+        self.array[...] = pixels.reshape(self.shape)
+        self.rows = self.shape[0]
+
+    def _inflate_row(self) -> tuple[int, bytes]:
+        """Return the filter type and the filtered data of the next row.
+
+        :raises ValueError: if the image data are truncated
+
+        """
+        stride = self.header.row_size + 1
+        while len(self._buffer) < stride:
+            data = self._pending or next(self._idat, b"")
+            # decompress only as much as is needed for the row
+            self._buffer += self._inflate.decompress(
+                data,
+                stride - len(self._buffer),
+            )
+            self._pending = self._inflate.unconsumed_tail
+            if not data and len(self._buffer) < stride and not self._pending:
+                raise ValueError("truncated PNG image data")
+
+        filter_type, filtered = self._buffer[0], bytes(self._buffer[1:])
+        self._buffer.clear()
+        return filter_type, filtered
+
+    def _store_row(self, filter_type: int, filtered: bytes) -> None:
+        """Un-filter the next row into the array.
+
+        :param filter_type: The PNG filter type of the row
+        :param filtered: The filtered row without the filter type byte
+
+        """
+        self.array[self.rows] = self._unfilter_row(filter_type, filtered)
+        self.rows += 1
+
+    def _unfilter_row(self, filter_type: int, filtered: bytes) -> np.ndarray:
+        """Return the un-filtered row, palette indexes are looked up.
+
+        :param filter_type: The PNG filter type of the row
+        :param filtered: The filtered row without the filter type byte
+
+        """
+        row = unfilter(
+            filter_type,
+            np.frombuffer(filtered, dtype=np.uint8),
+            self._previous,
+            self.header.channels,
+        )
+        self._previous = row
+
+        pixels = row.reshape(-1, self.header.channels)
+        if self.header.color_type == 3:
+            return self._palette[pixels[:, 0]]  # type: ignore
+        return pixels
+
+
+def encode(
+    array: np.ndarray,
+    *,
+    level: int = PNG_COMPRESS_LEVEL,
+    filter_type: str = PNG_FILTER,
+    workers: int = 1,
+    block_size: int = PNG_BLOCK_SIZE,
+    progress: Optional[Report] = None,
+) -> Iterator[bytes]:
+    """Yield data of a PNG image with the given pixel values piece by piece.
+
+    :param array: Array with 8 or 16 bit pixel values of shape
+        (height, width) or (height, width, channels) with 1 to 4 channels
+    :param level: zlib compression level, defaults to 'PNG_COMPRESS_LEVEL'
+    :param filter_type: One of 'FILTERS', defaults to 'PNG_FILTER'
+    :param workers: Number of threads to use, defaults to 1
+    :param block_size: Number of uncompressed bytes compressed by one thread
+        at once, defaults to 'PNG_BLOCK_SIZE'
+    :param progress: Called with the fraction of compressed rows,
+        defaults to None
+
+    :raises ValueError: if the array or any of the parameters is not valid
+
+    """
+    arr = _image_array(array)
+    if filter_type not in FILTERS:
+        raise ValueError(
+            f"{filter_type!r} is not a valid PNG filter, must be one of {FILTERS!r}.",
+        )
+    if not 0 <= level <= 9:
+        raise ValueError(
+            f"{level!r} is not a valid compression level, must be within {range(10)!r}.",
+        )
+
+    height, width, channels = arr.shape
+    depth = arr.itemsize * 8
+    # samples are stored in network byte order
+    rows = np.ascontiguousarray(arr, dtype=f">u{arr.itemsize}").view(np.uint8)
+    rows = rows.reshape(height, width * channels * arr.itemsize)
+    stride = rows.shape[1] + 1
+    bpp = channels * arr.itemsize
+
+    yield SIGNATURE + chunk(
+        b"IHDR",
+        _IHDR.pack(width, height, depth, COLOR_TYPES[channels], 0, 0, 0),
+    )
+
+    step = max(1, block_size // stride)
+    context = math.ceil(WINDOW_SIZE / stride)
+    starts = range(0, height, step)
+
+    def compress(start: int) -> tuple[np.ndarray, bytes]:
+        # the rows before the group are filtered once more on this thread,
+        # so no group has to wait for the previous one
+        stop = min(start + step, height)
+        first = max(0, start - context)
+        data = filter_rows(rows, first, stop, bpp, filter_type)
+        split = (start - first) * stride
+
+        options = {}
+        if split:
+            options["zdict"] = data[max(0, split - WINDOW_SIZE) : split]
+        # raw deflate, the zlib header and checksum are written only once
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, **options)
+        block = data[split:]
+        flush = zlib.Z_FINISH if stop == height else zlib.Z_FULL_FLUSH
+        return block, compressor.compress(block) + compressor.flush(flush)
+
+    prefix = _zlib_header(level)
+    checksum = zlib.adler32(b"")
+    for start, (block, data) in zip(
+        starts,
+        parallel.imap(compress, starts, workers),
+    ):
+        checksum = zlib.adler32(block, checksum)  # type: ignore
+        if start == starts[-1]:
+            data += struct.pack(">I", checksum)
+        yield chunk(b"IDAT", prefix + data)
+        prefix = b""
+        if progress is not None:
+            progress("compress", min(start + step, height) / height)
+
+    yield chunk(b"IEND", b"")
+
+
+def _image_array(array: np.ndarray) -> np.ndarray:
+    """Return the pixel values as an array of shape (height, width, channels).
+
+    :param array: Array with 8 or 16 bit pixel values of shape
+        (height, width) or (height, width, channels) with 1 to 4 channels
+
+    :raises ValueError: if the array can not be written as an image
+
+    """
+    arr = np.asarray(array)
+    if arr.dtype != np.uint16:
+        arr = arr.astype(np.uint8, copy=False)
+    if arr.ndim == 2:
+        arr = arr[..., np.newaxis]
+    if arr.ndim != 3 or arr.shape[2] not in COLOR_TYPES or not arr.size:
+        raise ValueError(f"can not write an image of shape {arr.shape!r}")
+    return arr
+
+
+def filter_rows(
+    rows: np.ndarray,
+    start: int,
+    stop: int,
+    bpp: int,
+    filter_type: str = PNG_FILTER,
+) -> np.ndarray:
+    """Return the filtered rows each prefixed with its filter type.
+
+    :param rows: Array with all rows of the image
+    :param start: Index of the first row to filter
+    :param stop: Index after the last row to filter
+    :param bpp: Number of bytes per complete pixel
+    :param filter_type: One of 'FILTERS', defaults to 'PNG_FILTER'
+
+    """
+    raw = rows[start:stop]
+    prior = np.empty_like(raw)
+    prior[0] = rows[start - 1] if start else 0
+    prior[1:] = raw[:-1]
+
+    left = np.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    upper_left = np.zeros_like(prior)
+    upper_left[:, bpp:] = prior[:, :-bpp]
+
+    def apply(kind: str) -> np.ndarray:
+        if kind == "none":
+            return raw  # type: ignore
+        if kind == "sub":
+            return raw - left  # type: ignore
+        if kind == "up":
+            return raw - prior  # type: ignore
+        if kind == "average":
+            average = (left.astype(np.uint16) + prior) >> 1
+            return raw - average.astype(np.uint8)  # type: ignore
+
+        a = left.astype(np.int16)
+        b = prior.astype(np.int16)
+        c = upper_left.astype(np.int16)
+        pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+        predictor = np.where(
+            (pa <= pb) & (pa <= pc),
+            a,
+            np.where(pb <= pc, b, c),
+        )
+        return raw - predictor.astype(np.uint8)  # type: ignore
+
+    out = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+    if filter_type != "adaptive":
+        out[:, 0] = FILTERS.index(filter_type)
+        out[:, 1:] = apply(filter_type)
+        return out.reshape(-1)
+
+    # the filter with the smallest sum of absolute signed differences
+    # usually compresses best, the same heuristic is used by libpng
+    candidates = np.stack([apply(kind) for kind in ADAPTIVE_FILTERS])
+    scores = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+    best = scores.argmin(axis=0)
+    types = np.array([FILTERS.index(kind) for kind in ADAPTIVE_FILTERS])
+    out[:, 0] = types[best]
+    out[:, 1:] = candidates[best, np.arange(raw.shape[0])]
+    return out.reshape(-1)
+
+
+def chunk(kind: bytes, data: bytes) -> bytes:
+    """Return a complete PNG chunk.
+
+    :param kind: Type of the chunk
+    :param data: Data of the chunk
+
+    """
+    crc = zlib.crc32(data, zlib.crc32(kind))
+    return _CHUNK.pack(len(data), kind) + data + struct.pack(">I", crc)
+
+
+def _zlib_header(level: int) -> bytes:
+    """Return zlib stream header matching the compression level."""
+    if level < 2:
+        return b"\x78\x01"
+    if level < 6:
+        return b"\x78\x5e"
+    if level == 6:
+        return b"\x78\x9c"
+    return b"\x78\xda"
@@ -4,13 +4,19 @@ from __future__ import annotations
 import contextlib
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, DateTime, Integer, func
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import Column, DateTime, Integer, func, text
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncSession,
+    create_async_engine,
+)
 from sqlalchemy.orm import declarative_base, declared_attr, sessionmaker
 
 from imagesecrets.config import settings
 
 if TYPE_CHECKING:
+    from typing import AsyncIterator
+
     from fastapi import FastAPI
 
 
@@ -48,7 +54,7 @@ async_sessionmaker = sessionmaker(
 
 
 @contextlib.asynccontextmanager
-async def get_session() -> AsyncSession:
+async def get_session() -> AsyncIterator[AsyncSession]:
     """Return database session."""
     async with async_sessionmaker.begin() as session:
         yield session
@@ -61,3 +67,22 @@ def init(app: FastAPI) -> None:
     async def startup():
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await upgrade(conn)
+
+
+# `create_all` only creates missing tables, changes of existing columns
+# are applied here, every statement must be safe to run repeatedly
+UPGRADES = (
+    "ALTER TABLE decodedimage ALTER COLUMN filename DROP NOT NULL",
+    "ALTER TABLE encodedimage ALTER COLUMN filename DROP NOT NULL",
+)
+
+
+async def upgrade(conn: AsyncConnection) -> None:
+    """Apply schema changes to tables created by older versions.
+
+    :param conn: Connection with an open transaction
+
+    """
+    for statement in UPGRADES:
+        await conn.execute(text(statement))
@@ -25,7 +25,9 @@ class Image:
     delimiter = Column(String, default=MESSAGE_DELIMITER, nullable=False)
     lsb_amount = Column(SmallInteger, default=1, nullable=False)
 
-    filename = Column(String, nullable=False)
+    # images which were not stored only have a history record,
+    # stored images point to the blob with their data
+    filename = Column(String, nullable=True)
 
 
 class DecodedImage(Image, Base):
@@ -52,7 +54,15 @@ class EncodedImage(Image, Base):
     user = relationship("User", back_populates="encoded_images")
 
 
+class Blob(Base):
+    """Stored image data shared by all images with the same content."""
+
+    key = Column(String, unique=True, nullable=False)
+    refcount = Column(Integer, default=0, nullable=False)
+
+
 __all__ = [
+    "Blob",
     "Image",
     "DecodedImage",
     "EncodedImage",
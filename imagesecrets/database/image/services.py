@@ -1,16 +1,21 @@
 """Database services for Image models."""
 from __future__ import annotations
 
+from collections import Counter, defaultdict
 from pathlib import Path
-from typing import Optional, Type, TypeVar
+from typing import TYPE_CHECKING, Optional, Type, TypeVar
 
-from sqlalchemy import select
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
 
 from imagesecrets.database.base import Base
-from imagesecrets.database.image.models import DecodedImage, EncodedImage
+from imagesecrets.database.image.models import Blob, DecodedImage, EncodedImage
 from imagesecrets.database.service import DatabaseService
 from imagesecrets.schemas import image
 
+if TYPE_CHECKING:
+    from typing import Iterable
+
 _I = TypeVar("_I", bound=Base)
 
 
@@ -116,3 +121,79 @@ class ImageService(DatabaseService):
             self._session.add(image)
 
         return image
+
+    async def reference(self, key: str) -> int:
+        """Add a reference to a blob and return its number of references.
+
+        A missing blob is created with a single reference,
+        the caller is then responsible for storing its data.
+
+        :param key: Storage key of the blob
+
+        """
+        stmt = (
+            insert(Blob)
+            .values(key=key, refcount=1)
+            .on_conflict_do_update(
+                index_elements=[Blob.key],
+                set_=dict(refcount=Blob.refcount + 1, updated=func.now()),
+            )
+            .returning(Blob.refcount)
+        )
+
+        result = await self._session.execute(statement=stmt)
+        refcount: int = result.scalar_one()
+
+        return refcount
+
+    async def release(self, keys: Iterable[str]) -> list[str]:
+        """Remove references to blobs and return keys of unreferenced blobs.
+
+        The unreferenced blobs are deleted from the database,
+        the caller is responsible for deleting their data.
+
+        :param keys: Storage keys of the blobs, once for every reference
+
+        """
+        counts = Counter(keys)
+        if not counts:
+            return []
+
+        # blobs losing the same number of references are updated together
+        groups = defaultdict(list)
+        for key, count in counts.items():
+            groups[count].append(key)
+        for count, group in groups.items():
+            update_stmt = (
+                update(Blob)
+                .where(Blob.key.in_(group))
+                .values(refcount=Blob.refcount - count)
+            )
+            await self._session.execute(statement=update_stmt)
+
+        stmt = (
+            delete(Blob)
+            .where(Blob.key.in_(list(counts)), Blob.refcount <= 0)
+            .returning(Blob.key)
+        )
+        result = await self._session.execute(statement=stmt)
+
+        return list(result.scalars())
+
+    async def delete(self, user_id: int) -> list[str]:
+        """Delete all User images and return keys of unreferenced blobs.
+
+        :param user_id: User database id
+
+        """
+        keys: list[str] = []
+        for model in (DecodedImage, EncodedImage):
+            stmt = (
+                delete(model)
+                .where(model.user_id == user_id)
+                .returning(model.filename)
+            )
+            result = await self._session.execute(statement=stmt)
+            keys.extend(key for key in result.scalars() if key)
+
+        return await self.release(keys)
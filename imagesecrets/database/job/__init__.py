@@ -0,0 +1 @@
+"""Job database package."""
@@ -0,0 +1,70 @@
+"""Job database models."""
+from __future__ import annotations
+
+from sqlalchemy import (
+    CheckConstraint,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    SmallInteger,
+    String,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+
+from imagesecrets.constants import JOB_KINDS, JOB_STATUSES
+from imagesecrets.database.base import Base
+
+
+def _one_of(column: str, values: tuple[str, ...]) -> CheckConstraint:
+    """Return constraint which allows only the given values in a column."""
+    allowed = ", ".join(f"'{value}'" for value in values)
+    return CheckConstraint(
+        f"{column} IN ({allowed})",
+        name=f"{column}_choice",
+    )
+
+
+class Job(Base):
+    """Job model, encoding or decoding done by a worker."""
+
+    user_id = Column(
+        Integer,
+        ForeignKey(column="user.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    kind = Column(String, nullable=False)
+    status = Column(String, default="queued", nullable=False)
+    # form fields of the request, as accepted by the synchronous endpoint
+    params = Column(JSONB, nullable=False)
+    image_name = Column(String, nullable=False)
+
+    # the job references the blobs of the uploaded and the encoded image
+    input_key = Column(String, nullable=False)
+    result_key = Column(String, nullable=True)
+    # decoded message or why nothing was found or why the job failed
+    result = Column(JSONB, nullable=True)
+    # latest progress event reported by the worker
+    progress = Column(JSONB, nullable=True)
+
+    attempts = Column(SmallInteger, default=0, nullable=False)
+    started = Column(DateTime, nullable=True)
+    finished = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        _one_of("kind", JOB_KINDS),
+        _one_of("status", JOB_STATUSES),
+        # workers only look for jobs which are waiting or running
+        Index(
+            "job_pending",
+            "id",
+            postgresql_where=status.in_(("queued", "running")),
+        ),
+    )
+
+
+__all__ = [
+    "Job",
+]
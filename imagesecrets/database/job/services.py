@@ -0,0 +1,220 @@
+"""Database services for Job model."""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import and_, delete, or_, select, update
+
+from imagesecrets.database.job.models import Job
+from imagesecrets.database.service import DatabaseService
+
+
+class JobService(DatabaseService):
+    """Database service for Job model."""
+
+    async def create(
+        self,
+        user_id: int,
+        kind: str,
+        image_name: str,
+        input_key: str,
+        params: dict[str, Any],
+    ) -> Job:
+        """Insert a new queued job.
+
+        :param user_id: User foreign key
+        :param kind: One of 'JOB_KINDS'
+        :param image_name: Name of the uploaded image
+        :param input_key: Storage key of the uploaded image
+        :param params: Parameters of the encoding or decoding
+
+        """
+        job = Job(
+            user_id=user_id,
+            kind=kind,
+            image_name=image_name,
+            input_key=input_key,
+            params=params,
+        )
+
+        async with self._session.begin_nested():
+            self._session.add(job)
+
+        return job
+
+    async def get(self, job_id: int, user_id: int) -> Optional[Job]:
+        """Return a job of the User or None if there is none.
+
+        :param job_id: Job database id
+        :param user_id: User database id
+
+        """
+        stmt = (
+            select(Job).where(Job.id == job_id, Job.user_id == user_id)
+            # a polled job is refreshed instead of returned from the session
+            .execution_options(populate_existing=True)
+        )
+
+        result = await self._session.execute(statement=stmt)
+
+        return result.scalar_one_or_none()
+
+    async def claim(self, timeout: int, max_attempts: int) -> Optional[Job]:
+        """Mark the oldest pending job as running and return it.
+
+        Rows locked by other workers are skipped, so every job is claimed
+        by a single worker. Jobs running for longer than the timeout
+        are claimed again, their worker is assumed to have stopped.
+        The ``attempts`` of the returned job number this claim, only its
+        worker can then finish the job.
+
+        :param timeout: Number of seconds after which a running job is stale
+        :param max_attempts: Maximal number of times a job is claimed
+
+        """
+        now = datetime.now()
+        stmt = (
+            select(Job)
+            .where(
+                or_(
+                    Job.status == "queued",
+                    and_(
+                        Job.status == "running",
+                        Job.started < now - timedelta(seconds=timeout),
+                    ),
+                ),
+                Job.attempts < max_attempts,
+            )
+            .order_by(Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+
+        result = await self._session.execute(statement=stmt)
+        job = result.scalar_one_or_none()
+        if job is not None:
+            job.status = "running"
+            job.started = now
+            job.attempts += 1
+            await self._session.flush()
+
+        return job
+
+    async def report(self, job_id: int, progress: dict[str, Any]) -> None:
+        """Store the latest progress of a running job.
+
+        :param job_id: Job database id
+        :param progress: The progress event
+
+        """
+        stmt = (
+            update(Job)
+            .where(Job.id == job_id, Job.status == "running")
+            .values(progress=progress)
+        )
+
+        await self._session.execute(statement=stmt)
+
+    async def finish(
+        self,
+        job_id: int,
+        attempt: int,
+        result: Optional[dict[str, Any]] = None,
+        result_key: Optional[str] = None,
+        failed: bool = False,
+    ) -> bool:
+        """Store the outcome of a running job and return whether it was stored.
+
+        The outcome is dropped when the job was claimed again or failed
+        as abandoned meanwhile, the attempt no longer owns the job then.
+
+        :param job_id: Job database id
+        :param attempt: Number of the attempt which claimed the job
+        :param result: Decoded message or why none was found or the error,
+            defaults to None
+        :param result_key: Storage key of the encoded image, defaults to None
+        :param failed: Whether the job failed, defaults to False
+
+        """
+        stmt = (
+            update(Job)
+            .where(
+                Job.id == job_id,
+                Job.status == "running",
+                Job.attempts == attempt,
+            )
+            .values(
+                status="failed" if failed else "done",
+                result=result,
+                result_key=result_key,
+                finished=datetime.now(),
+            )
+            .returning(Job.id)
+        )
+
+        finished = await self._session.execute(statement=stmt)
+        return finished.scalar_one_or_none() is not None
+
+    async def fail_abandoned(
+        self,
+        timeout: int,
+        max_attempts: int,
+    ) -> list[int]:
+        """Fail stale jobs which can not be claimed again and return their ids.
+
+        :param timeout: Number of seconds after which a running job is stale
+        :param max_attempts: Maximal number of times a job is claimed
+
+        """
+        stmt = (
+            update(Job)
+            .where(
+                Job.status == "running",
+                Job.started < datetime.now() - timedelta(seconds=timeout),
+                Job.attempts >= max_attempts,
+            )
+            .values(
+                status="failed",
+                result={"detail": "the job was abandoned by its workers"},
+                finished=datetime.now(),
+            )
+            .returning(Job.id)
+        )
+
+        result = await self._session.execute(statement=stmt)
+
+        return list(result.scalars())
+
+    async def _delete(self, *where: Any) -> list[str]:
+        """Delete jobs and return storage keys of their blobs.
+
+        :param where: Conditions of the deleted jobs
+
+        """
+        stmt = (
+            delete(Job).where(*where).returning(Job.input_key, Job.result_key)
+        )
+
+        result = await self._session.execute(statement=stmt)
+
+        return [key for row in result for key in row if key]
+
+    async def clear(self, older_than: timedelta) -> list[str]:
+        """Delete finished jobs and return storage keys of their blobs.
+
+        :param older_than: Age of the deleted jobs
+
+        """
+        return await self._delete(
+            Job.status.in_(("done", "failed")),
+            Job.finished <= datetime.now() - older_than,
+        )
+
+    async def delete(self, user_id: int) -> list[str]:
+        """Delete all User jobs and return storage keys of their blobs.
+
+        :param user_id: User database id
+
+        """
+        return await self._delete(Job.user_id == user_id)
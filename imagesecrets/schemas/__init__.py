@@ -1,3 +1,4 @@
 from .base import *  # noqa
 from .image import *  # noqa
+from .job import *  # noqa
 from .user import *  # noqa
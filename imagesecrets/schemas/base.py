@@ -59,3 +59,21 @@ class Token(BaseModel):
 
     access_token: str
     token_type: str
+
+
+class Admission(BaseModel):
+    """Response model for admission control metrics."""
+
+    in_flight: int
+    users: int
+    waiting: int
+    admitted: int
+    rejected: int
+    budget: int
+    user_budget: int
+
+
+class Metrics(BaseModel):
+    """Response model for metrics route."""
+
+    admission: Admission
@@ -2,8 +2,9 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import Optional
 
-from pydantic import conint
+from pydantic import BaseModel, Field, conint
 
 from imagesecrets.constants import MESSAGE_DELIMITER
 from imagesecrets.schemas.base import ModelSchema
@@ -22,7 +23,7 @@ class ImageCreate(_ImageBase):
     delimiter: str = MESSAGE_DELIMITER
     lsb_amount: conint(ge=1, le=8) = 1
 
-    filename: str
+    filename: Optional[str] = None
 
 
 class ImageUpdate(_ImageBase):
@@ -34,3 +35,21 @@ class Image(ImageCreate):
 
     created: datetime
     updated: datetime
+
+
+class Probe(BaseModel):
+    """Response model for a quick check of an image."""
+
+    found: bool
+    format: Optional[str] = None
+    lsb_amount: Optional[int] = Field(default=None, ge=1, le=8)
+    length: Optional[int] = None
+
+
+class Capacity(BaseModel):
+    """Response model for the message capacity of an image."""
+
+    width: int
+    height: int
+    capacity: dict[int, int]
+    lsb_amount: Optional[int] = Field(default=None, ge=1, le=8)
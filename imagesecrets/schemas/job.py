@@ -0,0 +1,25 @@
+"""Job schemas."""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Optional
+
+from imagesecrets.schemas.base import ModelSchema
+
+
+class Job(ModelSchema):
+    """Response model for an encoding or decoding job."""
+
+    id: int
+    kind: str
+    status: str
+    image_name: str
+    params: dict[str, Any]
+    result: Optional[dict[str, Any]] = None
+    progress: Optional[dict[str, Any]] = None
+    # path of the encoded image once the job is done
+    result_url: Optional[str] = None
+    attempts: int
+    created: datetime
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
@@ -0,0 +1,278 @@
+"""Worker which runs the encoding and decoding jobs.
+
+The web application only stores the uploaded images and queues the jobs,
+any number of workers on any number of nodes claim them from the database,
+run them and store the results. Start a worker with::
+
+    python -m imagesecrets.worker
+
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, cast
+
+import imagesecrets.database.user.models  # noqa: F401, maps relationships
+from imagesecrets.api import dependencies
+from imagesecrets.config import settings
+from imagesecrets.core import decode, encode
+from imagesecrets.core.executor import Executor, TaskStopped
+from imagesecrets.core.progress import Progress
+from imagesecrets.core.util import image
+from imagesecrets.database import base
+from imagesecrets.database.image.services import ImageService
+from imagesecrets.database.job.services import JobService
+from imagesecrets.schemas.image import ImageCreate
+
+if TYPE_CHECKING:
+    from imagesecrets.core.storage import Storage
+    from imagesecrets.database.job.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+class Outcome(NamedTuple):
+    """Outcome of a job.
+
+    :param result: Decoded message or why none was found or the error
+    :param data: Data of the encoded image
+    :param message: The decoded message
+    :param failed: Whether the job failed
+
+    """
+
+    result: Optional[dict[str, Any]] = None
+    data: Optional[bytes] = None
+    message: Optional[decode.Message] = None
+    failed: bool = False
+
+
+async def process(
+    job: Job,
+    executor: Executor,
+    image_storage: Storage,
+    progress: Optional[Progress] = None,
+) -> Outcome:
+    """Encode or decode the uploaded image of a job.
+
+    :param job: The claimed job
+    :param executor: Executor which runs the encoding or decoding
+    :param image_storage: Storage of the uploaded image
+    :param progress: Progress of the job, defaults to None
+
+    """
+    data = await image_storage.get(cast(str, job.input_key))
+    params = job.params
+    if job.kind == "encode":
+        try:
+            encoded = await executor.run(
+                encode.api,
+                message=params["message"],
+                file=data,
+                delimiter=params["delimiter"],
+                lsb_n=params["lsb_n"],
+                reverse=params["reverse"],
+                header=params["header"],
+                workers=settings.image_workers,
+                tile_size=settings.image_tile_size,
+                level=settings.png_compress_level,
+                filter_type=settings.png_filter,
+                progress=progress,
+            )
+        except ValueError as e:
+            return Outcome(result={"detail": e.args[0]}, failed=True)
+        return Outcome(data=encoded)
+
+    try:
+        message = await executor.run(
+            decode.api,
+            image_data=data,
+            delimiter=params["delimiter"],
+            lsb_n=params["lsb_n"],
+            reverse=params["reverse"],
+            workers=settings.image_workers,
+            tile_size=settings.image_tile_size,
+            progress=progress,
+        )
+    except TaskStopped as e:
+        return Outcome(result={"detail": e.args[0]})
+    return Outcome(
+        result={
+            "message": message.text,
+            "lsb_amount": message.lsb_n,
+            "reverse": message.reverse,
+        },
+        message=message,
+    )
+
+
+async def complete(
+    job: Job,
+    outcome: Outcome,
+    image_storage: Storage,
+) -> None:
+    """Store the outcome of a job and the history record of its image.
+
+    Nothing is stored when the job was claimed again meanwhile.
+
+    :param job: The claimed job
+    :param outcome: Outcome of the job
+    :param image_storage: Storage of the encoded image
+
+    """
+    params = job.params
+    result_key = None
+    if outcome.data is not None:
+        # identical results share a single stored blob
+        result_key = image.content_filename(image.content_hash(outcome.data))
+
+    # the outcome, the blob references and the history are committed together
+    async with base.get_session() as session:
+        image_service = ImageService(session=session)
+        stored = await JobService(session=session).finish(
+            cast(int, job.id),
+            cast(int, job.attempts),
+            result=outcome.result,
+            result_key=result_key,
+            failed=outcome.failed,
+        )
+        if not stored:
+            # a worker which claimed the job again stores its own outcome
+            logger.warning("outcome of job %d was dropped", job.id)
+            return
+
+        if result_key is not None:
+            if await image_service.reference(result_key) == 1:
+                await image_storage.put(result_key, cast(bytes, outcome.data))
+            if params["save"]:
+                # the history record holds its own reference of the blob
+                await image_service.reference(result_key)
+                await image_service.create_encoded(
+                    user_id=cast(int, job.user_id),
+                    data=ImageCreate(
+                        image_name=job.image_name,
+                        message=params["message"],
+                        delimiter=params["delimiter"],
+                        lsb_amount=params["lsb_n"],
+                        filename=result_key,
+                    ),
+                )
+        elif outcome.message and params["storage"] != "ephemeral":
+            filename = None
+            if params["storage"] == "original":
+                filename = cast(str, job.input_key)
+                await image_service.reference(filename)
+            await image_service.create_decoded(
+                user_id=cast(int, job.user_id),
+                data=ImageCreate(
+                    image_name=job.image_name,
+                    message=outcome.message.text,
+                    delimiter=params["delimiter"],
+                    lsb_amount=outcome.message.lsb_n,
+                    filename=filename,
+                ),
+            )
+
+
+async def publish(job_id: int, progress: Progress) -> None:
+    """Store the latest progress of a job until it is closed.
+
+    :param job_id: Job database id
+    :param progress: Progress of the job
+
+    """
+    try:
+        async for event in progress.changes():
+            async with base.get_session() as session:
+                await JobService(session=session).report(
+                    job_id,
+                    event._asdict(),
+                )
+            # the events reported meanwhile are coalesced into the latest one
+            await asyncio.sleep(settings.job_poll_interval)
+    except Exception:
+        # the progress is informative, the job itself is not affected
+        logger.exception("progress of job %d could not be stored", job_id)
+
+
+async def run(job: Job, executor: Executor, image_storage: Storage) -> None:
+    """Run a claimed job and store its outcome.
+
+    :param job: The claimed job
+    :param executor: Executor which runs the encoding or decoding
+    :param image_storage: Storage of the images
+
+    """
+    progress = Progress()
+    publisher = asyncio.ensure_future(publish(cast(int, job.id), progress))
+    try:
+        outcome = await process(job, executor, image_storage, progress)
+    except Exception:
+        logger.exception("job %d failed", job.id)
+        outcome = Outcome(
+            result={"detail": "the job could not be processed"},
+            failed=True,
+        )
+    finally:
+        progress.close()
+        # the outcome is stored instead of the latest progress
+        publisher.cancel()
+    await complete(job, outcome, image_storage)
+
+
+async def work(
+    executor: Executor,
+    image_storage: Storage,
+    *,
+    once: bool = False,
+) -> None:
+    """Claim and run jobs until cancelled.
+
+    :param executor: Executor which runs the encoding or decoding
+    :param image_storage: Storage of the images
+    :param once: Whether to return once there is no job to claim,
+        defaults to False
+
+    """
+    while True:
+        # the claim is committed right away, so the row lock is released
+        async with base.get_session() as session:
+            job_service = JobService(session=session)
+            job = await job_service.claim(
+                timeout=settings.job_timeout,
+                max_attempts=settings.job_max_attempts,
+            )
+            if job is None:
+                await job_service.fail_abandoned(
+                    timeout=settings.job_timeout,
+                    max_attempts=settings.job_max_attempts,
+                )
+
+        if job is not None:
+            await run(job, executor, image_storage)
+        elif once:
+            return
+        else:
+            await asyncio.sleep(settings.job_poll_interval)
+
+
+async def main() -> None:
+    """Run the configured number of job loops."""
+    executor = dependencies.get_executor()
+    image_storage = dependencies.get_storage()
+    try:
+        await asyncio.gather(
+            *(
+                work(executor, image_storage)
+                for _ in range(settings.job_concurrency)
+            ),
+        )
+    finally:
+        executor.shutdown()
+        image_storage.shutdown()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
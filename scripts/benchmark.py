@@ -0,0 +1,361 @@
+"""Simple CLI tool to benchmark the image processing functions."""
+from __future__ import annotations
+
+import os
+import sys
+import timeit
+from argparse import ArgumentParser, Namespace
+from io import BytesIO
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+BASE = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE))
+
+from imagesecrets.constants import (  # noqa: E402
+    MESSAGE_DELIMITER,
+    PNG_COMPRESS_LEVEL,
+    PNG_FILTER,
+    TILE_SIZE,
+)
+from imagesecrets.core import decode  # noqa: E402
+from imagesecrets.core.util import array, parallel, png  # noqa: E402
+
+MEGAPIXEL = 1_000_000
+CHANNELS = 3
+
+DEFAULT_SIZES = (1, 5, 10, 25, 50)
+DEFAULT_WORKERS = tuple(
+    2 ** exp for exp in range((os.cpu_count() or 1).bit_length())
+)
+
+
+def best_time(func: Callable[[], object], repeat: int) -> float:
+    """Return the best execution time of the given function in seconds.
+
+    :param func: Function to benchmark
+    :param repeat: How many times to repeat the measurement
+
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def report(name: str, megapixels: int, seconds: float) -> None:
+    """Print a single benchmark result.
+
+    :param name: Name of the benchmarked implementation
+    :param megapixels: Size of the benchmarked image in megapixels
+    :param seconds: Measured execution time
+
+    """
+    print(f"{name:>12} | {megapixels:>4} MP | {seconds * 1000:>12,.2f} ms")
+
+
+def legacy_decode_text(array: np.ndarray, delimiter: str) -> str:
+    """Decode text with the original character by character loop.
+
+    :param array: The array from which to decode the text
+    :param delimiter: Identifier that whole message has been extracted
+
+    """
+    text = ""
+    delim_len = len(delimiter)
+
+    for num in array:
+        text += chr(num)
+        if text.endswith(delimiter):
+            return text[:-delim_len]
+    raise StopIteration("No message found after scanning the whole image.")
+
+
+def bench_decode_text(args: Namespace) -> None:
+    """Benchmark the delimiter search on images without any message.
+
+    :param args: Parsed CLI arguments
+
+    """
+    rng = np.random.default_rng(seed=0)
+
+    for megapixels in args.sizes:
+        # size of the buffer returned by ``decode.prepare_array`` with lsb_n=1
+        size = megapixels * MEGAPIXEL * CHANNELS // 8
+        packed = rng.integers(0, 256, size=size, dtype=np.uint8)
+
+        for name, function in (
+            ("legacy", legacy_decode_text),
+            ("bytes.find", decode.decode_text),
+        ):
+
+            def run() -> None:
+                try:
+                    function(packed, MESSAGE_DELIMITER)
+                except StopIteration:
+                    pass
+
+            report(name, megapixels, best_time(run, repeat=args.repeat))
+
+
+def legacy_extract(pixels: np.ndarray, lsb_n: int) -> np.ndarray:
+    """Extract the least significant bits by unpacking every pixel value.
+
+    :param pixels: Flat array with pixel values
+    :param lsb_n: Number of least significant bits
+
+    """
+    return np.packbits(np.unpackbits(pixels).reshape(-1, 8)[:, -lsb_n:])
+
+
+def legacy_insert(pixels: np.ndarray, data: np.ndarray, lsb_n: int) -> None:
+    """Insert bytes by unpacking, editing, packing and concatenating pixel values.
+
+    :param pixels: Flat array with pixel values
+    :param data: Bytes to insert
+    :param lsb_n: Number of least significant bits
+
+    """
+    bits = np.unpackbits(data)
+    bits.resize(
+        (np.ceil(bits.size / lsb_n).astype(int), lsb_n),
+        refcheck=False,
+    )
+    unpacked = np.unpackbits(pixels[: bits.shape[0]]).reshape(-1, 8)
+    unpacked[:, -lsb_n:] = bits
+    np.concatenate((np.packbits(unpacked), pixels[bits.shape[0] :]))
+
+
+def new_insert(pixels: np.ndarray, data: np.ndarray, lsb_n: int) -> None:
+    """Insert bytes with the shift and mask kernels.
+
+    :param pixels: Flat array with pixel values
+    :param data: Bytes to insert
+    :param lsb_n: Number of least significant bits
+
+    """
+    array.embed_payload(pixels, array.split_bytes(data, lsb_n), lsb_n)
+
+
+def bench_kernels(args: Namespace) -> None:
+    """Benchmark extraction and insertion of least significant bits.
+
+    Insertion fills half of the image capacity.
+
+    :param args: Parsed CLI arguments
+
+    """
+    rng = np.random.default_rng(seed=0)
+
+    for megapixels in args.sizes:
+        size = megapixels * MEGAPIXEL * CHANNELS
+        pixels = rng.integers(0, 256, size=size, dtype=np.uint8)
+
+        for lsb_n in range(1, 9):
+            data = pixels[: size * lsb_n // 16]
+            for name, function in (
+                (f"unpack/{lsb_n}", lambda: legacy_extract(pixels, lsb_n)),
+                (
+                    f"extract/{lsb_n}",
+                    lambda: array.extract_bytes(pixels, lsb_n),
+                ),
+                (f"edit/{lsb_n}", lambda: legacy_insert(pixels, data, lsb_n)),
+                (f"insert/{lsb_n}", lambda: new_insert(pixels, data, lsb_n)),
+            ):
+                report(name, megapixels, best_time(function, args.repeat))
+
+
+def bench_reverse(args: Namespace) -> None:
+    """Benchmark forward and reverse decoding of a short message.
+
+    :param args: Parsed CLI arguments
+
+    """
+    rng = np.random.default_rng(seed=0)
+    message = array.message_payload("message", MESSAGE_DELIMITER, 1)
+
+    for megapixels in args.sizes:
+        size = megapixels * MEGAPIXEL * CHANNELS
+        forward = rng.integers(0, 256, size=size, dtype=np.uint8)
+        array.embed_payload(forward, message, 1)
+        backward = forward[::-1].copy()
+
+        for name, pixels, reverse in (
+            ("forward", forward, False),
+            ("reverse", backward, True),
+        ):
+            report(
+                name,
+                megapixels,
+                best_time(
+                    lambda: decode.main(pixels, MESSAGE_DELIMITER, 1, reverse),
+                    args.repeat,
+                ),
+            )
+
+
+def bench_parallel(args: Namespace) -> None:
+    """Benchmark tiled extraction and insertion with different worker counts.
+
+    Insertion fills the whole image capacity.
+
+    :param args: Parsed CLI arguments
+
+    """
+    rng = np.random.default_rng(seed=0)
+
+    for megapixels in args.sizes:
+        size = megapixels * MEGAPIXEL * CHANNELS
+        pixels = rng.integers(0, 256, size=size, dtype=np.uint8)
+
+        for lsb_n in (1, 3, 8):
+            payload = array.split_bytes(pixels[: size * lsb_n // 8], lsb_n)
+            for workers in args.workers:
+                for name, function in (
+                    (
+                        f"extract/{lsb_n}/{workers}",
+                        lambda: parallel.extract_bytes(
+                            pixels,
+                            lsb_n,
+                            workers=workers,
+                            tile_size=args.tile_size,
+                        ),
+                    ),
+                    (
+                        f"insert/{lsb_n}/{workers}",
+                        lambda: parallel.embed_payload(
+                            pixels,
+                            payload,
+                            lsb_n,
+                            workers=workers,
+                            tile_size=args.tile_size,
+                        ),
+                    ),
+                ):
+                    report(name, megapixels, best_time(function, args.repeat))
+
+
+def photo_like(megapixels: int, rng: np.random.Generator) -> np.ndarray:
+    """Return pixel values with smooth gradients and a little noise.
+
+    Random pixel values are not compressible at all,
+    so they would not show the cost of real compression.
+
+    :param megapixels: Size of the image in megapixels
+    :param rng: Random number generator for the noise
+
+    """
+    width = int((megapixels * MEGAPIXEL * 4 / 3) ** 0.5)
+    height = megapixels * MEGAPIXEL // width
+    y, x = np.mgrid[:height, :width]
+    channels = (x // 7 + y // 5, x * y // 1000, y // 3)
+    pixels = np.stack(channels, axis=-1).astype(np.uint8)
+    return pixels + rng.integers(0, 4, pixels.shape, dtype=np.uint8)
+
+
+def bench_png(args: Namespace) -> None:
+    """Benchmark saving encoded images by Pillow and by the parallel writer.
+
+    The size of the written image is printed next to the time.
+
+    :param args: Parsed CLI arguments
+
+    """
+    rng = np.random.default_rng(seed=0)
+
+    for megapixels in args.sizes:
+        pixels = photo_like(megapixels, rng)
+        sizes = {}
+
+        def pillow() -> None:
+            buffer = BytesIO()
+            Image.fromarray(pixels).save(
+                buffer,
+                format="PNG",
+                compress_level=args.level,
+            )
+            sizes["pillow"] = buffer.tell()
+
+        report("pillow", megapixels, best_time(pillow, args.repeat))
+        print(f"{'':>12} | {sizes['pillow']:>20,} B")
+
+        for workers in args.workers:
+
+            def write() -> None:
+                data = png.encode(
+                    pixels,
+                    level=args.level,
+                    filter_type=args.filter,
+                    workers=workers,
+                )
+                sizes["png"] = sum(map(len, data))
+
+            report(f"png/{workers}", megapixels, best_time(write, args.repeat))
+            print(f"{'':>12} | {sizes['png']:>20,} B")
+
+
+BENCHMARKS: dict[str, Callable[[Namespace], None]] = {
+    "decode-text": bench_decode_text,
+    "kernels": bench_kernels,
+    "parallel": bench_parallel,
+    "png": bench_png,
+    "reverse": bench_reverse,
+}
+
+
+def get_parser() -> ArgumentParser:
+    """Return Parser for CLI arguments."""
+    p = ArgumentParser()
+    p.add_argument(
+        "benchmark",
+        type=str,
+        choices=BENCHMARKS,
+        help="name of the benchmark to run",
+    )
+    p.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="image sizes in megapixels",
+    )
+    p.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=DEFAULT_WORKERS,
+        help="numbers of threads to compare in the parallel benchmark",
+    )
+    p.add_argument(
+        "--tile-size",
+        type=int,
+        default=TILE_SIZE,
+        help="number of pixel values processed by one thread at once",
+    )
+    p.add_argument(
+        "--level",
+        type=int,
+        default=PNG_COMPRESS_LEVEL,
+        help="zlib compression level of the png benchmark",
+    )
+    p.add_argument(
+        "--filter",
+        type=str,
+        choices=png.FILTERS,
+        default=PNG_FILTER,
+        help="row filter of the parallel png writer",
+    )
+    p.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="how many times to repeat every measurement",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    parser = get_parser()
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
@@ -2,8 +2,10 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import random
 from pathlib import Path
-from typing import TYPE_CHECKING, Generator, Optional
+from typing import TYPE_CHECKING, Callable, Generator, Optional
 
 import numpy as np
 import pytest
@@ -18,7 +20,11 @@ if TYPE_CHECKING:
     from pytest_mock import MockFixture
 
     from imagesecrets.config import Settings
+    from imagesecrets.core.admission import Admission
+    from imagesecrets.core.cache import ResultCache
+    from imagesecrets.core.storage import LocalStorage
     from imagesecrets.database.image.services import ImageService
+    from imagesecrets.database.job.services import JobService
     from imagesecrets.database.token.services import TokenService
     from imagesecrets.database.user.services import UserService
 
@@ -71,7 +77,11 @@ def patch_tasks(request, monkeypatch, api_settings: Settings) -> None:
     async def clear_tokens():
         """Test function to clear tokens."""
 
+    async def clear_jobs():
+        """Test function to clear jobs."""
+
     monkeypatch.setattr(tasks, "clear_tokens", lambda: clear_tokens())
+    monkeypatch.setattr(tasks, "clear_jobs", lambda: clear_jobs())
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -163,6 +173,51 @@ def token_service(database_session) -> TokenService:
     return TokenService(session=database_session)
 
 
+@pytest.fixture()
+def job_service(database_session) -> JobService:
+    from imagesecrets.database.job.services import JobService
+
+    return JobService(session=database_session)
+
+
+@pytest.fixture()
+def api_storage(
+    monkeypatch: MonkeyPatch,
+    tmp_path: Path,
+    api_settings: Settings,
+) -> Generator[LocalStorage, None, None]:
+    """Return storage of saved images in a temporary directory."""
+    from imagesecrets.api import dependencies
+
+    monkeypatch.setattr(api_settings, "storage_backend", "local")
+    monkeypatch.setattr(api_settings, "storage_dir", tmp_path / "images")
+    dependencies.get_storage.cache_clear()
+    storage = dependencies.get_storage()
+    yield storage
+    storage.shutdown()
+    dependencies.get_storage.cache_clear()
+
+
+@pytest.fixture()
+def api_decode_cache() -> Generator[ResultCache, None, None]:
+    """Return an empty cache of decoding results."""
+    from imagesecrets.api import dependencies
+
+    dependencies.get_decode_cache.cache_clear()
+    yield dependencies.get_decode_cache()
+    dependencies.get_decode_cache.cache_clear()
+
+
+@pytest.fixture()
+def api_admission() -> Generator[Admission, None, None]:
+    """Return an idle admission control of encodings and decodings."""
+    from imagesecrets.api import dependencies
+
+    dependencies.get_admission.cache_clear()
+    yield dependencies.get_admission()
+    dependencies.get_admission.cache_clear()
+
+
 @pytest.fixture()
 def api_client(
     monkeypatch,
@@ -171,9 +226,15 @@ def api_client(
     user_service,
     token_service,
     image_service,
+    job_service,
+    api_storage,
+    api_decode_cache,
+    api_admission,
+    database_session,
 ) -> Generator[TestClient, None, None]:
     """Return api test client connected to fake database."""
     from imagesecrets.database.image.services import ImageService
+    from imagesecrets.database.job.services import JobService
     from imagesecrets.database.token.services import TokenService
     from imagesecrets.database.user.services import UserService
     from imagesecrets.interface import app
@@ -183,8 +244,8 @@ def api_client(
             app.router.on_startup.pop(index)
 
     for service, fixture in zip(
-        (UserService, ImageService, TokenService),
-        (user_service, image_service, token_service),
+        (UserService, ImageService, TokenService, JobService),
+        (user_service, image_service, token_service, job_service),
     ):
 
         async def func(obj=fixture):
@@ -212,6 +273,13 @@ def api_client(
 
             monkeypatch.setattr(service, method, mock)
 
+    @contextlib.asynccontextmanager
+    async def get_session():
+        yield database_session
+
+    # the routes polling the database open a session of their own
+    monkeypatch.setattr("imagesecrets.database.base.get_session", get_session)
+
     # testclient __enter__ and __exit__ deals with event loop
     with TestClient(app=app) as client:
         yield client
@@ -280,3 +348,29 @@ def delimiter_array() -> ArrayLike:
             [1],
         ),
     )
+
+
+@pytest.fixture(scope="session")
+def embed_message() -> Callable[..., ArrayLike]:
+    """Return a function which hides a message in random pixel values."""
+    from imagesecrets.core.util import array
+
+    def embed(
+        message: str,
+        delimiter: str,
+        lsb_n: int,
+        size: int = 4096,
+    ) -> ArrayLike:
+        bits, length = array.message_bit(message, delimiter, lsb_n)
+        values = np.packbits(
+            np.pad(bits, ((0, 0), (8 - lsb_n, 0))),
+            axis=1,
+        ).ravel()
+
+        noise = random.Random(lsb_n).randbytes(size)
+        pixels = np.frombuffer(noise, dtype=np.uint8).copy()
+        pixels[:length] &= np.uint8(0xFF ^ ((1 << lsb_n) - 1))
+        pixels[:length] |= values
+        return pixels
+
+    return embed
@@ -20,6 +20,87 @@ def test_get_config():
     assert config is settings
 
 
+def test_get_executor():
+    from imagesecrets.api import dependencies
+    from imagesecrets.config import settings
+
+    executor = dependencies.get_executor()
+
+    assert executor is dependencies.get_executor()
+    assert executor.kind == settings.executor
+    assert executor.queue_size == settings.executor_queue_size
+
+
+def test_get_storage(monkeypatch, tmp_path):
+    from imagesecrets.api import dependencies
+    from imagesecrets.config import settings
+    from imagesecrets.core.storage import LocalStorage, S3Storage
+
+    monkeypatch.setattr(settings, "storage_dir", tmp_path)
+    dependencies.get_storage.cache_clear()
+    try:
+        storage = dependencies.get_storage()
+        assert isinstance(storage, LocalStorage)
+        assert storage is dependencies.get_storage()
+        assert storage.directory == tmp_path
+
+        dependencies.get_storage.cache_clear()
+        monkeypatch.setattr(settings, "storage_backend", "s3")
+        monkeypatch.setattr(settings, "s3_endpoint", "http://minio:9000")
+        monkeypatch.setattr(settings, "s3_bucket", "images")
+        storage = dependencies.get_storage()
+        assert isinstance(storage, S3Storage)
+        assert storage.url("key") == "http://minio:9000/images/key"
+    finally:
+        dependencies.get_storage.cache_clear()
+
+
+def test_get_flights():
+    from imagesecrets.api import dependencies
+    from imagesecrets.core.flight import SingleFlight
+
+    flights = dependencies.get_flights()
+
+    assert isinstance(flights, SingleFlight)
+    assert flights is dependencies.get_flights()
+
+
+def test_get_decode_cache(monkeypatch, tmp_path):
+    from imagesecrets.api import dependencies
+    from imagesecrets.config import settings
+
+    monkeypatch.setattr(settings, "decode_cache_dir", tmp_path)
+    dependencies.get_decode_cache.cache_clear()
+    try:
+        cache = dependencies.get_decode_cache()
+
+        assert cache is dependencies.get_decode_cache()
+        assert cache.max_bytes == settings.decode_cache_bytes
+        assert cache.directory == tmp_path
+        assert cache.max_disk_bytes == settings.decode_cache_dir_bytes
+    finally:
+        dependencies.get_decode_cache.cache_clear()
+
+
+def test_get_admission(monkeypatch):
+    from imagesecrets.api import dependencies
+    from imagesecrets.config import settings
+
+    monkeypatch.setattr(settings, "admission_budget", 100)
+    monkeypatch.setattr(settings, "admission_user_budget", 10)
+    dependencies.get_admission.cache_clear()
+    try:
+        admission = dependencies.get_admission()
+
+        assert admission is dependencies.get_admission()
+        assert admission.budget == 100
+        assert admission.user_budget == 10
+        assert admission.max_wait == settings.admission_max_wait
+        assert admission.queue_size == settings.admission_queue_size
+    finally:
+        dependencies.get_admission.cache_clear()
+
+
 @pytest.mark.asyncio
 async def test_user_loader_ok(
     api_client,
@@ -6,6 +6,8 @@ import pytest
 from starlette.responses import JSONResponse
 
 from imagesecrets.api import handlers
+from imagesecrets.core.admission import Rejected
+from imagesecrets.core.executor import QueueFull
 
 if TYPE_CHECKING:
     from pytest_mock import MockFixture
@@ -19,8 +21,8 @@ def test_init(mocker: MockFixture) -> None:
 
     handlers.init(app=app)
 
-    assert app.exception_handler.call_count == 3
-    assert handler.call_count == 3
+    assert app.exception_handler.call_count == 5
+    assert handler.call_count == 5
 
 
 @pytest.mark.asyncio
@@ -63,3 +65,37 @@ async def test_not_authenticated(mocker: MockFixture) -> None:
     assert isinstance(result, JSONResponse)
     assert result.status_code == 200
     assert result.body == b'{"detail":"invalid access token"}'
+
+
+@pytest.mark.asyncio
+async def test_queue_full() -> None:
+    result = await handlers.queue_full(req=..., exc=QueueFull())
+
+    assert isinstance(result, JSONResponse)
+    assert result.status_code == 503
+    assert result.headers["Retry-After"] == "1"
+    assert result.body == b'{"detail":"the server is busy, try again later"}'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "user, status_code, detail",
+    [
+        (
+            True,
+            429,
+            b"too many images are being processed for you, try again later",
+        ),
+        (False, 503, b"the server is busy, try again later"),
+    ],
+)
+async def test_rejected(user: bool, status_code: int, detail: bytes) -> None:
+    result = await handlers.rejected(
+        req=...,
+        exc=Rejected(retry_after=10, user=user),
+    )
+
+    assert isinstance(result, JSONResponse)
+    assert result.status_code == status_code
+    assert result.headers["Retry-After"] == "10"
+    assert result.body == b'{"detail":"' + detail + b'"}'
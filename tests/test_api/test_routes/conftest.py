@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING
 import pytest
 
 if TYPE_CHECKING:
+    from imagesecrets.database.job.models import Job
     from imagesecrets.database.user.models import User
 
 
@@ -69,3 +70,22 @@ def return_encoded(return_user) -> User:
         updated=datetime(year=3000, month=2, day=2),
         user_id=return_user.id,
     )
+
+
+@pytest.fixture()
+def return_job(return_user) -> Job:
+    """Return a fake database job entry."""
+    from imagesecrets.database.job.models import Job
+
+    return Job(
+        id=1,
+        kind="encode",
+        status="queued",
+        image_name="test_image_name",
+        params={"message": "test_message"},
+        input_key="test_input.png",
+        attempts=0,
+        created=datetime(year=2000, month=1, day=1),
+        updated=datetime(year=2000, month=1, day=1),
+        user_id=return_user.id,
+    )
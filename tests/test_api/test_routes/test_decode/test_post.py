@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+import hashlib
+import random
 from datetime import datetime
+from io import BytesIO
 from pathlib import Path
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pytest
+from PIL import Image
+
+from imagesecrets.constants import TILE_SIZE
+from imagesecrets.core.decode import Message
+from imagesecrets.core.flight import SingleFlight
 
 if TYPE_CHECKING:
     from fastapi.testclient import TestClient
     from pytest import MockFixture
 
+    from imagesecrets.core.admission import Admission
+    from imagesecrets.core.cache import ResultCache
+    from imagesecrets.core.storage import LocalStorage
     from imagesecrets.database.image.models import DecodedImage  # noqa
     from imagesecrets.database.image.services import ImageService
     from imagesecrets.database.user.models import User
@@ -18,16 +30,16 @@ URL = "api/decode"
 
 
 @pytest.mark.parametrize(
-    "delimiter, lsb_n",
+    "delimiter, lsb_n, reverse",
     [
-        ("dlm1", 1),
-        ("dlm2", 2),
-        ("dlm3", 3),
-        ("dlm5", 4),
-        ("dlm5", 5),
-        ("dlm6", 6),
-        ("dlm7", 7),
-        ("dlm8", 8),
+        ("dlm1", 1, False),
+        ("dlm2", 2, True),
+        ("dlm3", 3, False),
+        ("dlm5", 4, True),
+        ("dlm5", 5, False),
+        ("dlm6", 6, True),
+        ("dlm7", 7, False),
+        ("dlm8", 8, True),
     ],
 )
 def test_post(
@@ -40,6 +52,7 @@ def test_post(
     mocker: MockFixture,
     delimiter: str,
     lsb_n: int,
+    reverse: bool,
 ) -> None:
     """Test a successful post request."""
     from imagesecrets.database.image.models import DecodedImage  # noqa
@@ -61,7 +74,7 @@ def test_post(
 
     decode_api = mocker.patch(
         "imagesecrets.core.decode.api",
-        return_value=("decoded>test", test_image_path),
+        return_value=Message("decoded>test", lsb_n, reverse),
     )
 
     response = api_client.post(
@@ -70,6 +83,7 @@ def test_post(
         data={
             "custom-delimiter": delimiter,
             "least-significant-bit-amount": lsb_n,
+            "reverse": reverse,
         },
         headers=access_token,
     )
@@ -78,7 +92,9 @@ def test_post(
         image_data=buffer,
         delimiter=delimiter,
         lsb_n=lsb_n,
-        reverse=False,
+        reverse=reverse,
+        workers=1,
+        tile_size=TILE_SIZE,
     )
 
     assert response.status_code == 201
@@ -119,6 +135,8 @@ def test_post_200(
         delimiter="delimiter",
         lsb_n=1,
         reverse=False,
+        workers=1,
+        tile_size=TILE_SIZE,
     )
 
     assert response.status_code == 200
@@ -126,6 +144,265 @@ def test_post_200(
     headers = response.headers
     assert headers["custom-delimiter"] == "delimiter"
     assert headers["least-significant-bit-amount"] == repr(1)
+    assert headers["auto-detect"] == repr(False)
+
+
+@pytest.mark.parametrize("found", [True, False])
+def test_post_cached(
+    api_client: TestClient,
+    api_decode_cache: ResultCache,
+    image_service: ImageService,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+    found: bool,
+) -> None:
+    """Test that the same image is decoded only once."""
+    from imagesecrets.database.image.models import DecodedImage  # noqa
+
+    image_service.create_decoded.side_effect = lambda user_id, data: (
+        DecodedImage(
+            **data.dict(),
+            created=datetime(year=2000, month=1, day=1),
+            updated=datetime(year=3000, month=2, day=2),
+            user_id=user_id,
+        )
+    )
+    decode_api = mocker.patch(
+        "imagesecrets.core.decode.api",
+        return_value=Message("decoded", 2, False),
+        side_effect=None if found else StopIteration("nothing found"),
+    )
+    run = mocker.spy(SingleFlight, "run")
+
+    responses = [
+        api_client.post(
+            URL,
+            files=api_image_file,
+            data={"custom-delimiter": "dlm", "auto-detect": True},
+            headers=access_token,
+        )
+        for _ in range(3)
+    ]
+
+    decode_api.assert_called_once()
+    assert api_decode_cache.stats[:3] == (2, 0, 1)
+    for response in responses:
+        assert response.status_code == (201 if found else 200)
+        if found:
+            assert response.json()["message"] == "decoded"
+            assert response.json()["lsb_amount"] == 2
+        else:
+            assert response.json()["detail"] == "nothing found"
+
+    # the decoding is coalesced with identical running decodings
+    run.assert_called_once()
+    assert run.call_args[0][1][0] == "decode.api"
+
+    # other parameters are decoded again
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"custom-delimiter": "dlm"},
+        headers=access_token,
+    )
+    assert response.status_code == (201 if found else 200)
+    assert decode_api.call_count == 2
+
+
+def test_post_spooled(
+    api_client: TestClient,
+    access_token,
+    mocker: MockFixture,
+) -> None:
+    """Test that large uploads are passed on as a mapping of the spooled file."""
+    rng = random.Random(0)
+    pixels = np.frombuffer(rng.randbytes(700 * 700 * 3), dtype=np.uint8)
+    data = BytesIO()
+    Image.fromarray(pixels.reshape(700, 700, 3)).save(data, format="PNG")
+    assert data.tell() > 2 ** 20  # larger than the spooling limit
+
+    received = []
+
+    def api(image_data, **_):
+        received.append((type(image_data), image_data == data.getvalue()))
+        raise StopIteration("nothing")
+
+    mocker.patch("imagesecrets.core.decode.api", side_effect=api)
+
+    response = api_client.post(
+        URL,
+        files={"file": ("image.png", data.getvalue(), "image/png")},
+        headers=access_token,
+    )
+
+    assert response.status_code == 200
+    assert received == [(memoryview, True)]
+
+
+def test_post_auto_detect(
+    api_client: TestClient,
+    image_service: ImageService,
+    return_user: User,
+    access_token,
+    api_image_file,
+    test_image_path: Path,
+    mocker: MockFixture,
+) -> None:
+    """Test a post request which detects the lsb amount and direction."""
+    from imagesecrets.database.image.models import DecodedImage  # noqa
+
+    image_service.create_decoded.side_effect = lambda user_id, data: (
+        DecodedImage(
+            **data.dict(),
+            created=datetime(year=2000, month=1, day=1),
+            updated=datetime(year=3000, month=2, day=2),
+            user_id=user_id,
+        )
+    )
+    decode_api = mocker.patch(
+        "imagesecrets.core.decode.api",
+        return_value=Message("decoded", 5, True),
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"custom-delimiter": "dlm", "auto-detect": True},
+        headers=access_token,
+    )
+
+    decode_api.assert_called_once_with(
+        image_data=api_image_file["file"][1],
+        delimiter="dlm",
+        lsb_n=None,
+        reverse=None,
+        workers=1,
+        tile_size=TILE_SIZE,
+    )
+    assert response.status_code == 201
+    json_ = response.json()
+    assert json_["message"] == "decoded"
+    assert json_["lsb_amount"] == 5
+
+
+@pytest.mark.parametrize(
+    "storage, save, record",
+    [
+        ("original", True, True),
+        ("history", False, True),
+        ("ephemeral", False, False),
+    ],
+)
+def test_post_storage(
+    api_client: TestClient,
+    api_storage: LocalStorage,
+    image_service: ImageService,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+    storage: str,
+    save: bool,
+    record: bool,
+) -> None:
+    """Test that the storage mode decides what is saved."""
+    from imagesecrets.database.image.models import DecodedImage  # noqa
+
+    image_service.create_decoded.side_effect = lambda user_id, data: (
+        DecodedImage(
+            **data.dict(),
+            created=datetime(year=2000, month=1, day=1),
+            updated=datetime(year=3000, month=2, day=2),
+            user_id=user_id,
+        )
+    )
+    mocker.patch(
+        "imagesecrets.core.decode.api",
+        return_value=Message("decoded", 1, False),
+    )
+    image_service.reference.return_value = 1
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"storage": storage},
+        headers=access_token,
+    )
+
+    assert image_service.create_decoded.called is record
+    assert response.status_code == 201
+    json_ = response.json()
+    assert json_["message"] == "decoded"
+    data = api_image_file["file"][1]
+    key = f"{hashlib.sha256(data).hexdigest()}.png"
+    assert json_["filename"] == (key if save else None)
+    files = list(api_storage.directory.iterdir())
+    if save:
+        image_service.reference.assert_called_once_with(key)
+        assert files == [api_storage.path(key)]
+        assert files[0].read_bytes() == data
+    else:
+        image_service.reference.assert_not_called()
+        assert not files
+
+
+def test_post_storage_shared(
+    api_client: TestClient,
+    api_storage: LocalStorage,
+    image_service: ImageService,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test that an image which is already stored is not written again."""
+    from imagesecrets.database.image.models import DecodedImage  # noqa
+
+    image_service.create_decoded.side_effect = lambda user_id, data: (
+        DecodedImage(
+            **data.dict(),
+            created=datetime(year=2000, month=1, day=1),
+            updated=datetime(year=3000, month=2, day=2),
+            user_id=user_id,
+        )
+    )
+    image_service.reference.return_value = 2
+    mocker.patch(
+        "imagesecrets.core.decode.api",
+        return_value=Message("decoded", 1, False),
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"storage": "original"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 201
+    key = f"{hashlib.sha256(api_image_file['file'][1]).hexdigest()}.png"
+    assert response.json()["filename"] == key
+    image_service.reference.assert_called_once_with(key)
+    assert not list(api_storage.directory.iterdir())
+
+
+def test_post_storage_invalid(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test a post request with an unknown storage mode."""
+    decode_api = mocker.patch("imagesecrets.core.decode.api")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"storage": "disk"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 422
+    decode_api.assert_not_called()
 
 
 def test_post_415(
@@ -143,3 +420,155 @@ def test_post_415(
 
     assert response.status_code == 415
     assert response.json()["detail"] == "only .png images are supported"
+
+
+def test_post_413(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test a post request with an image which has too many pixels."""
+    mocker.patch(
+        "imagesecrets.api.routers.decode.config.max_image_pixels", 100
+    )
+    task = mocker.patch("imagesecrets.core.decode.api")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        headers=access_token,
+    )
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "the image has too many pixels"
+    task.assert_not_called()
+
+
+def test_post_503(
+    api_client: TestClient,
+    access_token,
+    mocker: MockFixture,
+    api_image_file,
+) -> None:
+    """Test a post request when all workers are busy."""
+    from imagesecrets.core.executor import QueueFull
+
+    mocker.patch(
+        "imagesecrets.core.executor.Executor.run",
+        side_effect=QueueFull,
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        headers=access_token,
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_post_admission(
+    api_client: TestClient,
+    api_admission: Admission,
+    return_user: User,
+    access_token,
+    api_image_file,
+    test_image_path: Path,
+    mocker: MockFixture,
+) -> None:
+    """Test that the decoding is charged the cost of its image."""
+    mocker.patch(
+        "imagesecrets.core.decode.api",
+        return_value=Message("decoded", 1, False),
+    )
+    acquire = mocker.spy(api_admission, "acquire")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"auto-detect": True, "storage": "ephemeral"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 201
+    width, height = Image.open(test_image_path).size
+    # detection charges every least significant bit
+    acquire.assert_called_once_with(return_user.id, width * height * 8)
+    assert api_admission.stats.in_flight == 0
+    assert api_admission.stats.admitted == 1
+
+
+def test_post_429(
+    api_client: TestClient,
+    api_admission: Admission,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test a post request when the user has too many running decodings."""
+    from imagesecrets.core.admission import Rejected
+    from imagesecrets.core.flight import SingleFlight
+
+    mocker.patch.object(
+        api_admission,
+        "acquire",
+        side_effect=Rejected(retry_after=10, user=True),
+    )
+    task = mocker.patch("imagesecrets.core.decode.api")
+    run = mocker.spy(SingleFlight, "run")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        headers=access_token,
+    )
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+    task.assert_not_called()
+    # a rejected request does not join the decodings of others
+    run.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_decoding_retried(mocker: MockFixture) -> None:
+    """Test that a retry of a large image joins its running decoding."""
+    import asyncio
+
+    from imagesecrets.api.routers.decode import run_decoding
+    from imagesecrets.core.admission import Admission
+
+    admission = Admission(budget=100, user_budget=10)
+    flights = SingleFlight()
+    executor = mocker.Mock()
+
+    async def run(func, **kwargs):
+        await asyncio.sleep(0.01)
+        return Message("decoded", 1, False)
+
+    executor.run = mocker.AsyncMock(side_effect=run)
+
+    # the image costs the whole budget of the user
+    results = await asyncio.gather(
+        *(
+            run_decoding(
+                executor,
+                flights,
+                admission,
+                "key",
+                1,
+                1000,
+                image_data=b"",
+            )
+            for _ in range(2)
+        ),
+        return_exceptions=True,
+    )
+
+    assert results == [Message("decoded", 1, False)] * 2
+    executor.run.assert_called_once()
+    assert admission.stats.admitted == 1
+    assert admission.stats.rejected == 0
+    assert admission.in_flight == 0
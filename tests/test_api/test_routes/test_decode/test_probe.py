@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pytest
+
+from imagesecrets.core.decode import Probe
+from imagesecrets.core.util import png
+
+if TYPE_CHECKING:
+    from fastapi.testclient import TestClient
+    from pytest import MockFixture
+
+    from imagesecrets.core.admission import Admission
+    from imagesecrets.database.user.models import User
+
+URL = "api/decode/probe"
+
+
+@pytest.mark.parametrize(
+    "result, found",
+    [
+        (Probe(format="header", lsb_n=3, length=100), True),
+        (Probe(format="delimiter", lsb_n=1, length=0), True),
+        (Probe(format="text", lsb_n=8), True),
+        (Probe(), False),
+    ],
+)
+def test_post(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+    result: Probe,
+    found: bool,
+) -> None:
+    """Test a successful probe request."""
+    buffer = api_image_file["file"][1]
+
+    probe = mocker.patch("imagesecrets.core.decode.probe", return_value=result)
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"custom-delimiter": "dlm"},
+        headers=access_token,
+    )
+
+    probe.assert_called_once_with(image_data=buffer, delimiter="dlm")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "found": found,
+        "format": result.format,
+        "lsb_amount": result.lsb_n,
+        "length": result.length,
+    }
+
+
+def test_post_415(
+    api_client: TestClient,
+    access_token,
+) -> None:
+    """Test a probe request with invalid media type."""
+    response = api_client.post(
+        URL,
+        files={
+            "file": (Path(__file__).name, open(__file__).read(), "image/png"),
+        },
+        headers=access_token,
+    )
+
+    assert response.status_code == 415
+    assert response.json()["detail"] == "only .png images are supported"
+
+
+def test_post_413(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test a probe request with an image which has too many pixels."""
+    mocker.patch(
+        "imagesecrets.api.routers.decode.config.max_image_pixels", 100
+    )
+    task = mocker.patch("imagesecrets.core.decode.probe")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        headers=access_token,
+    )
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "the image has too many pixels"
+    task.assert_not_called()
+
+
+def test_post_admission(
+    api_client: TestClient,
+    api_admission: Admission,
+    return_user: User,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test that the probe is charged the cost of the rows it decodes."""
+    mocker.patch("imagesecrets.core.decode.probe", return_value=Probe())
+    acquire = mocker.spy(api_admission, "acquire")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        headers=access_token,
+    )
+
+    assert response.status_code == 200
+    # the whole 64x64 test image fits into the probed values
+    acquire.assert_called_once_with(return_user.id, 64 * 64 * 8)
+    assert api_admission.stats.in_flight == 0
+
+
+@pytest.mark.parametrize(
+    "header, rows",
+    [
+        (png.Header(4000, 3000, 8, 2, 0), 6),
+        (png.Header(10, 10, 8, 6, 0), 10),
+        (png.Header(4000, 3000, 16, 0, 0), 3000),
+        (png.Header(4000, 3000, 8, 2, 1), 3000),
+    ],
+)
+def test_probe_rows(header: png.Header, rows: int) -> None:
+    """Test the number of rows decoded by a probe."""
+    from imagesecrets.api.routers.decode import probe_rows
+
+    assert probe_rows(header) == rows
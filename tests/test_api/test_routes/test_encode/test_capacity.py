@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pytest
+
+from imagesecrets.constants import MESSAGE_DELIMITER
+
+if TYPE_CHECKING:
+    from fastapi.testclient import TestClient
+    from pytest import MockFixture
+
+URL = "api/encode/capacity"
+
+
+@pytest.mark.parametrize(
+    "data, lsb_amount",
+    [
+        ({}, None),
+        ({"message-length": 0}, 1),
+        ({"message-length": 1000}, 1),
+        ({"message-length": 2000}, 2),
+        ({"message-length": 10 ** 6}, None),
+        ({"message-length": 2000, "length-header": True}, 2),
+        ({"message-length": 1000, "custom-delimiter": "d" * 600}, 2),
+    ],
+)
+def test_post(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    data: dict,
+    lsb_amount: int,
+) -> None:
+    """Test a successful capacity request."""
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data=data,
+        headers=access_token,
+    )
+
+    assert response.status_code == 200
+    json_ = response.json()
+    assert (json_["width"], json_["height"]) == (64, 64)
+    assert json_["lsb_amount"] == lsb_amount
+    delimiter = data.get("custom-delimiter", MESSAGE_DELIMITER)
+    if not data.get("length-header"):
+        assert json_["capacity"]["1"] == 64 * 64 * 3 // 8 - len(delimiter)
+        assert json_["capacity"]["8"] == 64 * 64 * 3 - len(delimiter)
+
+
+def test_post_no_decode(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test that the capacity is computed without decoding any pixels."""
+    data = mocker.patch("imagesecrets.core.util.image.data")
+
+    response = api_client.post(URL, files=api_image_file, headers=access_token)
+
+    assert response.status_code == 200
+    data.assert_not_called()
+
+
+def test_post_415(
+    api_client: TestClient,
+    access_token,
+) -> None:
+    """Test a capacity request with invalid media type."""
+    response = api_client.post(
+        URL,
+        files={
+            "file": (Path(__file__).name, open(__file__).read(), "image/png"),
+        },
+        headers=access_token,
+    )
+
+    assert response.status_code == 415
+    assert response.json()["detail"] == "only .png images are supported"
+
+
+def test_post_413(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test a capacity request with an image which has too many pixels."""
+    mocker.patch(
+        "imagesecrets.api.routers.encode.config.max_image_pixels", 100
+    )
+
+    response = api_client.post(URL, files=api_image_file, headers=access_token)
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "the image has too many pixels"
@@ -1,49 +1,66 @@
 from __future__ import annotations
 
+import hashlib
+from io import BytesIO
 from json import JSONDecodeError
 from pathlib import Path
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pytest
+from PIL import Image
+
+from imagesecrets.constants import PNG_COMPRESS_LEVEL, PNG_FILTER, TILE_SIZE
+from imagesecrets.core import encode
+from imagesecrets.core.util import image
 
 if TYPE_CHECKING:
     from fastapi.testclient import TestClient
     from pytest import MockFixture
 
+    from imagesecrets.core.admission import Admission
+    from imagesecrets.core.storage import LocalStorage
     from imagesecrets.database.image.models import DecodedImage  # noqa
 
 URL = "api/encode"
 
 
 @pytest.mark.parametrize(
-    "message, delimiter, lsb_n",
+    "message, delimiter, lsb_n, header, reverse",
     [
-        ("test1", "dlm1", 1),
-        ("test2", "dlm2", 2),
-        ("test3", "dlm3", 3),
-        ("test4", "dlm5", 4),
-        ("test5", "dlm5", 5),
-        ("test6", "dlm6", 6),
-        ("test7", "dlm7", 7),
-        ("test8", "dlm8", 8),
+        ("test1", "dlm1", 1, False, False),
+        ("test2", "dlm2", 2, True, True),
+        ("test3", "dlm3", 3, False, True),
+        ("test4", "dlm5", 4, True, False),
+        ("test5", "dlm5", 5, False, False),
+        ("test6", "dlm6", 6, True, True),
+        ("test7", "dlm7", 7, False, True),
+        ("test8", "dlm8", 8, True, False),
     ],
 )
 def test_post(
     api_client: TestClient,
+    api_storage: LocalStorage,
+    image_service,
     api_image_file,
     test_image_path: Path,
     mocker: MockFixture,
     message: str,
     delimiter: str,
     lsb_n: int,
+    header: bool,
+    reverse: bool,
     access_token,
 ) -> None:
     """Test a successful post request."""
     buffer = api_image_file["file"][1]
+    data = test_image_path.read_bytes()
+    key = f"{hashlib.sha256(data).hexdigest()}.png"
+    image_service.reference.return_value = 1
 
     encode_api = mocker.patch(
         "imagesecrets.core.encode.api",
-        return_value=test_image_path,
+        return_value=data,
     )
 
     response = api_client.post(
@@ -53,6 +70,8 @@ def test_post(
             "message": message,
             "custom-delimiter": delimiter,
             "least-significant-bit-amount": lsb_n,
+            "length-header": header,
+            "reverse": reverse,
         },
         headers=access_token,
     )
@@ -62,27 +81,42 @@ def test_post(
         file=buffer,
         delimiter=delimiter,
         lsb_n=lsb_n,
-        reverse=False,
+        reverse=reverse,
+        header=header,
+        workers=1,
+        tile_size=TILE_SIZE,
+        level=PNG_COMPRESS_LEVEL,
+        filter_type=PNG_FILTER,
     )
 
     assert response.status_code == 201
     with pytest.raises(JSONDecodeError):  # png image data should be returned
         response.json()
+    assert response.content == data
     headers = response.headers
     assert headers["image-name"] == "test.png"
     assert headers["message"] == message
     assert headers["delimiter"] == delimiter
     assert headers["lsb_amount"] == repr(lsb_n)
+    assert headers["reverse"] == repr(reverse)
     assert headers["content-type"] == "image/png"
-    assert 'filename="test.png"' in headers["content-disposition"]
+    # the image is downloaded under the name it was stored with
+    assert f'filename="{key}"' in headers["content-disposition"]
+    image_service.reference.assert_called_once_with(key)
+    assert api_storage.path(key).read_bytes() == data
+    image_service.create_encoded.assert_called_once()
+    assert image_service.create_encoded.call_args[1]["data"].filename == key
 
 
 def test_post_image_too_small(
     api_client: TestClient,
     api_image_file,
     access_token,
+    mocker: MockFixture,
 ) -> None:
     """Test a post request with a message longer than fits into the uploaded image."""
+    encode_api = mocker.spy(encode, "api")
+
     msg = "test" * 1000
     response = api_client.post(
         URL,
@@ -99,6 +133,8 @@ def test_post_image_too_small(
     assert headers["message"] == msg
     assert headers["delimiter"] == "<{~stop-here~}>"
     assert headers["lsb_amount"] == repr(1)
+    # the message was rejected before the image was decoded
+    encode_api.assert_not_called()
 
 
 def test_post_415(
@@ -117,3 +153,358 @@ def test_post_415(
 
     assert response.status_code == 415
     assert response.json()["detail"] == "only .png images are supported"
+
+
+def test_post_413(
+    api_client: TestClient,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+) -> None:
+    """Test a post request with an image which has too many pixels."""
+    mocker.patch(
+        "imagesecrets.api.routers.encode.config.max_image_pixels", 100
+    )
+    task = mocker.patch("imagesecrets.core.encode.api")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"message": "test message"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "the image has too many pixels"
+    task.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "stream, save", [(True, True), (True, False), (False, False)]
+)
+def test_post_stream(
+    api_client: TestClient,
+    api_storage: LocalStorage,
+    api_image_file,
+    image_service,
+    test_image_array,
+    mocker: MockFixture,
+    access_token,
+    stream: bool,
+    save: bool,
+) -> None:
+    """Test a post request which streams the image while it is compressed."""
+    image_service.reference.return_value = 1
+    mocker.patch(
+        "imagesecrets.core.util.image.new_filename",
+        return_value="streamed.png",
+    )
+    encode_api = mocker.patch(
+        "imagesecrets.core.encode.api",
+        side_effect=lambda **_: b"".join(
+            image.encode_array(test_image_array),
+        ),
+    )
+    array_api = mocker.patch(
+        "imagesecrets.core.encode.array_api",
+        return_value=test_image_array,
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"message": "test", "stream": stream, "save-image": save},
+        headers=access_token,
+    )
+
+    assert array_api.called is stream
+    assert encode_api.called is not stream
+    assert response.status_code == 201
+    assert response.headers["content-type"] == "image/png"
+    disposition = response.headers["content-disposition"]
+    if save:
+        # the stored name is known only once the image was sent
+        assert disposition == "attachment"
+    else:
+        assert disposition == 'attachment; filename="streamed.png"'
+    with Image.open(BytesIO(response.content)) as img:
+        np.testing.assert_array_equal(np.asarray(img), test_image_array)
+
+    key = f"{hashlib.sha256(response.content).hexdigest()}.png"
+    fp = api_storage.path(key)
+    assert fp.is_file() == save
+    if save:
+        assert fp.read_bytes() == response.content
+        image_service.create_encoded.assert_called_once()
+        assert image_service.create_encoded.call_args[1]["data"].filename == (
+            key
+        )
+    else:
+        image_service.create_encoded.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_store_incomplete(
+    api_storage: LocalStorage,
+    mocker: MockFixture,
+) -> None:
+    """Test that a stream which was not sent completely is not stored."""
+    from imagesecrets.api.routers.encode import collect, store
+    from imagesecrets.schemas.image import ImageCreate
+
+    image_service = mocker.AsyncMock()
+
+    spool = api_storage.spool()
+    chunks = collect(iter([b"first", b"second"]), spool)
+    next(chunks)  # the client disconnects after the first chunk
+
+    await store(
+        api_storage,
+        image_service,
+        spool,
+        filename=None,
+        user_id=1,
+        data=ImageCreate(
+            delimiter="dlm",
+            lsb_amount=1,
+            message="test",
+            image_name="test.png",
+        ),
+    )
+
+    assert not spool.complete
+    image_service.reference.assert_not_called()
+    image_service.create_encoded.assert_not_called()
+    assert not list(api_storage.directory.iterdir())
+
+
+def test_post_shared(
+    api_client: TestClient,
+    api_storage: LocalStorage,
+    image_service,
+    api_image_file,
+    test_image_path: Path,
+    mocker: MockFixture,
+    access_token,
+) -> None:
+    """Test that an image which is already stored is not written again."""
+    data = test_image_path.read_bytes()
+    image_service.reference.return_value = 3
+    mocker.patch("imagesecrets.core.encode.api", return_value=data)
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"message": "test"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 201
+    key = f"{hashlib.sha256(data).hexdigest()}.png"
+    image_service.reference.assert_called_once_with(key)
+    assert not list(api_storage.directory.iterdir())
+    assert image_service.create_encoded.call_args[1]["data"].filename == key
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_post_coalesced(
+    api_client: TestClient,
+    api_image_file,
+    test_image_path: Path,
+    test_image_array,
+    mocker: MockFixture,
+    access_token,
+    stream: bool,
+) -> None:
+    """Test that the encoding is keyed by the image and its parameters."""
+    from imagesecrets.core.flight import SingleFlight
+
+    run = mocker.spy(SingleFlight, "run")
+    mocker.patch(
+        "imagesecrets.core.encode.api",
+        return_value=test_image_path.read_bytes(),
+    )
+    mocker.patch(
+        "imagesecrets.core.encode.array_api",
+        return_value=test_image_array,
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={
+            "message": "test",
+            "custom-delimiter": "dlm",
+            "least-significant-bit-amount": 2,
+            "stream": stream,
+            "save-image": False,
+        },
+        headers=access_token,
+    )
+
+    assert response.status_code == 201
+    run.assert_called_once()
+    key = run.call_args[0][1]
+    digest = hashlib.sha256(api_image_file["file"][1]).hexdigest()
+    if stream:
+        assert key == (
+            "encode.array_api",
+            digest,
+            "test",
+            "dlm",
+            2,
+            False,
+            False,
+        )
+    else:
+        assert key[:7] == (
+            "encode.api",
+            digest,
+            "test",
+            "dlm",
+            2,
+            False,
+            False,
+        )
+        assert key[7:] == (PNG_COMPRESS_LEVEL, PNG_FILTER)
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_post_admission(
+    api_client: TestClient,
+    api_admission: Admission,
+    return_user,
+    api_image_file,
+    test_image_path: Path,
+    test_image_array,
+    mocker: MockFixture,
+    access_token,
+    stream: bool,
+) -> None:
+    """Test that the encoding is charged the cost of its image."""
+    mocker.patch(
+        "imagesecrets.core.encode.api",
+        return_value=test_image_path.read_bytes(),
+    )
+    mocker.patch(
+        "imagesecrets.core.encode.array_api",
+        return_value=test_image_array,
+    )
+    acquire = mocker.spy(api_admission, "acquire")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={
+            "message": "test",
+            "least-significant-bit-amount": 3,
+            "stream": stream,
+            "save-image": False,
+        },
+        headers=access_token,
+    )
+
+    assert response.status_code == 201
+    width, height = Image.open(test_image_path).size
+    acquire.assert_called_once_with(return_user.id, width * height * 3)
+    assert api_admission.stats.in_flight == 0
+
+
+def test_post_stream_admission(
+    api_client: TestClient,
+    api_admission: Admission,
+    api_image_file,
+    test_image_array,
+    mocker: MockFixture,
+    access_token,
+) -> None:
+    """Test that a streamed image is charged until it is compressed."""
+    mocker.patch(
+        "imagesecrets.core.encode.array_api",
+        return_value=test_image_array,
+    )
+    charged = []
+
+    def encode_array(arr, **kwargs):
+        for chunk in (b"first", b"second"):
+            charged.append(api_admission.in_flight)
+            yield chunk
+
+    mocker.patch(
+        "imagesecrets.core.util.image.encode_array",
+        side_effect=encode_array,
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"message": "test", "stream": True, "save-image": False},
+        headers=access_token,
+    )
+
+    assert response.status_code == 201
+    assert response.content == b"firstsecond"
+    assert charged[0] > 0
+    assert charged[1] == charged[0]
+    assert api_admission.in_flight == 0
+
+
+def test_post_stream_error(
+    api_client: TestClient,
+    api_admission: Admission,
+    api_image_file,
+    mocker: MockFixture,
+    access_token,
+) -> None:
+    """Test that a streamed encoding which fails releases its charge."""
+    mocker.patch(
+        "imagesecrets.core.encode.array_api",
+        side_effect=ValueError("test error"),
+    )
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"message": "test", "stream": True},
+        headers=access_token,
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "test error"
+    assert api_admission.in_flight == 0
+
+
+@pytest.mark.parametrize("user, status_code", [(True, 429), (False, 503)])
+def test_post_rejected(
+    api_client: TestClient,
+    api_admission: Admission,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+    user: bool,
+    status_code: int,
+) -> None:
+    """Test a post request which does not fit into the admission budget."""
+    from imagesecrets.core.admission import Rejected
+    from imagesecrets.core.flight import SingleFlight
+
+    mocker.patch.object(
+        api_admission,
+        "acquire",
+        side_effect=Rejected(retry_after=10, user=user),
+    )
+    task = mocker.patch("imagesecrets.core.encode.api")
+    run = mocker.spy(SingleFlight, "run")
+
+    response = api_client.post(
+        URL,
+        files=api_image_file,
+        data={"message": "test message"},
+        headers=access_token,
+    )
+
+    assert response.status_code == status_code
+    assert response.headers["Retry-After"] == "10"
+    task.assert_not_called()
+    # a rejected request does not join the encodings of others
+    run.assert_not_called()
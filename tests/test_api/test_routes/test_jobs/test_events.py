@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fastapi.testclient import TestClient
+    from pytest import MockFixture
+
+    from imagesecrets.database.job.models import Job
+    from imagesecrets.database.job.services import JobService
+
+URL = "api/jobs/1/events"
+
+
+def parse(text: str) -> list[tuple[str, dict]]:
+    """Return names and data of the server-sent events."""
+    events = []
+    for block in text.strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append(
+            (name.removeprefix("event: "), json.loads(data[len("data: ") :]))
+        )
+    return events
+
+
+def test_events(
+    api_client: TestClient,
+    job_service: JobService,
+    return_job: Job,
+    access_token,
+    mocker: MockFixture,
+) -> None:
+    """Test that changes of a job are streamed until it is done."""
+    from imagesecrets.database.job.models import Job
+
+    mocker.patch(
+        "imagesecrets.api.routers.job.config.job_poll_interval",
+        0,
+    )
+
+    def job(status: str, progress=None, **kwargs) -> Job:
+        return Job(
+            id=return_job.id,
+            kind="encode",
+            status=status,
+            image_name=return_job.image_name,
+            params=return_job.params,
+            progress=progress,
+            attempts=1,
+            created=return_job.created,
+            **kwargs,
+        )
+
+    embed = {"stage": "embed", "fraction": 0.5}
+    job_service.get.side_effect = [
+        return_job,
+        return_job,
+        return_job,
+        job("running"),
+        job("running", embed),
+        job("running", embed),
+        job(
+            "done",
+            result_key="test_result.png",
+            finished=datetime(year=2000, month=1, day=2),
+        ),
+    ]
+
+    response = api_client.get(URL, headers=access_token)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse(response.text)
+    assert [name for name, _ in events] == [
+        "progress",
+        "progress",
+        "progress",
+        "done",
+    ]
+    assert [data for _, data in events[:3]] == [
+        {"status": "queued", "progress": None},
+        {"status": "running", "progress": None},
+        {"status": "running", "progress": embed},
+    ]
+    assert events[3][1]["result_url"] == "/api/jobs/1/result"
+
+
+def test_events_404(
+    api_client: TestClient,
+    job_service: JobService,
+    access_token,
+) -> None:
+    """Test that no stream is opened for a job which does not exist."""
+    job_service.get.return_value = None
+
+    response = api_client.get(URL, headers=access_token)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "no job with id 1 found"
+
+
+def test_events_sessions(
+    api_client: TestClient,
+    job_service: JobService,
+    return_job: Job,
+    access_token,
+    database_session,
+    mocker: MockFixture,
+) -> None:
+    """Test that every poll of the stream reads the job in its own session."""
+    import contextlib
+
+    from imagesecrets.database.job.models import Job
+
+    mocker.patch(
+        "imagesecrets.api.routers.job.config.job_poll_interval",
+        0,
+    )
+    sessions = []
+
+    @contextlib.asynccontextmanager
+    async def get_session():
+        sessions.append("open")
+        yield database_session
+        sessions[-1] = "closed"
+
+    mocker.patch("imagesecrets.database.base.get_session", get_session)
+    done = Job(
+        id=return_job.id,
+        kind="encode",
+        status="done",
+        image_name=return_job.image_name,
+        params=return_job.params,
+        attempts=1,
+        created=return_job.created,
+    )
+    job_service.get.side_effect = [return_job, return_job, done]
+
+    response = api_client.get(URL, headers=access_token)
+
+    assert response.status_code == 200
+    assert sessions == ["closed"] * 3
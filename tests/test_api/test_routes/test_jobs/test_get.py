@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from fastapi.testclient import TestClient
+    from pytest import MockFixture
+
+    from imagesecrets.core.storage import LocalStorage
+    from imagesecrets.database.job.models import Job
+    from imagesecrets.database.job.services import JobService
+    from imagesecrets.database.user.models import User
+
+URL = "api/jobs/1"
+
+
+def test_get(
+    api_client: TestClient,
+    job_service: JobService,
+    return_user: User,
+    return_job: Job,
+    access_token,
+) -> None:
+    """Test that a job is returned right away without waiting."""
+    job_service.get.return_value = return_job
+
+    response = api_client.get(URL, headers=access_token)
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+    job_service.get.assert_called_once_with(job_id=1, user_id=return_user.id)
+
+
+def test_get_wait(
+    api_client: TestClient,
+    job_service: JobService,
+    return_job: Job,
+    access_token,
+    mocker: MockFixture,
+) -> None:
+    """Test that a job is polled until it is done."""
+    from imagesecrets.database.job.models import Job
+
+    mocker.patch(
+        "imagesecrets.api.routers.job.config.job_poll_interval",
+        0.01,
+    )
+    done = Job(
+        id=return_job.id,
+        kind="encode",
+        status="done",
+        image_name=return_job.image_name,
+        params=return_job.params,
+        result_key="test_result.png",
+        attempts=1,
+        created=return_job.created,
+        finished=datetime(year=2000, month=1, day=2),
+    )
+    job_service.get.side_effect = [return_job, return_job, done]
+
+    response = api_client.get(URL, params={"wait": 5}, headers=access_token)
+
+    assert response.status_code == 200
+    json_ = response.json()
+    assert json_["status"] == "done"
+    assert json_["result_url"] == "/api/jobs/1/result"
+    assert job_service.get.call_count == 3
+
+
+def test_get_wait_timeout(
+    api_client: TestClient,
+    job_service: JobService,
+    return_job: Job,
+    access_token,
+    mocker: MockFixture,
+) -> None:
+    """Test that an unfinished job is returned after the longest wait."""
+    mocker.patch("imagesecrets.api.routers.job.config.job_max_wait", 0)
+    job_service.get.return_value = return_job
+
+    response = api_client.get(URL, params={"wait": 60}, headers=access_token)
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+    job_service.get.assert_called_once()
+
+
+def test_get_404(
+    api_client: TestClient,
+    job_service: JobService,
+    access_token,
+) -> None:
+    """Test a get request of a job which does not exist."""
+    job_service.get.return_value = None
+
+    response = api_client.get(URL, headers=access_token)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "no job with id 1 found"
+
+
+def test_get_result(
+    api_client: TestClient,
+    api_storage: LocalStorage,
+    job_service: JobService,
+    return_job: Job,
+    access_token,
+) -> None:
+    """Test a successful download of an encoded image."""
+    api_storage.path("test_result.png").write_bytes(b"test data")
+    return_job.result_key = "test_result.png"
+    job_service.get.return_value = return_job
+
+    response = api_client.get(f"{URL}/result", headers=access_token)
+
+    assert response.status_code == 200
+    assert response.content == b"test data"
+    assert response.headers["content-type"] == "image/png"
+
+
+@pytest.mark.parametrize("found", [False, True])
+def test_get_result_404(
+    api_client: TestClient,
+    job_service: JobService,
+    return_job: Job,
+    access_token,
+    found: bool,
+) -> None:
+    """Test a download of a job which has no encoded image."""
+    job_service.get.return_value = return_job if found else None
+
+    response = api_client.get(f"{URL}/result", headers=access_token)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "no encoded image of job 1 found"
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from fastapi.testclient import TestClient
+    from pytest import MockFixture
+
+    from imagesecrets.core.storage import LocalStorage
+    from imagesecrets.database.image.services import ImageService
+    from imagesecrets.database.job.models import Job
+    from imagesecrets.database.job.services import JobService
+    from imagesecrets.database.user.models import User
+
+URL = "api/jobs"
+
+
+@pytest.mark.parametrize("references", [1, 2])
+def test_post_encode(
+    api_client: TestClient,
+    api_storage: LocalStorage,
+    image_service: ImageService,
+    job_service: JobService,
+    return_user: User,
+    return_job: Job,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+    references: int,
+) -> None:
+    """Test that an encoding is queued instead of run."""
+    task = mocker.patch("imagesecrets.core.encode.api")
+    image_service.reference.return_value = references
+    job_service.create.return_value = return_job
+    data = api_image_file["file"][1]
+    key = f"{hashlib.sha256(data).hexdigest()}.png"
+
+    response = api_client.post(
+        f"{URL}/encode",
+        files=api_image_file,
+        data={"message": "test message", "least-significant-bit-amount": 2},
+        headers=access_token,
+    )
+
+    assert response.status_code == 202
+    json_ = response.json()
+    assert json_["id"] == return_job.id
+    assert json_["status"] == "queued"
+    assert json_["result_url"] is None
+    task.assert_not_called()
+    image_service.reference.assert_called_once_with(key)
+    job_service.create.assert_called_once_with(
+        user_id=return_user.id,
+        kind="encode",
+        image_name=api_image_file["file"][0],
+        input_key=key,
+        params={
+            "message": "test message",
+            "delimiter": "<{~stop-here~}>",
+            "lsb_n": 2,
+            "reverse": False,
+            "header": False,
+            "save": True,
+        },
+    )
+    # only the first reference uploads the blob
+    assert api_storage.path(key).exists() is (references == 1)
+
+
+def test_post_encode_422(
+    api_client: TestClient,
+    job_service: JobService,
+    access_token,
+    api_image_file,
+) -> None:
+    """Test that a message which can not fit is not queued."""
+    response = api_client.post(
+        f"{URL}/encode",
+        files=api_image_file,
+        data={"message": "test message" * 100_000},
+        headers=access_token,
+    )
+
+    assert response.status_code == 422
+    assert response.json()["field"] == "file"
+    job_service.create.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "detect, lsb_n, reverse",
+    [(False, 3, True), (True, None, None)],
+)
+def test_post_decode(
+    api_client: TestClient,
+    job_service: JobService,
+    return_user: User,
+    return_job: Job,
+    access_token,
+    api_image_file,
+    detect: bool,
+    lsb_n: int | None,
+    reverse: bool | None,
+) -> None:
+    """Test that a decoding is queued instead of run."""
+    return_job.kind = "decode"
+    job_service.create.return_value = return_job
+
+    response = api_client.post(
+        f"{URL}/decode",
+        files=api_image_file,
+        data={
+            "custom-delimiter": "dlm",
+            "least-significant-bit-amount": 3,
+            "reverse": True,
+            "auto-detect": detect,
+            "storage": "history",
+        },
+        headers=access_token,
+    )
+
+    assert response.status_code == 202
+    assert response.json()["kind"] == "decode"
+    assert job_service.create.call_args[1]["params"] == {
+        "delimiter": "dlm",
+        "lsb_n": lsb_n,
+        "reverse": reverse,
+        "storage": "history",
+    }
+
+
+@pytest.mark.parametrize("kind", ["encode", "decode"])
+def test_post_415(
+    api_client: TestClient,
+    job_service: JobService,
+    access_token,
+    kind: str,
+) -> None:
+    """Test a post request with invalid media type."""
+    response = api_client.post(
+        f"{URL}/{kind}",
+        files={
+            "file": (Path(__file__).name, open(__file__).read(), "image/png"),
+        },
+        data={"message": "test message"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 415
+    job_service.create.assert_not_called()
+
+
+@pytest.mark.parametrize("kind", ["encode", "decode"])
+def test_post_413(
+    api_client: TestClient,
+    job_service: JobService,
+    access_token,
+    api_image_file,
+    mocker: MockFixture,
+    kind: str,
+) -> None:
+    """Test a post request with an image which has too many pixels."""
+    mocker.patch("imagesecrets.api.routers.job.config.max_image_pixels", 100)
+
+    response = api_client.post(
+        f"{URL}/{kind}",
+        files=api_image_file,
+        data={"message": "test message"},
+        headers=access_token,
+    )
+
+    assert response.status_code == 413
+    job_service.create.assert_not_called()
@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import contextlib
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from fastapi.testclient import TestClient
+    from pytest_mock import MockFixture
+
+    from imagesecrets.core.storage import LocalStorage
+    from imagesecrets.database.image.services import ImageService
+    from imagesecrets.database.job.services import JobService
+    from imagesecrets.database.user.models import User
+    from imagesecrets.database.user.services import UserService
 
 
 URL = "api/users/me"
@@ -11,9 +19,35 @@ URL = "api/users/me"
 
 def test_delete(
     api_client: TestClient,
+    api_storage: LocalStorage,
+    user_service: UserService,
+    image_service: ImageService,
+    job_service: JobService,
+    return_user: User,
     access_token,
+    mocker: MockFixture,
 ) -> None:
     """Test a successful delete request."""
+    for key in ("unused.png", "shared.png", "job.png"):
+        api_storage.path(key).write_bytes(b"data")
+    sessions = []
+
+    @contextlib.asynccontextmanager
+    async def get_session():
+        session = mocker.Mock()
+        sessions.append(session)
+        yield session
+        # no blob is removed before the deletion is committed
+        assert len(list(api_storage.directory.iterdir())) == 3
+
+    mocker.patch(
+        "imagesecrets.database.base.get_session",
+        get_session,
+    )
+    image_service.delete.return_value = ["unused.png"]
+    job_service.delete.return_value = ["job.png", "shared.png"]
+    image_service.release.return_value = ["job.png"]
+
     response = api_client.delete(
         URL,
         headers=access_token,
@@ -22,3 +56,12 @@ def test_delete(
     assert response.status_code == 202
     assert response.reason == "Accepted"
     assert response.json()["detail"] == "account deleted"
+    image_service.delete.assert_called_once_with(return_user.id)
+    job_service.delete.assert_called_once_with(return_user.id)
+    image_service.release.assert_called_once_with(["job.png", "shared.png"])
+    user_service.delete.assert_called_once_with(return_user.id)
+    # every deletion runs in a single transaction
+    assert len(sessions) == 1
+    assert list(api_storage.directory.iterdir()) == [
+        api_storage.path("shared.png"),
+    ]
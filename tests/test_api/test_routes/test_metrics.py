@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from _pytest.monkeypatch import MonkeyPatch
+    from fastapi.testclient import TestClient
+
+    from imagesecrets.core.admission import Admission
+
+
+def test_get(
+    api_client: TestClient,
+    api_admission: Admission,
+    access_token,
+) -> None:
+    """Test get request on the metrics route."""
+    api_admission.in_flight = 10
+    api_admission.admitted = 2
+
+    response = api_client.get("api/metrics", headers=access_token)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "admission": {
+            "in_flight": 10,
+            "users": 0,
+            "waiting": 0,
+            "admitted": 2,
+            "rejected": 0,
+            "budget": api_admission.budget,
+            "user_budget": api_admission.user_budget,
+        },
+    }
+
+
+def test_get_401(api_client: TestClient, monkeypatch: MonkeyPatch) -> None:
+    """Test that the metrics are not shown to anonymous users."""
+    from imagesecrets.api.exceptions import NotAuthenticated
+
+    def call(*args, **kwargs):
+        raise NotAuthenticated()
+
+    monkeypatch.setattr("fastapi_login.LoginManager.__call__", call)
+
+    response = api_client.get("api/metrics")
+
+    assert response.status_code == 401
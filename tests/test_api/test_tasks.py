@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import asyncio
+from datetime import timedelta
 from typing import TYPE_CHECKING
 
 import pytest
@@ -65,3 +66,33 @@ async def test_runner():
             continue
 
         await func()
+
+
+@pytest.mark.asyncio
+@pytest.mark.disable_autouse
+async def test_clear_jobs(mocker: MockFixture, database_session):
+    import contextlib
+
+    from imagesecrets.api import tasks
+
+    @contextlib.asynccontextmanager
+    async def get_session():
+        yield database_session
+
+    mocker.patch("imagesecrets.api.tasks.base.get_session", get_session)
+    storage = mocker.patch("imagesecrets.api.dependencies.get_storage")
+    storage.return_value.delete = mocker.AsyncMock()
+    clear = mocker.patch(
+        "imagesecrets.database.job.services.JobService.clear",
+        return_value=["unused.png", "shared.png"],
+    )
+    release = mocker.patch(
+        "imagesecrets.database.image.services.ImageService.release",
+        return_value=["unused.png"],
+    )
+
+    await tasks.clear_jobs()
+
+    clear.assert_called_once_with(older_than=timedelta(days=1))
+    release.assert_called_once_with(["unused.png", "shared.png"])
+    storage.return_value.delete.assert_called_once_with("unused.png")
@@ -0,0 +1,281 @@
+"""Test the module used for admission control by cost."""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from imagesecrets.core.admission import Admission, Rejected, Stats
+
+
+async def settle() -> None:
+    """Let the scheduled tasks run."""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_cost() -> None:
+    """Test the cost of an image."""
+    assert Admission.cost(width=10, height=20, lsb_n=3) == 600
+
+
+def test_user_budget_capped() -> None:
+    """Test that the budget of a user does not exceed the global one."""
+    admission = Admission(budget=10, user_budget=20)
+
+    assert admission.user_budget == 10
+
+
+@pytest.mark.asyncio
+async def test_run() -> None:
+    """Test that a request which fits is admitted right away."""
+    admission = Admission(budget=10, user_budget=5)
+    inside = []
+
+    async def func(value: int) -> int:
+        inside.append(admission.stats)
+        return value
+
+    assert await admission.run("user", 4, func, 1) == 1
+    assert inside == [
+        Stats(in_flight=4, users=1, waiting=0, admitted=1, rejected=0),
+    ]
+    assert admission.stats == Stats(
+        in_flight=0,
+        users=0,
+        waiting=0,
+        admitted=1,
+        rejected=0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_exception() -> None:
+    """Test that the cost of a failed request is released."""
+    admission = Admission(budget=10, user_budget=5)
+
+    async def func() -> None:
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        await admission.run("user", 4, func)
+    assert admission.in_flight == 0
+    assert admission.user_in_flight("user") == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_capped() -> None:
+    """Test that a request over the user budget is charged the budget."""
+    admission = Admission(budget=10, user_budget=5)
+
+    assert await admission.acquire("user", 100) == 5
+    assert admission.user_in_flight("user") == 5
+
+
+@pytest.mark.asyncio
+async def test_acquire_user_queued() -> None:
+    """Test that a request over the user budget waits for a release."""
+    admission = Admission(budget=10, user_budget=5, max_wait=5, queue_size=1)
+    await admission.acquire("user", 4)
+
+    waiting = asyncio.ensure_future(admission.acquire("user", 2))
+    other = asyncio.ensure_future(admission.acquire("other", 5))
+    await settle()
+
+    assert other.done()
+    assert not waiting.done()
+    assert admission.stats.waiting == 1
+
+    admission.release("user", 4)
+    assert await waiting == 2
+    assert admission.stats == Stats(
+        in_flight=7,
+        users=2,
+        waiting=0,
+        admitted=3,
+        rejected=0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_acquire_fair() -> None:
+    """Test that the waiting users are admitted in turns."""
+    admission = Admission(budget=2, user_budget=2, max_wait=5, queue_size=4)
+    await admission.acquire("blocker", 2)
+    order = []
+
+    async def acquire(user: str) -> None:
+        await admission.acquire(user, 1)
+        order.append(user)
+
+    tasks = [
+        asyncio.ensure_future(acquire(user))
+        for user in ("many", "many", "many", "few")
+    ]
+    await settle()
+    assert admission.stats.waiting == 4
+
+    admission.release("blocker", 2)
+    await settle()
+    # the first request of every user is admitted before the second one
+    assert order == ["many", "few"]
+
+    admission.release("few", 1)
+    await settle()
+    assert order == ["many", "few", "many"]
+
+    for task in tasks[2:]:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_acquire_queue_full() -> None:
+    """Test that a request is rejected when the queue is full."""
+    admission = Admission(budget=10, user_budget=5, max_wait=2.5)
+    await admission.acquire("user", 5)
+
+    with pytest.raises(Rejected) as e:
+        await admission.acquire("user", 1)
+
+    assert e.value.retry_after == 3
+    assert e.value.user
+    assert admission.stats == Stats(
+        in_flight=5,
+        users=1,
+        waiting=0,
+        admitted=1,
+        rejected=1,
+    )
+
+
+@pytest.mark.asyncio
+async def test_acquire_timeout() -> None:
+    """Test that a request is rejected when it waits for too long."""
+    admission = Admission(budget=5, user_budget=5, max_wait=0.01, queue_size=1)
+    await admission.acquire("user", 5)
+
+    with pytest.raises(Rejected) as e:
+        await admission.acquire("other", 1)
+
+    assert e.value.retry_after == 1
+    assert not e.value.user
+    assert admission.stats.waiting == 0
+    assert admission.stats.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_acquire_cancelled() -> None:
+    """Test that a cancelled request stops waiting."""
+    admission = Admission(budget=5, user_budget=5, max_wait=5, queue_size=2)
+    await admission.acquire("user", 5)
+
+    cancelled = asyncio.ensure_future(admission.acquire("user", 5))
+    waiting = asyncio.ensure_future(admission.acquire("user", 1))
+    await settle()
+    cancelled.cancel()
+    await settle()
+
+    assert cancelled.cancelled()
+    assert admission.stats.waiting == 1
+
+    admission.release("user", 5)
+    assert await waiting == 1
+    assert admission.stats.in_flight == 1
+    assert admission.stats.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_run_cancelled_admitted() -> None:
+    """Test that a request cancelled once admitted releases its cost."""
+    admission = Admission(budget=5, user_budget=5, max_wait=5, queue_size=1)
+    await admission.acquire("user", 5)
+
+    async def func() -> None:
+        await asyncio.sleep(0)
+
+    task = asyncio.ensure_future(admission.run("user", 5, func))
+    await settle()
+    admission.release("user", 5)
+    # admitted, but the task did not resume yet
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert admission.in_flight == 0
+    assert admission.stats.users == 0
+
+
+@pytest.mark.asyncio
+async def test_hold_shared() -> None:
+    """Test that requests of a user with the same key are charged once."""
+    admission = Admission(budget=10, user_budget=5)
+    first = admission.hold("user", 100, "key")
+    second = admission.hold("user", 100, "key")
+
+    await first.__aenter__()
+    # a retry of a request over the user budget is not rejected
+    await second.__aenter__()
+    assert admission.stats == Stats(
+        in_flight=5,
+        users=1,
+        waiting=0,
+        admitted=1,
+        rejected=0,
+    )
+
+    await first.__aexit__(None, None, None)
+    assert admission.in_flight == 5
+    await second.__aexit__(None, None, None)
+    assert admission.in_flight == 0
+    assert admission.stats.users == 0
+
+
+@pytest.mark.asyncio
+async def test_hold_other_user() -> None:
+    """Test that every user is charged for the same key."""
+    admission = Admission(budget=10, user_budget=5)
+
+    async with admission.hold("user", 3, "key"):
+        async with admission.hold("other", 3, "key"):
+            assert admission.in_flight == 6
+            assert admission.stats.users == 2
+    assert admission.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_hold_rejected() -> None:
+    """Test that every request sharing a rejected charge is rejected."""
+    admission = Admission(budget=10, user_budget=5)
+    await admission.acquire("user", 5)
+
+    async def hold() -> None:
+        async with admission.hold("user", 1, "key"):
+            pass
+
+    results = await asyncio.gather(hold(), hold(), return_exceptions=True)
+
+    assert [type(result) for result in results] == [Rejected, Rejected]
+    assert admission.stats.rejected == 1
+    assert admission.in_flight == 5
+
+
+@pytest.mark.asyncio
+async def test_hold_cancelled() -> None:
+    """Test that a waiting charge is withdrawn once nobody awaits it."""
+    admission = Admission(budget=5, user_budget=5, max_wait=5, queue_size=1)
+    await admission.acquire("user", 5)
+
+    async def hold() -> None:
+        async with admission.hold("user", 1, "key"):
+            pass
+
+    task = asyncio.ensure_future(hold())
+    await settle()
+    assert admission.stats.waiting == 1
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await settle()
+
+    assert admission.stats.waiting == 0
+    admission.release("user", 5)
+    assert admission.in_flight == 0
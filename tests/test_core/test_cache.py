@@ -0,0 +1,179 @@
+"""Test the module used for caching decoding results."""
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING
+
+import pytest
+
+from imagesecrets.core.cache import ResultCache, Stats, dumps, loads
+from imagesecrets.core.decode import Message
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_key() -> None:
+    """Test that keys depend on the image and on every parameter."""
+    key = ResultCache.key("digest", "dlm", 1, False)
+
+    keys = {
+        key,
+        ResultCache.key("other", "dlm", 1, False),
+        ResultCache.key("digest", "other", 1, False),
+        ResultCache.key("digest", "dlm", 2, False),
+        ResultCache.key("digest", "dlm", 1, True),
+        ResultCache.key("digest", "dlm", None, None),
+    }
+
+    assert key == ResultCache.key("digest", "dlm", 1, False)
+    assert len(keys) == 6
+
+
+@pytest.mark.parametrize(
+    "result",
+    [Message("text", 2, True), Message("", 8, False), "no message found"],
+)
+def test_serialize(result) -> None:
+    """Test that results are restored from their serialized form."""
+    assert loads(dumps(result)) == result
+
+
+@pytest.mark.asyncio
+async def test_get_put() -> None:
+    """Test that cached results are returned from memory."""
+    cache = ResultCache(max_bytes=2 ** 10)
+
+    assert await cache.get("found") is None
+    await cache.put("found", Message("text", 1, False))
+    await cache.put("missing", "no message found")
+
+    assert await cache.get("found") == Message("text", 1, False)
+    assert await cache.get("missing") == "no message found"
+    stats = cache.stats
+    assert stats[:4] == (2, 0, 1, 2)
+    assert stats.size == sum(
+        len(key) + len(dumps(result))
+        for key, result in (
+            ("found", Message("text", 1, False)),
+            ("missing", "no message found"),
+        )
+    )
+
+    cache.clear()
+
+    assert cache.stats == Stats(0, 0, 0, 0, 0)
+    assert await cache.get("found") is None
+
+
+@pytest.mark.asyncio
+async def test_eviction() -> None:
+    """Test that the least recently used results are evicted."""
+    size = len("a") + len(dumps("x" * 10))
+    cache = ResultCache(max_bytes=size * 2)
+
+    await cache.put("a", "x" * 10)
+    await cache.put("b", "x" * 10)
+    await cache.get("a")
+    await cache.put("c", "x" * 10)
+
+    assert cache.stats.entries == 2
+    assert cache.stats.size == size * 2
+    assert await cache.get("a") == "x" * 10
+    assert await cache.get("b") is None
+    assert await cache.get("c") == "x" * 10
+
+
+@pytest.mark.asyncio
+async def test_replace() -> None:
+    """Test that a result put again replaces the previous one."""
+    cache = ResultCache(max_bytes=2 ** 10)
+
+    await cache.put("key", "first")
+    await cache.put("key", "second result")
+
+    assert await cache.get("key") == "second result"
+    assert cache.stats.entries == 1
+    assert cache.stats.size == len("key") + len(dumps("second result"))
+
+
+@pytest.mark.asyncio
+async def test_too_large() -> None:
+    """Test that results larger than the memory tier are not kept."""
+    cache = ResultCache(max_bytes=16)
+
+    await cache.put("key", "x" * 16)
+
+    assert cache.stats.entries == 0
+    assert await cache.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_disk(tmp_path: Path) -> None:
+    """Test that the disk tier is shared by several caches."""
+    directory = tmp_path / "cache"
+    first = ResultCache(max_bytes=2 ** 10, directory=directory)
+    second = ResultCache(max_bytes=0, directory=directory)
+
+    await first.put("key", Message("text", 3, True))
+
+    assert [fp.name for fp in directory.iterdir()] == ["key"]
+    assert await second.get("key") == Message("text", 3, True)
+    assert await second.get("other") is None
+    assert second.stats[:3] == (0, 1, 1)
+
+    third = ResultCache(max_bytes=2 ** 10, directory=directory)
+    assert await third.get("key") == Message("text", 3, True)
+    # the result read from disk is kept in memory
+    assert await third.get("key") == Message("text", 3, True)
+    assert third.stats[:3] == (1, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_disk_eviction(tmp_path: Path) -> None:
+    """Test that the least recently used results are evicted from disk."""
+    directory = tmp_path / "cache"
+    size = len(dumps("x" * 10))
+    cache = ResultCache(
+        max_bytes=0,
+        directory=directory,
+        max_disk_bytes=size * 2,
+    )
+
+    await cache.put("a", "x" * 10)
+    await cache.put("b", "x" * 10)
+    # the modification time is the order of the last use
+    os.utime(directory / "a", (1, 1))
+    os.utime(directory / "b", (2, 2))
+    await cache.put("c", "x" * 10)
+
+    assert sorted(fp.name for fp in directory.iterdir()) == ["b", "c"]
+    assert cache.stats.disk_size == size * 2
+    # the size of the existing results is counted on construction
+    other = ResultCache(max_bytes=0, directory=directory)
+    assert other.stats.disk_size == size * 2
+
+
+@pytest.mark.asyncio
+async def test_disk_read_touches(tmp_path: Path) -> None:
+    """Test that reading a result from disk marks it as recently used."""
+    directory = tmp_path / "cache"
+    cache = ResultCache(max_bytes=0, directory=directory)
+    await cache.put("key", "result")
+    os.utime(directory / "key", (1, 1))
+
+    assert await cache.get("key") == "result"
+
+    assert (directory / "key").stat().st_mtime > 1
+
+
+@pytest.mark.asyncio
+async def test_disk_too_large(tmp_path: Path) -> None:
+    """Test that results larger than the disk tier are not written."""
+    directory = tmp_path / "cache"
+    cache = ResultCache(max_bytes=0, directory=directory, max_disk_bytes=8)
+
+    await cache.put("key", "x" * 16)
+
+    assert not list(directory.iterdir())
+    assert cache.stats.disk_size == 0
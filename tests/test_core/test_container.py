@@ -0,0 +1,70 @@
+"""Test the module with the message container format."""
+from __future__ import annotations
+
+import zlib
+
+import pytest
+
+from imagesecrets.core import container
+from imagesecrets.core.container import Header
+
+
+@pytest.mark.parametrize("lsb_n", [1, 2, 3, 4, 5, 6, 7, 8])
+@pytest.mark.parametrize("data", [b"", b"a", b"message", "žluťoučký".encode()])
+def test_header_pack_unpack(data: bytes, lsb_n: int) -> None:
+    """Test that a packed header can be unpacked again."""
+    header = Header.create(data, lsb_n)
+
+    packed = header.pack()
+
+    assert len(packed) == container.HEADER_SIZE
+    assert packed.startswith(container.MAGIC)
+    assert Header.unpack(packed + b"noise") == header
+    assert header.length == len(data)
+    assert header.crc == zlib.crc32(data)
+
+
+@pytest.mark.parametrize(
+    "length, lsb_n, expected",
+    [(0, 1, 0), (1, 1, 8), (1, 3, 3), (3, 3, 8), (10, 8, 10), (5, 7, 6)],
+)
+def test_header_payload_pixels(length: int, lsb_n: int, expected: int) -> None:
+    """Test the payload pixels method."""
+    header = Header(
+        version=container.VERSION,
+        lsb_n=lsb_n,
+        flags=0,
+        length=length,
+        crc=0,
+    )
+
+    assert header.payload_pixels() == expected
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"ISEC",
+        b"XXXX" + Header.create(b"", 1).pack()[4:],
+        Header(version=2, lsb_n=1, flags=0, length=0, crc=0).pack(),
+        Header(version=1, lsb_n=0, flags=0, length=0, crc=0).pack(),
+        Header(version=1, lsb_n=9, flags=0, length=0, crc=0).pack(),
+        Header(version=1, lsb_n=1, flags=1, length=0, crc=0).pack(),
+    ],
+)
+def test_header_unpack_raises(data: bytes) -> None:
+    """Test that the unpack method raises ValueError with invalid data."""
+    with pytest.raises(ValueError):
+        Header.unpack(data)
+
+
+def test_header_verify() -> None:
+    """Test the verify method."""
+    header = Header.create(b"message", 1)
+
+    header.verify(b"message")
+    with pytest.raises(ValueError):
+        header.verify(b"massage")
+    with pytest.raises(ValueError):
+        header.verify(b"message!")
@@ -1,14 +1,21 @@
 """Test the module used for decoding."""
 from __future__ import annotations
 
+import random
+import tracemalloc
+from io import BytesIO
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 import numpy as np
 import pytest
+from PIL import Image
 
-from imagesecrets.constants import API_IMAGES
-from imagesecrets.core import decode
+from imagesecrets.constants import TILE_SIZE
+from imagesecrets.core import decode, encode
+from imagesecrets.core.container import HEADER_PIXELS
+from imagesecrets.core.util import image as image_util
+from imagesecrets.core.util import png
 
 if TYPE_CHECKING:
     from numpy.typing import ArrayLike
@@ -51,6 +58,24 @@ def test_decode_text(text: str) -> None:
     np.testing.assert_string_equal(result, text)
 
 
+@pytest.mark.parametrize(
+    "text, delimiter",
+    [
+        ("příliš žluťoučký kůň", "dlm"),
+        ("🐍 snake", "dlm"),
+        ("message", "✂️"),
+        ("ünïcödé", "€€"),
+    ],
+)
+def test_decode_text_utf8(text: str, delimiter: str) -> None:
+    """Test that the decode text function decodes multi-byte characters."""
+    data = f"{text}{delimiter}noise".encode("utf-8")
+
+    result = decode.decode_text(np.frombuffer(data, dtype=np.uint8), delimiter)
+
+    assert result == text
+
+
 def test_decode_text_raises(
     test_image_array: ArrayLike,
 ) -> None:
@@ -72,54 +97,426 @@ def test_decode_text_raises(
         ("delimiter8", 8),
     ],
 )
-def test_main(mocker: MockFixture, delimiter: str, lsb_n: int) -> None:
+def test_main(embed_message, delimiter: str, lsb_n: int) -> None:
     """Test the main function."""
-    arr = np.fromiter(map(ord, f"Hello{lsb_n}{delimiter}"), dtype=np.uint8)
-    mocker.patch(
-        "imagesecrets.core.decode.prepare_array",
-        return_value=arr,
-    )
+    arr = embed_message(f"Hello{lsb_n}", delimiter, lsb_n)
+
     result = decode.main(
-        ...,
+        arr,
         delimiter,
         lsb_n,
     )
     assert result == f"Hello{lsb_n}"
 
 
+@pytest.mark.parametrize("chunk_size", [8, 16, 24, 64, 1024])
+@pytest.mark.parametrize("lsb_n", [1, 3, 8])
+def test_main_chunks(embed_message, lsb_n: int, chunk_size: int) -> None:
+    """Test that the main function finds delimiters split between chunks."""
+    message = "žluťoučký kůň" * 5
+    arr = embed_message(message, "delimiter", lsb_n)
+
+    result = decode.main(arr, "delimiter", lsb_n, chunk_size=chunk_size)
+
+    assert result == message
+
+
+def test_main_stops_early(mocker: MockFixture, embed_message) -> None:
+    """Test that the main function does not decode chunks after the delimiter."""
+    arr = embed_message("short", "dlm", 1, size=8 * 1024)
+    prepare_array = mocker.spy(decode, "prepare_array")
+
+    result = decode.main(arr, "dlm", 1, chunk_size=64)
+
+    assert result == "short"
+    # one chunk for the search and one for the message itself
+    assert prepare_array.call_count == 2
+
+
+@pytest.mark.parametrize("lsb_n", [1, 3, 8])
+def test_main_reverse(embed_message, lsb_n: int) -> None:
+    """Test that the reverse main function decodes a message from the end."""
+    arr = embed_message("žluťoučký kůň", "dlm", lsb_n)[::-1]
+
+    result = decode.main(arr, "dlm", lsb_n, True, chunk_size=64)
+
+    assert result == "žluťoučký kůň"
+
+
+def test_main_reverse_tail(embed_message) -> None:
+    """Test that the reverse main function reads only the last pixels."""
+    arr = np.zeros(2 ** 22, dtype=np.uint8)
+    tail = embed_message("message", "dlm", 2, size=256)
+    arr[-tail.size :] = tail[::-1]
+
+    tracemalloc.start()
+    result = decode.main(arr, "dlm", 2, True, chunk_size=1024)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert result == "message"
+    # no flipped copy of the whole array was made
+    assert peak < arr.nbytes // 64
+
+
+def test_prepare_array_reverse(test_image_array: ArrayLike) -> None:
+    """Test that the reversed array is prepared without flipping a copy."""
+    flipped = test_image_array.ravel()[::-1]
+
+    np.testing.assert_array_equal(
+        decode.prepare_array(test_image_array, 3, True),
+        decode.prepare_array(flipped.copy(), 3, False),
+    )
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("header", [False, True])
+def test_main_workers(
+    test_image_path: Path,
+    reverse: bool,
+    header: bool,
+) -> None:
+    """Test that the main function decodes the same message on more threads."""
+    message = "žluťoučký kůň" * 50
+    arr = encode.main(message, test_image_path, "dlm", 3, reverse, header)
+
+    result = decode.main(
+        arr,
+        "dlm",
+        3,
+        reverse,
+        chunk_size=64,
+        workers=4,
+        tile_size=256,
+    )
+
+    assert result == message
+
+
+def test_main_raises(test_image_array: ArrayLike) -> None:
+    """Test that the main function raises StopIteration if nothing was found."""
+    with pytest.raises(StopIteration):
+        decode.main(test_image_array, "fake delimiter", chunk_size=256)
+
+
+def test_main_header(mocker: MockFixture, test_image_path: Path) -> None:
+    """Test that the main function does not search for the delimiter if a header is found."""
+    arr = encode.main("message", test_image_path, "dlm", 3, header=True)
+    find_delimiter = mocker.spy(decode, "find_delimiter")
+
+    assert decode.main(arr, "dlm", 1) == "message"
+    find_delimiter.assert_not_called()
+
+
+def test_main_header_corrupted(test_image_path: Path) -> None:
+    """Test that the main function raises StopIteration if the message is corrupted."""
+    arr = encode.main("message", test_image_path, "dlm", 8, header=True)
+    arr.ravel()[HEADER_PIXELS] ^= 1
+
+    with pytest.raises(StopIteration, match="corrupted"):
+        decode.main(arr, "dlm", 8)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("lsb_n", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_search(test_image_path: Path, lsb_n: int, reverse: bool) -> None:
+    """Test that the search function detects the lsb amount and direction."""
+    arr = encode.main("hello there", test_image_path, "dlm", lsb_n, reverse)
+
+    result = decode.search(arr, "dlm", chunk_size=64)
+
+    assert result == decode.Message("hello there", lsb_n, reverse)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_search_header(test_image_path: Path, reverse: bool) -> None:
+    """Test that the search function detects a reversed container header."""
+    arr = encode.main("message", test_image_path, "dlm", 5, reverse, True)
+
+    assert decode.search(arr, "dlm") == decode.Message("message", 5, reverse)
+
+
+def test_search_single_decode(
+    mocker: MockFixture,
+    test_image_path: Path,
+) -> None:
+    """Test that the search function stops after the chunk with the message."""
+    arr = encode.main("short", test_image_path, "dlm", 4)
+    iter_chunks = mocker.spy(decode, "iter_chunks")
+    prepare_array = mocker.spy(decode, "prepare_array")
+
+    result = decode.search(arr, "dlm", chunk_size=64)
+
+    assert result == decode.Message("short", 4, False)
+    assert iter_chunks.call_count == 16
+    # one chunk for each of the 16 scans and one for the message itself
+    assert prepare_array.call_count == 17
+
+
+@pytest.mark.parametrize("header", [False, True])
+def test_search_lazy(header: bool) -> None:
+    """Test that the search function decodes only the rows it needs."""
+    rng = random.Random(0)
+    buffer = BytesIO()
+    pixels = np.frombuffer(rng.randbytes(512 * 512 * 3), dtype=np.uint8)
+    pixels = pixels.reshape(512, 512, 3)
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    arr = encode.main("short", buffer, "dlm", 2, False, header)
+    # rows with the average or Paeth filter are decoded by Pillow
+    data = b"".join(png.encode(arr, filter_type="up"))
+    reader = png.Reader(data, lazy_limit=arr.size)
+
+    result = decode.search(
+        reader.array, "dlm", reverse=False, load=reader.load
+    )
+
+    assert result == decode.Message("short", 2, False)
+    assert 0 < reader.rows < arr.shape[0]
+    np.testing.assert_array_equal(
+        reader.array[: reader.rows], arr[: reader.rows]
+    )
+
+
+@pytest.mark.parametrize("mode", ["L", "LA", "RGBA", "I;16"])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_native_modes(tmpdir: local, mode: str, reverse: bool) -> None:
+    """Test that messages survive saving images in their own color mode."""
+    rng = random.Random(1)
+    channels = {"L": 1, "LA": 2, "RGBA": 4, "I;16": 1}[mode]
+    pixels = np.frombuffer(
+        rng.randbytes(64 * 48 * channels * 2), dtype=np.uint16
+    )
+    if mode != "I;16":
+        pixels = (pixels % 256).astype(np.uint8)
+    image_path = image_util.save_array(
+        pixels.reshape(48, 64, channels), image_dir=Path(tmpdir)
+    )
+
+    arr = encode.main("native", image_path, "dlm", 3, reverse, True)
+    fp = image_util.save_array(arr, image_dir=Path(tmpdir.mkdir("out")))
+
+    assert arr.dtype == pixels.dtype
+    assert arr.shape == (48, 64, channels)
+    assert image_util.shape(fp) == arr.shape
+    _, saved = image_util.data(fp, writable=False)
+    assert decode.main(saved, "dlm", None, None) == "native"
+    # only the low byte of 16 bit values holds the message
+    np.testing.assert_array_equal(
+        arr.reshape(-1) >> 8, pixels.reshape(-1) >> 8
+    )
+
+
+def test_search_raises(test_image_array: ArrayLike) -> None:
+    """Test that the search function raises StopIteration if nothing was found."""
+    with pytest.raises(StopIteration):
+        decode.search(test_image_array, "fake delimiter", chunk_size=256)
+
+
+def test_main_detect(test_image_path: Path) -> None:
+    """Test that the main function detects parameters if they are None."""
+    arr = encode.main("message", test_image_path, "dlm", 6, True)
+
+    assert decode.main(arr, "dlm", None, None) == "message"
+
+
+def test_read_header_raises(embed_message) -> None:
+    """Test that the read header function raises ValueError without a header."""
+    arr = embed_message("message", "dlm", 1)
+
+    with pytest.raises(ValueError):
+        decode.read_header(arr)
+
+
+@pytest.mark.parametrize("chunk_size", [16, 800, 12288])
+def test_iter_chunks(test_image_array: ArrayLike, chunk_size: int) -> None:
+    """Test that joined chunks are equal to the whole prepared array."""
+    chunks = list(
+        decode.iter_chunks(test_image_array.ravel(), 2, chunk_size),
+    )
+
+    assert len(chunks) == np.ceil(test_image_array.size / chunk_size)
+    np.testing.assert_array_equal(
+        np.concatenate(chunks),
+        decode.prepare_array(test_image_array, 2, False),
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [-8, 0, 1, 7, 100])
+def test_iter_chunks_raises(chunk_size: int) -> None:
+    """Test that the iter chunks function raises ValueError with invalid chunk size."""
+    with pytest.raises(ValueError):
+        next(decode.iter_chunks(np.zeros(10), 1, chunk_size))
+
+
+@pytest.mark.parametrize(
+    "chunks, expected",
+    [
+        ([b"dlm"], 0),
+        ([b"abc", b"dlm"], 3),
+        ([b"abd", b"lm"], 2),
+        ([b"abcd", b"l", b"m"], 3),
+        ([b"", b"x", b"", b"dlm"], 1),
+    ],
+)
+def test_find_delimiter(chunks: list[bytes], expected: int) -> None:
+    """Test the find delimiter function."""
+    arrays = [np.frombuffer(chunk, dtype=np.uint8) for chunk in chunks]
+
+    assert decode.find_delimiter(arrays, b"dlm") == expected
+
+
+def test_scan_delimiter() -> None:
+    """Test that the scan delimiter function yields after every chunk."""
+    arrays = [
+        np.frombuffer(chunk, dtype=np.uint8)
+        for chunk in (b"ab", b"cd", b"dlm", b"ef")
+    ]
+
+    assert list(decode.scan_delimiter(arrays[:2], b"dlm")) == [None, None]
+    assert list(decode.scan_delimiter(arrays, b"dlm")) == [None, None, 4]
+
+
+def test_find_delimiter_raises() -> None:
+    """Test that the find delimiter function raises StopIteration if nothing was found."""
+    arrays = [np.frombuffer(chunk, dtype=np.uint8) for chunk in (b"dl", b"d")]
+
+    with pytest.raises(StopIteration):
+        decode.find_delimiter(arrays, b"dlm")
+
+
+@pytest.mark.parametrize("lsb_n", [1, 4, 8])
+def test_probe_array_header(test_image_path: Path, lsb_n: int) -> None:
+    """Test that the probe array function reads the container header."""
+    arr = encode.main("message", test_image_path, "dlm", lsb_n, header=True)
+
+    result = decode.probe_array(arr[:1], "dlm", arr.size)
+
+    assert result == decode.Probe(format="header", lsb_n=lsb_n, length=7)
+
+
+@pytest.mark.parametrize("lsb_n", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_probe_array_delimiter(embed_message, lsb_n: int) -> None:
+    """Test that the probe array function finds the delimiter."""
+    arr = embed_message("příliš žluťoučký kůň", "dlm", lsb_n)
+
+    result = decode.probe_array(arr, "dlm")
+
+    assert result == decode.Probe(format="delimiter", lsb_n=lsb_n, length=29)
+
+
+def test_probe_array_text(embed_message) -> None:
+    """Test that the probe array function recognizes text without a delimiter."""
+    arr = embed_message("lorem ipsum " * 100, "dlm", 3)
+
+    result = decode.probe_array(arr[:2048], "dlm", arr.size)
+
+    assert result == decode.Probe(format="text", lsb_n=3)
+
+
+def test_probe_array_nothing(test_image_array: ArrayLike) -> None:
+    """Test that the probe array function returns an empty result."""
+    assert decode.probe_array(test_image_array, "fake delimiter") == (
+        decode.Probe()
+    )
+
+
+def test_probe(test_image_path: Path) -> None:
+    """Test that the probe function finds a message in an image."""
+    arr = encode.main("message", test_image_path, "dlm", 2)
+    buffer = BytesIO()
+    Image.fromarray(arr).save(buffer, format="PNG")
+
+    result = decode.probe(buffer.getvalue(), "dlm", size=256)
+
+    assert result == decode.Probe(format="delimiter", lsb_n=2, length=7)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (b"", False),
+        (b"hello world", True),
+        ("žluťoučký kůň\n".encode("utf-8"), True),
+        (bytes(range(64)), False),
+        (b"\xff" * 64, False),
+    ],
+)
+def test_text_like(text: bytes, expected: bool) -> None:
+    """Test the text like function."""
+    assert decode.text_like(text) is expected
+
+
 @pytest.mark.parametrize(
     "image_data, delimiter, lsb_n",
     [(b"image_data", "delimiter", 1)],
 )
 def test_api(
     mocker: MockFixture,
-    tmpdir: local,
     image_data: bytes,
     delimiter: str,
     lsb_n: int,
 ) -> None:
     """Test the api decode function."""
-    tmpdir = Path(tmpdir.mkdir("tmp/"))
-
     read_bytes = mocker.patch(
         "imagesecrets.core.util.image.read_bytes",
         return_value="bytes read",
     )
-    data = mocker.patch(
-        "imagesecrets.core.util.image.data",
-        return_value=(..., "array"),
+    lazy_data = mocker.patch(
+        "imagesecrets.core.util.image.lazy_data",
+        return_value=(..., "array", "load"),
+    )
+    search = mocker.patch(
+        "imagesecrets.core.decode.search",
+        return_value=decode.Message("message", lsb_n, False),
     )
-    main = mocker.patch(
-        "imagesecrets.core.decode.main",
-        retuen_value="Message",
+    message = decode.api(image_data, delimiter, lsb_n, False)
+    read_bytes.assert_called_once_with(image_data)
+    lazy_data.assert_called_once_with("bytes read")
+    search.assert_called_once_with(
+        "array",
+        delimiter,
+        lsb_n,
+        False,
+        workers=1,
+        tile_size=TILE_SIZE,
+        load="load",
+        progress=None,
     )
-    save_array = mocker.patch(
-        "imagesecrets.core.util.image.save_array",
-        return_value=tmpdir / "image.png",
+    assert message == search.return_value
+
+
+def test_api_encoded(test_image_path: Path) -> None:
+    """Test the api decode function with an encoded image."""
+    encoded = encode.main("encoded", test_image_path, "dlm", 2, False)
+    buffer = BytesIO()
+    Image.fromarray(encoded).save(buffer, format="PNG")
+
+    message = decode.api(buffer.getvalue(), "dlm", 2, False)
+
+    assert message == decode.Message("encoded", 2, False)
+
+
+@pytest.mark.parametrize("reverse", [False, None])
+def test_api_progress(test_image_path: Path, reverse) -> None:
+    """Test that the parsed header and the decoded pixels are reported."""
+    encoded = encode.main("encoded", test_image_path, "dlm", 2, False)
+    buffer = BytesIO()
+    Image.fromarray(encoded).save(buffer, format="PNG")
+    events: list[tuple[str, float]] = []
+
+    decode.api(
+        buffer.getvalue(),
+        "dlm",
+        2,
+        reverse,
+        progress=lambda *event: events.append(event),
     )
 
-    decode.api(image_data, delimiter, lsb_n, False)
-    read_bytes.assert_called_once_with(image_data)
-    data.assert_called_once_with("bytes read")
-    main.assert_called_once_with("array", delimiter, lsb_n, False)
-    save_array.assert_called_once_with("array", image_dir=API_IMAGES)
+    assert events[0] == ("header", 1.0)
+    fractions = [fraction for stage, fraction in events[1:]]
+    assert {stage for stage, _ in events[1:]} == {"pixels"}
+    assert fractions == sorted(fractions)
+    assert 0 < fractions[0] <= 1
+    if reverse is None:
+        # the reversed message is searched from the end of the image
+        assert fractions[0] == 1
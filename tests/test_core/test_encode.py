@@ -2,51 +2,42 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np
 import pytest
 
-from imagesecrets.core import encode
+from imagesecrets.core import decode, encode
+from imagesecrets.core.util import array, image
 
 if TYPE_CHECKING:
     from numpy.typing import ArrayLike
     from pytest_mock import MockFixture
 
 
-@pytest.mark.parametrize("message_len", [0, 10, 11, 100, 192])
-def test_prepare_image(
-    mocker: MockFixture,
-    test_image_array: ArrayLike,
-    message_len: int,
-) -> None:
-    """Test the prepare_image function."""
-    mocker.patch(
-        "imagesecrets.core.util.image.data",
-        return_value=(test_image_array.shape, test_image_array),
-    )
-    shape, base_arr, unpacked_arr = encode.prepare_image(..., message_len)
-
-    assert shape[-1] == 3
-    assert shape == test_image_array.shape
+def legacy_main(
+    message: str,
+    arr: ArrayLike,
+    delimiter: str,
+    lsb_n: int,
+) -> ArrayLike:
+    """Encode a message with the original unpack, edit, pack and concatenate steps."""
+    msg_arr, msg_len = array.message_bit(message, delimiter, lsb_n)
+    flat = arr.ravel()
 
-    assert base_arr.ndim == 1
-    assert base_arr.dtype == np.uint8
-    assert np.logical_and(base_arr >= 0, base_arr <= 255).all()
+    unpacked = np.unpackbits(flat[:msg_len]).reshape(-1, 8)
+    unpacked[:, -lsb_n:] = msg_arr
 
-    assert unpacked_arr.ndim == 2
-    assert unpacked_arr.shape == (message_len, 8)
-    np.testing.assert_array_equal(unpacked_arr, unpacked_arr.astype(bool))
+    return np.concatenate((np.packbits(unpacked), flat[msg_len:])).reshape(
+        arr.shape,
+    )
 
 
 def test_api(
-    tmpdir,
     mocker: MockFixture,
     test_image_array: ArrayLike,
 ) -> None:
-    """Test the api encoding function."""
-    tmpdir = Path(tmpdir.mkdir("tmp/"))
-
+    """Test that the api encoding function returns the png image data."""
     mocker.patch(
         "imagesecrets.core.util.image.read_bytes",
         return_value=...,
@@ -56,13 +47,26 @@ def test_api(
         return_value=test_image_array,
     )
 
-    result = encode.api(..., ..., ..., ..., ..., image_dir=tmpdir)
+    result = encode.api(..., ..., ..., ..., ...)
 
-    assert isinstance(result, Path)
-    assert result.is_file()
-    assert result.parent.name == "tmp"
-    assert len(result.stem) == 16
-    assert result.suffix == ".png"
+    assert isinstance(result, bytes)
+    assert result == b"".join(image.encode_array(test_image_array))
+
+
+def test_array_api(mocker: MockFixture, test_image_array: ArrayLike) -> None:
+    """Test that the array api function returns the pixels without saving them."""
+    save = mocker.patch("imagesecrets.core.util.image.save_array")
+    main = mocker.patch(
+        "imagesecrets.core.encode.main",
+        return_value=test_image_array,
+    )
+
+    result = encode.array_api("msg", b"data", "dlm", 2, True, workers=3)
+
+    assert result is test_image_array
+    save.assert_not_called()
+    assert main.call_args[0][2:] == ("dlm", 2, True, False)
+    assert main.call_args[0][1].read() == b"data"
 
 
 @pytest.mark.parametrize(
@@ -86,7 +90,203 @@ def test_main(
         np.testing.assert_array_equal(result, test_image_array)
 
 
+@pytest.mark.parametrize("lsb_n", [1, 2, 3, 4, 5, 6, 7, 8])
+@pytest.mark.parametrize(
+    "message, delimiter",
+    [
+        ("0", "dlm"),
+        ("Hello World!", "<{~stop-here~}>"),
+        ("příliš žluťoučký kůň 🐍", "€"),
+        ("x" * 511, "delimiter"),
+    ],
+)
+def test_main_bit_identical(
+    test_image_path: Path,
+    test_image_array: ArrayLike,
+    message: str,
+    delimiter: str,
+    lsb_n: int,
+) -> None:
+    """Test that the main function produces the same image as the original implementation."""
+    expected = legacy_main(message, test_image_array.copy(), delimiter, lsb_n)
+
+    result = encode.main(message, test_image_path, delimiter, lsb_n)
+
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("lsb_n", [1, 4, 7])
+def test_main_decodable(
+    test_image_path: Path,
+    lsb_n: int,
+    reverse: bool,
+) -> None:
+    """Test that the encoded message can be decoded again."""
+    result = encode.main("message", test_image_path, "dlm", lsb_n, reverse)
+
+    assert decode.main(result, "dlm", lsb_n, reverse) == "message"
+
+
+def test_main_in_place(
+    mocker: MockFixture,
+    test_image_array: ArrayLike,
+) -> None:
+    """Test that the main function writes into the decoded pixel array."""
+    arr = test_image_array.copy()
+    mocker.patch(
+        "imagesecrets.core.util.image.shape",
+        return_value=arr.shape,
+    )
+    mocker.patch(
+        "imagesecrets.core.util.image.data",
+        return_value=(arr.shape, arr),
+    )
+
+    result = encode.main("message", ..., "dlm", 2)
+
+    assert result is arr
+
+
+@pytest.mark.parametrize("lsb_n", [1, 4, 8])
+def test_main_reverse(
+    mocker: MockFixture,
+    test_image_array: ArrayLike,
+    lsb_n: int,
+) -> None:
+    """Test that the reverse main function changes only the last pixels."""
+    arr = test_image_array.copy()
+    mocker.patch(
+        "imagesecrets.core.util.image.shape",
+        return_value=arr.shape,
+    )
+    mocker.patch(
+        "imagesecrets.core.util.image.data",
+        return_value=(arr.shape, arr),
+    )
+
+    result = encode.main("message", ..., "dlm", lsb_n, True)
+
+    changed = np.flatnonzero(result.ravel() != test_image_array.ravel())
+    assert result is arr
+    assert changed.min() >= arr.size - np.ceil(10 * 8 / lsb_n)
+    assert decode.main(result, "dlm", lsb_n, True) == "message"
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("lsb_n", [1, 3, 8])
+def test_main_workers(
+    test_image_path: Path, lsb_n: int, reverse: bool
+) -> None:
+    """Test that encoding on more threads gives the same image."""
+    message = "příliš žluťoučký kůň" * 10
+
+    expected = encode.main(message, test_image_path, "dlm", lsb_n, reverse)
+    result = encode.main(
+        message,
+        test_image_path,
+        "dlm",
+        lsb_n,
+        reverse,
+        workers=4,
+        tile_size=64,
+    )
+
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("lsb_n", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_main_header(test_image_path: Path, lsb_n: int, reverse: bool) -> None:
+    """Test that a message encoded with a header can be decoded without the delimiter."""
+    message = "příliš žluťoučký kůň"
+
+    result = encode.main(message, test_image_path, "", lsb_n, reverse, True)
+
+    header = decode.read_header(result.ravel()[::-1] if reverse else result)
+    assert header.lsb_n == lsb_n
+    assert header.length == len(message.encode())
+    # delimiter and lsb_n passed to decode are not needed
+    assert decode.main(result, "not used", 1, reverse) == message
+
+
+def test_main_header_raises_value_error(test_image_path: Path) -> None:
+    """Test that the header is included in the image size check."""
+    with pytest.raises(ValueError):
+        encode.main("x" * 1530, test_image_path, "", 1, header=True)
+
+
 def test_main_raises_value_error(test_image_path) -> None:
     """Test the the main encode function raises ValueError correctly."""
     with pytest.raises(ValueError):
         encode.main("Hello" * 1000, test_image_path)
+
+
+def test_main_capacity_before_decode(
+    mocker: MockFixture,
+    test_image_path: Path,
+) -> None:
+    """Test that a message which does not fit is rejected before decoding."""
+    data = mocker.spy(image, "data")
+
+    with pytest.raises(ValueError):
+        encode.main("Hello" * 1000, test_image_path)
+    data.assert_not_called()
+
+
+@pytest.mark.parametrize("header", [False, True])
+@pytest.mark.parametrize("lsb_n", [1, 3, 8])
+def test_capacity(test_image_path: Path, lsb_n: int, header: bool) -> None:
+    """Test that the capacity is exactly the longest message which fits."""
+    result = encode.capacity(test_image_path, None, "dlm", header)
+    length = result.sizes[lsb_n]
+
+    encode.main("x" * length, test_image_path, "dlm", lsb_n, header=header)
+    with pytest.raises(ValueError):
+        encode.main(
+            "x" * (length + 1), test_image_path, "dlm", lsb_n, header=header
+        )
+
+
+@pytest.mark.parametrize(
+    "length, expected",
+    [(None, None), (0, 1), (1000, 1), (2000, 2), (12000, 8), (10 ** 6, None)],
+)
+def test_capacity_lsb_n(
+    test_image_path: Path,
+    length: Optional[int],
+    expected: Optional[int],
+) -> None:
+    """Test that the capacity function returns the smallest fitting lsb amount."""
+    result = encode.capacity(test_image_path, length, "dlm")
+
+    assert result.shape == (64, 64, 3)
+    assert result.lsb_n == expected
+
+
+@pytest.mark.parametrize("header", [False, True])
+def test_api_progress(test_image_path: Path, header: bool) -> None:
+    """Test that every stage of the encoding is reported in order."""
+    events: list[tuple[str, float]] = []
+
+    encode.api(
+        "message",
+        test_image_path.read_bytes(),
+        "dlm",
+        2,
+        False,
+        header,
+        progress=lambda *event: events.append(event),
+    )
+
+    stages = [stage for stage, _ in events]
+    assert stages[:2] == ["header", "pixels"]
+    assert set(stages[2:]) == {"embed", "compress"}
+    assert stages.index("compress") > max(
+        index for index, stage in enumerate(stages) if stage == "embed"
+    )
+    for stage in ("embed", "compress"):
+        fractions = [fraction for name, fraction in events if name == stage]
+        assert fractions == sorted(fractions)
+        assert fractions[-1] == 1
@@ -0,0 +1,288 @@
+"""Test the module used for running blocking functions."""
+from __future__ import annotations
+
+import asyncio
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from imagesecrets.core import executor
+
+
+def describe(data: bytes, arr: np.ndarray) -> tuple[int, int]:
+    """Return the size of the data and the sum of the array."""
+    return len(data), int(arr.sum())
+
+
+def stop() -> None:
+    """Raise StopIteration."""
+    raise StopIteration("nothing found")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_run(kind: str) -> None:
+    """Test that the run function returns the result from the pool."""
+    pool = executor.Executor(kind, workers=1)
+    data = b"x" * executor.SHARED_MEMORY_MIN
+    arr = np.ones(executor.SHARED_MEMORY_MIN, dtype=np.uint8)
+
+    try:
+        result = await pool.run(describe, data, arr=arr)
+    finally:
+        pool.shutdown()
+
+    assert result == (len(data), arr.size)
+    assert pool.pending == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_run_stopped(kind: str) -> None:
+    """Test that StopIteration is raised as TaskStopped."""
+    pool = executor.Executor(kind, workers=1)
+
+    try:
+        with pytest.raises(executor.TaskStopped, match="nothing found"):
+            await pool.run(stop)
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_run_queue_full() -> None:
+    """Test that tasks over the limit are refused right away."""
+    pool = executor.Executor("thread", workers=1, queue_size=1)
+
+    results = await asyncio.gather(
+        *(pool.run(time.sleep, 0.1) for _ in range(3)),
+        return_exceptions=True,
+    )
+    pool.shutdown()
+
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], executor.QueueFull)
+
+
+def double(data: memoryview) -> bytes:
+    """Return the data twice."""
+    return bytes(data) * 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_run_shared_result(kind: str) -> None:
+    """Test that large results are returned from the pool."""
+    pool = executor.Executor(kind, workers=1)
+    data = b"x" * executor.SHARED_MEMORY_MIN
+
+    try:
+        result = await pool.run(double, data)
+    finally:
+        pool.shutdown()
+
+    assert result == data * 2
+
+
+@pytest.mark.asyncio
+async def test_run_thread_not_shared(mocker) -> None:
+    """Test that results of thread workers are returned without a copy."""
+    pool = executor.Executor("thread", workers=1)
+    arr = np.ones(executor.SHARED_MEMORY_MIN, dtype=np.uint8)
+    create = mocker.spy(shared_memory, "SharedMemory")
+
+    try:
+        result = await pool.run(lambda: arr)
+    finally:
+        pool.shutdown()
+
+    assert result is arr
+    create.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_run_share_fails(mocker) -> None:
+    """Test that the shared arguments are unlinked if sharing fails."""
+    pool = executor.Executor("process", workers=1)
+    data = b"x" * executor.SHARED_MEMORY_MIN
+    share = executor.share
+    blocks: list[shared_memory.SharedMemory] = []
+
+    def fail_second(value, created):
+        if blocks:
+            raise OSError("no space left on device")
+        result = share(value, created)
+        blocks.extend(created)
+        return result
+
+    mocker.patch("imagesecrets.core.executor.share", side_effect=fail_second)
+
+    try:
+        with pytest.raises(OSError):
+            await pool.run(describe, data, data)
+    finally:
+        pool.shutdown()
+
+    assert pool.pending == 0
+    assert len(blocks) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=blocks[0].name)
+
+
+@pytest.mark.asyncio
+async def test_shutdown_waits() -> None:
+    """Test that running tasks of process workers finish on shutdown."""
+    pool = executor.Executor("process", workers=1)
+    data = b"x" * executor.SHARED_MEMORY_MIN
+    # the worker is started by the first task
+    await pool.run(describe, b"", np.zeros(1))
+
+    future = pool.pool.submit(
+        executor.call,
+        double,
+        (data,),
+        {},
+        shared=True,
+    )
+    # queued tasks are cancelled, running ones are waited for
+    while not future.running() and not future.done():
+        await asyncio.sleep(0.01)
+    pool.shutdown()
+
+    assert future.done()
+    result = future.result()
+    assert executor.collect(result) == data * 2
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=result.name)
+
+
+def test_executor_raises() -> None:
+    """Test that the executor raises ValueError with unknown kind."""
+    with pytest.raises(ValueError):
+        executor.Executor("fiber")
+
+
+def test_executor_default_workers() -> None:
+    """Test that the limit includes the default number of workers."""
+    pool = executor.Executor("process", queue_size=2)
+
+    assert pool.workers >= 1
+    assert pool.limit == pool.workers + 2
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        b"x" * executor.SHARED_MEMORY_MIN,
+        bytearray(executor.SHARED_MEMORY_MIN),
+        memoryview(b"y" * executor.SHARED_MEMORY_MIN),
+        np.arange(executor.SHARED_MEMORY_MIN, dtype=np.uint16).reshape(-1, 8),
+    ],
+)
+def test_share_attach(value) -> None:
+    """Test that large buffers are passed through shared memory."""
+    blocks: list[shared_memory.SharedMemory] = []
+
+    shared = executor.share(value, blocks)
+    attached_blocks: list[shared_memory.SharedMemory] = []
+    result = executor.attach(shared, attached_blocks)
+
+    try:
+        assert len(blocks) == 1
+        assert isinstance(
+            shared,
+            (executor.SharedBytes, executor.SharedArray),
+        )
+        if isinstance(value, np.ndarray):
+            np.testing.assert_array_equal(result, value)
+            assert not result.flags.writeable
+        else:
+            assert result == value
+            assert result.readonly
+    finally:
+        # the views must be released before the blocks are closed
+        del result
+        for block in attached_blocks:
+            block.close()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        b"x" * executor.SHARED_MEMORY_MIN,
+        np.arange(executor.SHARED_MEMORY_MIN, dtype=np.uint16).reshape(-1, 8),
+    ],
+)
+def test_share_result_collect(value) -> None:
+    """Test that large results are returned through shared memory."""
+    shared = executor.share_result(value)
+
+    result = executor.collect(shared)
+
+    assert isinstance(shared, (executor.SharedBytes, executor.SharedArray))
+    if isinstance(value, np.ndarray):
+        np.testing.assert_array_equal(result, value)
+    else:
+        assert result == value
+    # the block is unlinked once the result is collected
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shared.name)
+
+
+@pytest.mark.parametrize("value", [b"small", np.zeros(10), "text", None])
+def test_share_small(value) -> None:
+    """Test that small values are not put into shared memory."""
+    blocks: list[shared_memory.SharedMemory] = []
+
+    assert executor.share(value, blocks) is value
+    assert not blocks
+
+
+def test_share_small_view() -> None:
+    """Test that small memory views are turned into picklable bytes."""
+    blocks: list[shared_memory.SharedMemory] = []
+
+    assert executor.share(memoryview(b"small"), blocks) == b"small"
+    assert not blocks
+
+
+def count(n: int, *, progress) -> int:
+    """Report progress of every step and return the number of steps."""
+    for i in range(n):
+        progress("embed", (i + 1) / n)
+    return n
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_run_progress(kind: str) -> None:
+    """Test that progress reported by a worker reaches the event loop."""
+    from imagesecrets.core.progress import Event, Progress
+
+    pool = executor.Executor(kind, workers=1)
+    progress = Progress()
+
+    async def finished() -> None:
+        async for event in progress.changes():
+            if event.fraction == 1:
+                return
+
+    try:
+        assert await pool.run(count, 4, progress=progress) == 4
+        # events of process workers are relayed by another thread
+        await asyncio.wait_for(finished(), timeout=10)
+        for _ in range(100):
+            if not pool._progress:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        pool.shutdown()
+
+    assert progress.last == Event("embed", 1.0)
+    # the relay forgets the progress once the task has finished
+    assert pool._progress == {}
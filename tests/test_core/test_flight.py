@@ -0,0 +1,96 @@
+"""Test the module used for coalescing identical computations."""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from imagesecrets.core.flight import SingleFlight
+
+
+class Computation:
+    """Coroutine function which counts its calls and waits for a signal."""
+
+    def __init__(self) -> None:
+        """Construct the class."""
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, value: int, *, fail: bool = False) -> int:
+        """Return the value once released."""
+        self.calls += 1
+        await self.release.wait()
+        if fail:
+            raise ValueError(value)
+        return value
+
+
+@pytest.mark.asyncio
+async def test_run_shared() -> None:
+    """Test that concurrent calls with the same key share the result."""
+    flights = SingleFlight()
+    compute = Computation()
+
+    tasks = [
+        asyncio.ensure_future(flights.run("key", compute, 1)) for _ in range(3)
+    ]
+    other = asyncio.ensure_future(flights.run("other", compute, 2))
+    await asyncio.sleep(0)
+
+    assert len(flights) == 2
+    compute.release.set()
+
+    assert await asyncio.gather(*tasks, other) == [1, 1, 1, 2]
+    assert compute.calls == 2
+    assert flights.joined == 2
+    assert len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_sequential() -> None:
+    """Test that finished computations are not reused."""
+    flights = SingleFlight()
+    compute = Computation()
+    compute.release.set()
+
+    assert await flights.run("key", compute, 1) == 1
+    assert await flights.run("key", compute, 2) == 2
+    assert compute.calls == 2
+    assert flights.joined == 0
+
+
+@pytest.mark.asyncio
+async def test_run_exception() -> None:
+    """Test that an exception is raised in every waiting call."""
+    flights = SingleFlight()
+    compute = Computation()
+
+    tasks = [
+        asyncio.ensure_future(flights.run("key", compute, 1, fail=True))
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+    compute.release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert compute.calls == 1
+    assert len(flights) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_cancelled() -> None:
+    """Test that a cancelled call does not cancel the shared computation."""
+    flights = SingleFlight()
+    compute = Computation()
+
+    first = asyncio.ensure_future(flights.run("key", compute, 1))
+    second = asyncio.ensure_future(flights.run("key", compute, 1))
+    await asyncio.sleep(0)
+    first.cancel()
+    compute.release.set()
+
+    assert await second == 1
+    assert first.cancelled()
+    assert compute.calls == 1
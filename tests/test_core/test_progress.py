@@ -0,0 +1,88 @@
+"""Test the module used for reporting progress of computations."""
+from __future__ import annotations
+
+import asyncio
+import threading
+
+import pytest
+
+from imagesecrets.core.progress import Event, Progress, loading
+
+
+async def collect(progress: Progress) -> list[Event]:
+    """Return all events yielded by the progress."""
+    return [event async for event in progress.changes()]
+
+
+@pytest.mark.asyncio
+async def test_progress_thread() -> None:
+    """Test that events reported from another thread are received."""
+    progress = Progress()
+    listener = asyncio.ensure_future(collect(progress))
+    await asyncio.sleep(0)
+
+    thread = threading.Thread(target=progress, args=("pixels", 1.5))
+    thread.start()
+    await asyncio.to_thread(thread.join)
+    await asyncio.sleep(0)
+    progress.close()
+
+    assert await listener == [Event("pixels", 1.0)]
+
+
+@pytest.mark.asyncio
+async def test_progress_coalesced() -> None:
+    """Test that only the latest event is yielded to a slow listener."""
+    progress = Progress()
+    for fraction in (0.1, 0.2, 0.3):
+        progress("embed", fraction)
+    progress("embed", 0.3)
+    await asyncio.sleep(0)
+    progress.close()
+
+    assert await collect(progress) == [Event("embed", 0.3)]
+
+
+@pytest.mark.asyncio
+async def test_progress_listeners() -> None:
+    """Test that every listener receives the events."""
+    progress = Progress()
+    listeners = [asyncio.ensure_future(collect(progress)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    progress("header", 1.0)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    progress("compress", 0.5)
+    await asyncio.sleep(0)
+    progress.close()
+    # late events are ignored
+    progress("compress", 1.0)
+
+    expected = [Event("header", 1.0), Event("compress", 0.5)]
+    assert await asyncio.gather(*listeners) == [expected, expected]
+    assert progress.last == Event("compress", 0.5)
+
+
+def test_loading() -> None:
+    """Test that the fraction of loaded pixel values is reported."""
+    loaded: list[int] = []
+    reported: list[tuple[str, float]] = []
+
+    load = loading(loaded.append, 10, lambda *args: reported.append(args))
+    load(5)
+    load(2)
+    load(20)
+
+    assert loaded == [5, 2, 20]
+    assert reported == [("pixels", 0.5), ("pixels", 1.0)]
+
+
+def test_loading_decoded() -> None:
+    """Test that an already decoded array is reported right away."""
+    reported: list[tuple[str, float]] = []
+
+    load = loading(None, 10, lambda *args: reported.append(args))
+
+    assert load is None
+    assert reported == [("pixels", 1.0)]
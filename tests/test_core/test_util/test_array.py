@@ -63,81 +63,121 @@ def test_message_bit_array(
     assert length == expected_arr.size // bits
 
 
+@pytest.mark.parametrize("bits", [1, 2, 3, 4, 5, 6, 7, 8])
 @pytest.mark.parametrize(
-    "col_num, start_from_end",
-    [
-        (1, True),
-        (2, True),
-        (3, True),
-        (1, False),
-        (2, False),
-        (3, False),
-    ],
+    "message", ["", "A", "Hello", "žluťoučký kůň", "Z" * 50]
 )
-def test_edit_column(
-    test_image_array: ArrayLike,
-    col_num: int,
-    start_from_end: bool,
+def test_message_payload(message: str, bits: int) -> None:
+    """Test that the message payload holds the same bits as the message bit array."""
+    bit_arr, length = array.message_bit(message, "dlm", bits)
+
+    result = array.message_payload(message, "dlm", bits)
+
+    assert result.dtype == np.uint8
+    assert result.shape == (length,)
+    assert (result < 2 ** bits).all()
+    np.testing.assert_array_equal(
+        np.unpackbits(result[:, np.newaxis], axis=1)[:, -bits:],
+        bit_arr,
+    )
+
+
+@pytest.mark.parametrize("bits", [1, 3, 8])
+def test_embed_payload(test_image_array: ArrayLike, bits: int) -> None:
+    """Test the embed payload function."""
+    base = test_image_array.ravel().copy()
+    payload = array.message_payload("message", "dlm", bits)
+
+    array.embed_payload(base, payload, bits)
+
+    mask = (1 << bits) - 1
+    np.testing.assert_array_equal(base[: payload.size] & mask, payload)
+    np.testing.assert_array_equal(
+        base[: payload.size] >> bits,
+        test_image_array.ravel()[: payload.size] >> bits,
+    )
+    np.testing.assert_array_equal(
+        base[payload.size :],
+        test_image_array.ravel()[payload.size :],
+    )
+
+
+@pytest.mark.parametrize("bits", [1, 4, 8])
+def test_embed_payload_reversed(
+    test_image_array: ArrayLike, bits: int
 ) -> None:
-    """Test the edit column function."""
-    new = np.array([36, 56, 157, 61, 8, 95, 39, 140] * 24)
-
-    bitlike_shape = (-1, 8)
-
-    test_image_array = test_image_array.reshape(bitlike_shape)[
-        : new.shape[0] // bitlike_shape[1]
-    ].copy()
-    new = new.reshape(-1, col_num)[: test_image_array.shape[0], :]
-
-    if start_from_end:
-        test_image_array[:, -col_num:] = new
-    else:
-        test_image_array[:, :col_num] = new
-
-    result = array.edit_column(
-        test_image_array.reshape(bitlike_shape),
-        new,
-        col_num,
-        start_from_end,
+    """Test that the embed payload function writes through reversed views."""
+    base = test_image_array.ravel().copy()
+    payload = array.message_payload("message", "dlm", bits)
+
+    array.embed_payload(base[::-1], payload, bits)
+
+    mask = (1 << bits) - 1
+    np.testing.assert_array_equal(
+        base[::-1][: payload.size] & mask,
+        payload,
     )
+    np.testing.assert_array_equal(
+        base[: -payload.size],
+        test_image_array.ravel()[: -payload.size],
+    )
+
+
+@pytest.mark.parametrize("bits", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_lsb_table(bits: int) -> None:
+    """Test that the table shifts cover every bit of the 8 pixel values exactly once."""
+    table = array.lsb_table(bits)
+
+    assert table.bits == bits
+    assert table.mask == 2 ** bits - 1
+    assert {pixel for _, pixel, _ in table.shifts} == set(range(8))
+    assert {byte for byte, _, _ in table.shifts} == set(range(bits))
+    assert array.LSB_TABLES[bits] == table
+
+
+@pytest.mark.parametrize("size", [8, 13, 64, 12287])
+@pytest.mark.parametrize("bits", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_extract_bytes(
+    test_image_array: ArrayLike, bits: int, size: int
+) -> None:
+    """Test that the extract bytes function is equal to unpacking and packing the bits."""
+    pixels = test_image_array.ravel()[:size]
+
+    result = array.extract_bytes(pixels, bits)
 
-    np.testing.assert_array_equal(result, test_image_array)
-
-
-def test_pack_and_concatenate(test_image_array) -> None:
-    """Test the pack and concatenate function."""
-    unpacked = np.array(
-        [
-            [0, 0, 0, 0, 1, 1, 1, 0],
-            [1, 0, 0, 0, 0, 0, 1, 0],
-            [0, 0, 0, 0, 1, 1, 1, 1],
-            [1, 1, 1, 1, 0, 1, 1, 0],
-            [0, 1, 0, 0, 1, 0, 1, 1],
-            [1, 1, 0, 1, 1, 1, 0, 0],
-            [0, 0, 1, 1, 0, 1, 1, 1],
-            [1, 1, 0, 0, 0, 1, 1, 1],
-            [1, 0, 1, 1, 1, 1, 0, 1],
-            [0, 0, 1, 0, 0, 1, 0, 0],
-            [1, 0, 0, 1, 0, 1, 1, 1],
-            [1, 1, 1, 1, 1, 1, 0, 1],
-            [0, 0, 1, 1, 0, 0, 1, 1],
-            [1, 0, 0, 1, 0, 1, 0, 0],
-            [0, 0, 0, 1, 0, 1, 0, 0],
-            [0, 1, 1, 0, 0, 0, 0, 1],
-            [0, 0, 0, 1, 1, 0, 1, 0],
-            [1, 1, 0, 0, 1, 1, 0, 0],
-            [1, 1, 0, 0, 1, 0, 0, 1],
-            [1, 1, 1, 1, 1, 0, 1, 1],
-        ],
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(
+        result,
+        np.packbits(np.unpackbits(pixels).reshape(-1, 8)[:, -bits:]),
     )
 
-    result = array.pack_and_concatenate(
-        unpacked.ravel(),
-        test_image_array.ravel(),
-        (-1,),
+
+@pytest.mark.parametrize("size", [0, 1, 7, 100, 1001])
+@pytest.mark.parametrize("bits", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_extract_bytes_view(
+    test_image_array: ArrayLike, bits: int, size: int
+) -> None:
+    """Test that the extract bytes function works with reversed views."""
+    pixels = test_image_array.ravel()[::-1][:size]
+
+    np.testing.assert_array_equal(
+        array.extract_bytes(pixels, bits),
+        array.extract_bytes(pixels.copy(), bits),
     )
 
+
+@pytest.mark.parametrize("size", [0, 1, 7, 100])
+@pytest.mark.parametrize("bits", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_split_bytes(
+    test_image_array: ArrayLike, bits: int, size: int
+) -> None:
+    """Test that the split bytes function reverses the extract bytes function."""
+    data = test_image_array.ravel()[:size]
+
+    values = array.split_bytes(data, bits)
+
+    assert values.size == np.ceil(size * 8 / bits)
+    assert (values < 2 ** bits).all()
     np.testing.assert_array_equal(
-        result.ravel()[: -test_image_array.size],
-        np.packbits(unpacked),
+        array.extract_bytes(values, bits)[:size], data
     )
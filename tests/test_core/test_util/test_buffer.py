@@ -0,0 +1,133 @@
+"""Test the module used for reading uploaded data without copying them."""
+from __future__ import annotations
+
+import io
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecrets.core.util import buffer
+
+DATA = bytes(range(256)) * 64
+
+
+@pytest.fixture()
+def stream() -> buffer.BufferIO:
+    """Return stream over a memory view of the test data."""
+    return buffer.BufferIO(memoryview(bytearray(DATA)))
+
+
+def test_read(stream: buffer.BufferIO) -> None:
+    """Test that the stream reads the same bytes as BytesIO."""
+    expected = io.BytesIO(DATA)
+
+    for size in (0, 10, 1000, -1, 10):
+        assert stream.read(size) == expected.read(size)
+        assert stream.tell() == expected.tell()
+
+
+@pytest.mark.parametrize(
+    "offset, whence, position",
+    [
+        (10, io.SEEK_SET, 10),
+        (5, io.SEEK_CUR, 105),
+        (-6, io.SEEK_END, len(DATA) - 6),
+        (10, io.SEEK_END, len(DATA) + 10),
+    ],
+)
+def test_seek(
+    stream: buffer.BufferIO,
+    offset: int,
+    whence: int,
+    position: int,
+) -> None:
+    """Test that the stream moves to the right position."""
+    stream.seek(100)
+
+    assert stream.seek(offset, whence) == position
+    assert stream.read(4) == DATA[position : position + 4]
+
+
+@pytest.mark.parametrize("offset, whence", [(-1, io.SEEK_SET), (0, 3)])
+def test_seek_raises(
+    stream: buffer.BufferIO,
+    offset: int,
+    whence: int,
+) -> None:
+    """Test that the stream raises ValueError for invalid positions."""
+    with pytest.raises(ValueError):
+        stream.seek(offset, whence)
+
+
+def test_readinto(stream: buffer.BufferIO) -> None:
+    """Test that the stream fills a writable buffer."""
+    target = bytearray(100)
+    stream.seek(len(DATA) - 40)
+
+    assert stream.readinto(target) == 40
+    assert target[:40] == DATA[-40:]
+    assert stream.readinto(target) == 0
+
+
+def test_getbuffer(stream: buffer.BufferIO) -> None:
+    """Test that the buffer of the stream is not copied."""
+    view = stream.getbuffer()
+
+    assert view == DATA
+    assert view.obj is stream.getbuffer().obj
+
+
+def test_image(test_image_path: Path) -> None:
+    """Test that Pillow reads images from the stream."""
+    data = memoryview(test_image_path.read_bytes())
+
+    with Image.open(buffer.BufferIO(data)) as img:
+        arr = np.asarray(img)
+    with Image.open(test_image_path) as img:
+        np.testing.assert_array_equal(arr, np.asarray(img))
+
+
+@pytest.mark.parametrize(
+    "data, cls",
+    [(b"data", io.BytesIO), (memoryview(b"data"), buffer.BufferIO)],
+)
+def test_stream(data, cls: type) -> None:
+    """Test that the stream function does not copy the data."""
+    result = buffer.stream(data)
+
+    assert isinstance(result, cls)
+    assert result.read() == b"data"
+
+
+@pytest.mark.parametrize("size", [0, 100, 2 ** 20])
+def test_map_file(size: int) -> None:
+    """Test that spooled files are returned without reading them from disk."""
+    data = DATA * (size // len(DATA)) + DATA[: size % len(DATA)]
+    with tempfile.SpooledTemporaryFile(max_size=1000) as file:
+        file.write(data)
+
+        tracemalloc.start()
+        try:
+            result = buffer.map_file(file)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        assert result == data
+        if size > 1000:
+            assert isinstance(result, memoryview)
+            assert peak < size // 10
+        del result
+
+
+def test_map_file_in_memory() -> None:
+    """Test that small spooled files are returned as bytes."""
+    with tempfile.SpooledTemporaryFile(max_size=1000) as file:
+        file.write(b"small")
+
+        assert buffer.map_file(file) == b"small"
+        assert not file._rolled
@@ -6,17 +6,29 @@ from typing import TYPE_CHECKING
 
 import numpy as np
 import pytest
+from PIL import Image
 
+from imagesecrets.core.util import png
 from imagesecrets.core.util.image import (
+    ImageTooLarge,
+    content_filename,
+    content_hash,
     data,
-    png_filetype,
+    head,
+    lazy_data,
+    new_filename,
+    pixels,
+    png_header,
     read_bytes,
     save_array,
+    save_bytes,
+    shape,
 )
 
 if TYPE_CHECKING:
     from numpy.typing import ArrayLike
     from py.path import local
+    from pytest_mock import MockFixture
 
 
 @pytest.mark.parametrize(
@@ -43,6 +55,66 @@ def test_data(test_image_path: Path) -> None:
     assert shape[-1] == 3
 
 
+@pytest.mark.parametrize("size", [1, 1000, 10 ** 9])
+def test_head(test_image_path: Path, size: int) -> None:
+    """Test that the head function returns the first rows of the image."""
+    shape, arr = data(test_image_path)
+
+    head_shape, head_arr = head(test_image_path, size)
+
+    assert head_shape == shape
+    assert size <= head_arr.size or head_arr.shape == arr.shape
+    np.testing.assert_array_equal(head_arr, arr[: head_arr.shape[0]])
+
+
+@pytest.mark.parametrize("filter_type", ["up", "paeth"])
+def test_head_rows(
+    mocker: MockFixture,
+    test_image_array: ArrayLike,
+    filter_type: str,
+) -> None:
+    """Test that the head function decompresses only the first rows."""
+    data_ = b"".join(png.encode(test_image_array, filter_type=filter_type))
+    inflate = mocker.spy(png.Reader, "_inflate_row")
+    load_all = mocker.spy(png.Reader, "load_all")
+
+    shape, arr = head(read_bytes(data_), 1000)
+
+    # 1000 pixel values fill 6 rows of 64 RGB pixels
+    assert shape == test_image_array.shape
+    assert inflate.call_count == 6
+    load_all.assert_not_called()
+    np.testing.assert_array_equal(arr, test_image_array[:6])
+
+
+def test_head_other_format(tmpdir: local, test_image_array: ArrayLike) -> None:
+    """Test that the head function lets Pillow decode images of other formats."""
+    fp = Path(tmpdir) / "image.bmp"
+    Image.fromarray(test_image_array).save(fp)
+
+    shape, arr = head(fp, 1000)
+
+    assert shape == test_image_array.shape
+    np.testing.assert_array_equal(arr, test_image_array[: arr.shape[0]])
+
+
+@pytest.mark.parametrize("suffix", [".png", ".bmp"])
+def test_lazy_data(
+    tmpdir: local,
+    test_image_array: ArrayLike,
+    suffix: str,
+) -> None:
+    """Test that the lazy data function fills the array on demand."""
+    fp = Path(tmpdir) / f"image{suffix}"
+    Image.fromarray(test_image_array).save(fp)
+
+    shape, arr, load = lazy_data(fp)
+    load(arr.size)
+
+    assert shape == test_image_array.shape
+    np.testing.assert_array_equal(arr, test_image_array)
+
+
 def test_save(tmpdir: local, test_image_array: ArrayLike) -> None:
     """Test the save function."""
     tmp_dir = Path(tmpdir.mkdir("tmp/"))
@@ -51,15 +123,151 @@ def test_save(tmpdir: local, test_image_array: ArrayLike) -> None:
     assert fp.is_file()
 
 
-def test_png_filetype(test_image_path: Path) -> None:
-    """Test the png_filetype function."""
-    with open(test_image_path, mode="rb") as image_data:
-        result = png_filetype(image_data.read())
-    assert result
+@pytest.mark.parametrize(
+    "shape, mode",
+    [
+        ((20, 30), "L"),
+        ((20, 30, 1), "L"),
+        ((20, 30, 2), "LA"),
+        ((20, 30, 3), "RGB"),
+        ((20, 30, 4), "RGBA"),
+    ],
+)
+def test_save_mode(tmpdir: local, shape: tuple[int, ...], mode: str) -> None:
+    """Test that the save function keeps the color mode of the array."""
+    arr = np.arange(np.prod(shape)).reshape(shape).astype(np.uint8)
+
+    fp = save_array(arr, image_dir=Path(tmpdir), level=1, workers=2)
+
+    with Image.open(fp) as img:
+        assert img.mode == mode
+        np.testing.assert_array_equal(np.asarray(img), arr.squeeze())
+        np.testing.assert_array_equal(pixels(img), arr.reshape(20, 30, -1))
+
+
+def test_save_wide(tmpdir: local) -> None:
+    """Test that 16 bit arrays are saved as 16 bit grayscale images."""
+    arr = np.arange(600).reshape(20, 30, 1).astype(np.uint16) * 97
+
+    fp = save_array(arr, image_dir=Path(tmpdir))
+    shape, result = data(fp)
+
+    assert shape == (20, 30, 1)
+    assert result.dtype == np.uint16
+    np.testing.assert_array_equal(result, arr)
+
+
+@pytest.mark.parametrize(
+    "mode, channels", [("1", 1), ("P", 3), ("PA", 3), ("CMYK", 3)]
+)
+def test_pixels_other_modes(mode: str, channels: int) -> None:
+    """Test that other modes are converted to grayscale or RGB."""
+    img = Image.new(mode, (30, 20))
+
+    arr = pixels(img)
+
+    assert arr.shape == (20, 30, channels)
+    assert arr.dtype == np.uint8
+    assert arr.flags.writeable
+
+
+def test_data_read_only(test_image_path: Path) -> None:
+    """Test that the data are not copied unless they must be writable."""
+    _, arr = data(test_image_path, writable=False)
+
+    assert not arr.flags.writeable
+
+
+def test_content_filename(test_image_path: Path) -> None:
+    """Test that images with the same data get the same name."""
+    data = test_image_path.read_bytes()
+
+    name = content_filename(content_hash(data))
+
+    assert name == content_filename(content_hash(memoryview(data)))
+    assert name != content_filename(content_hash(data + b"\0"))
+    assert Path(name).suffix == ".png"
+    assert len(Path(name).stem) == 64
+
+
+def test_new_filename() -> None:
+    """Test that new file names are random png names."""
+    names = {new_filename() for _ in range(10)}
+
+    assert len(names) == 10
+    assert all(Path(name).suffix == ".png" for name in names)
+    assert all(Path(name).name == name for name in names)
+
+
+def test_save_bytes(tmpdir: local, test_image_path: Path) -> None:
+    """Test that the save bytes function stores the data unchanged."""
+    tmp_dir = Path(tmpdir.mkdir("tmp/"))
+
+    fp = save_bytes(test_image_path.read_bytes(), image_dir=tmp_dir)
+
+    assert fp.suffix == ".png"
+    assert fp.read_bytes() == test_image_path.read_bytes()
 
 
-def test_png_filetype_fail() -> None:
-    """Test that png_filetype returns False if not a png file is passed in."""
-    with open(Path(__file__), mode="rb") as image_data:
-        result = png_filetype(image_data.read())
-    assert not result
+def test_png_header(
+    test_image_path: Path, test_image_array: ArrayLike
+) -> None:
+    """Test that the png header function reads only the beginning of the data."""
+    start = test_image_path.read_bytes()[: png.HEADER_SIZE]
+
+    header = png_header(start, max_pixels=10 ** 9)
+
+    assert (header.height, header.width) == test_image_array.shape[:2]
+
+
+@pytest.mark.parametrize("data_", [b"", b"GIF89a", png.SIGNATURE + b"\0" * 25])
+def test_png_header_invalid(data_: bytes) -> None:
+    """Test that the png header function raises ValueError for invalid data."""
+    with pytest.raises(ValueError):
+        png_header(data_)
+
+
+def test_png_header_too_large(test_image_path: Path) -> None:
+    """Test that the png header function rejects images over the pixel budget."""
+    header = png_header(test_image_path.read_bytes())
+
+    png_header(test_image_path.read_bytes(), max_pixels=header.pixels)
+    with pytest.raises(ImageTooLarge):
+        png_header(test_image_path.read_bytes(), max_pixels=header.pixels - 1)
+
+
+def test_shape(
+    tmpdir: local,
+    test_image_path: Path,
+    test_image_array: ArrayLike,
+) -> None:
+    """Test that the shape function reads the size from the image header."""
+    bmp = Path(tmpdir) / "image.bmp"
+    Image.fromarray(test_image_array).save(bmp)
+
+    assert shape(test_image_path) == test_image_array.shape
+    assert (
+        shape(read_bytes(test_image_path.read_bytes()))
+        == test_image_array.shape
+    )
+    assert shape(bmp) == test_image_array.shape
+
+
+@pytest.mark.parametrize(
+    "mode, channels", [("L", 1), ("LA", 2), ("RGBA", 4), ("P", 3), ("1", 1)]
+)
+@pytest.mark.parametrize("format_", ["PNG", "BMP"])
+def test_shape_channels(
+    tmpdir: local,
+    mode: str,
+    channels: int,
+    format_: str,
+) -> None:
+    """Test that the shape function counts the channels of the color mode."""
+    if format_ == "BMP" and mode in ("LA", "RGBA", "P"):
+        pytest.skip("BMP does not store alpha channels and gray palettes")
+    fp = Path(tmpdir) / f"image.{format_.lower()}"
+    Image.new(mode, (30, 20)).save(fp, format=format_)
+
+    assert shape(fp) == (20, 30, channels)
+    assert data(fp)[0] == (20, 30, channels)
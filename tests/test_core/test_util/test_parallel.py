@@ -0,0 +1,92 @@
+"""Test the module used for processing arrays in tiles."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pytest
+
+from imagesecrets.core.util import array, parallel
+
+if TYPE_CHECKING:
+    from numpy.typing import ArrayLike
+
+
+@pytest.mark.parametrize(
+    "size, tile_size, expected",
+    [
+        (0, 8, []),
+        (8, 8, [slice(0, 8)]),
+        (20, 8, [slice(0, 8), slice(8, 16), slice(16, 20)]),
+        (20, 64, [slice(0, 20)]),
+    ],
+)
+def test_tiles(size: int, tile_size: int, expected: list[slice]) -> None:
+    """Test the tiles function."""
+    assert parallel.tiles(size, tile_size) == expected
+
+
+@pytest.mark.parametrize("tile_size", [-8, 0, 1, 12])
+def test_tiles_raises(tile_size: int) -> None:
+    """Test that the tiles function raises ValueError with invalid tile size."""
+    with pytest.raises(ValueError):
+        parallel.tiles(100, tile_size)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_run(workers: int) -> None:
+    """Test that the run function keeps the order of the items."""
+    assert parallel.run(str, range(10), workers) == list(map(str, range(10)))
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_imap(workers: int) -> None:
+    """Test that the imap function does not compute far ahead."""
+    calls = []
+
+    def func(item: int) -> int:
+        calls.append(item)
+        return item * 2
+
+    results = parallel.imap(func, range(100), workers)
+
+    assert next(results) == 0
+    assert next(results) == 2
+    results.close()
+    assert len(calls) <= workers + 1
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("bits", [1, 2, 3, 4, 5, 6, 7, 8])
+def test_extract_bytes(
+    test_image_array: ArrayLike,
+    bits: int,
+    reverse: bool,
+) -> None:
+    """Test that the tiled extraction is equal to the serial one."""
+    pixels = test_image_array.ravel()[: 1000 + bits]
+    if reverse:
+        pixels = pixels[::-1]
+
+    result = parallel.extract_bytes(pixels, bits, workers=4, tile_size=64)
+
+    np.testing.assert_array_equal(result, array.extract_bytes(pixels, bits))
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("bits", [1, 3, 8])
+def test_embed_payload(
+    test_image_array: ArrayLike,
+    bits: int,
+    reverse: bool,
+) -> None:
+    """Test that the tiled insertion is equal to the serial one."""
+    payload = array.message_payload("message" * 20, "dlm", bits)
+    expected = test_image_array.ravel().copy()
+    result = test_image_array.ravel().copy()
+    base = result[::-1] if reverse else result
+
+    array.embed_payload(expected[::-1] if reverse else expected, payload, bits)
+    parallel.embed_payload(base, payload, bits, workers=4, tile_size=64)
+
+    np.testing.assert_array_equal(result, expected)
@@ -0,0 +1,326 @@
+"""Test the png module."""
+from __future__ import annotations
+
+import random
+import zlib
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imagesecrets.core.util import png
+
+if TYPE_CHECKING:
+    from numpy.typing import ArrayLike
+    from pytest_mock import MockFixture
+
+
+def encode(arr: ArrayLike, mode: str = "RGB", **params) -> bytes:
+    """Return PNG image data of the array."""
+    buffer = BytesIO()
+    img = Image.fromarray(arr)
+    if mode == "P":
+        img = img.convert("P", palette=Image.ADAPTIVE)
+    else:
+        img = img.convert(mode)
+    img.save(buffer, format="PNG", **params)
+    return buffer.getvalue()
+
+
+def pillow_rgb(data: bytes) -> ArrayLike:
+    """Return the RGB pixel values of the image decoded by Pillow."""
+    with Image.open(BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB"), dtype=np.uint8)
+
+
+def pillow_native(data: bytes) -> ArrayLike:
+    """Return the pixel values of the image in its own mode decoded by Pillow."""
+    with Image.open(BytesIO(data)) as img:
+        mode = img.mode if img.mode in png.MODES.values() else "RGB"
+        arr = np.asarray(img.convert(mode), dtype=np.uint8)
+        return arr.reshape(img.height, img.width, -1)
+
+
+@pytest.fixture(scope="module")
+def pixels() -> ArrayLike:
+    """Return random pixel values with smooth areas for every filter type."""
+    rng = random.Random(0)
+    noise = np.frombuffer(rng.randbytes(40 * 60 * 3), dtype=np.uint8).copy()
+    noise = noise.reshape(40, 60, 3)
+    gradient = np.add.outer(np.arange(40), np.arange(60)).astype(np.uint8)
+    noise[20:] = gradient[20:, :, None]
+    return noise
+
+
+def test_read_header(test_image_path) -> None:
+    """Test that the read header function returns the image size."""
+    header = png.read_header(test_image_path.read_bytes())
+
+    with Image.open(test_image_path) as img:
+        assert (header.width, header.height) == img.size
+    assert header.bit_depth == 8
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"not a png image", png.SIGNATURE, png.SIGNATURE + b"\0" * 20],
+)
+def test_read_header_raises(data: bytes) -> None:
+    """Test that the read header function raises ValueError for invalid data."""
+    with pytest.raises(ValueError):
+        png.read_header(data)
+
+
+def test_chunks(pixels: ArrayLike) -> None:
+    """Test that the chunks function yields all chunks before IEND."""
+    kinds = [kind for kind, _ in png.chunks(encode(pixels))]
+
+    assert kinds[0] == b"IHDR"
+    assert b"IDAT" in kinds
+    assert b"IEND" not in kinds
+
+
+def test_chunks_truncated(pixels: ArrayLike) -> None:
+    """Test that the chunks function raises ValueError for truncated data."""
+    with pytest.raises(ValueError):
+        list(png.chunks(encode(pixels)[:-20]))
+
+
+@pytest.mark.parametrize("filter_type", [0, 1, 2, 3, 4])
+def test_unfilter(filter_type: int) -> None:
+    """Test that the unfilter function reverses every filter type."""
+    rng = random.Random(filter_type)
+    previous = np.frombuffer(rng.randbytes(30), dtype=np.uint8)
+    row = np.frombuffer(rng.randbytes(30), dtype=np.uint8)
+    bpp = 3
+
+    # filter the row with the reference definitions of the PNG specification
+    filtered = bytearray(row.size)
+    for i, value in enumerate(row.tolist()):
+        a = int(row[i - bpp]) if i >= bpp else 0
+        b = int(previous[i])
+        c = int(previous[i - bpp]) if i >= bpp else 0
+        p = a + b - c
+        paeth = min((abs(p - a), 0, a), (abs(p - b), 1, b), (abs(p - c), 2, c))
+        predictor = [0, a, b, (a + b) // 2, paeth[2]][filter_type]
+        filtered[i] = (value - predictor) & 0xFF
+
+    result = png.unfilter(
+        filter_type,
+        np.frombuffer(filtered, dtype=np.uint8),
+        previous,
+        bpp,
+    )
+
+    np.testing.assert_array_equal(result, row)
+
+
+def test_unfilter_raises() -> None:
+    """Test that the unfilter function raises ValueError for invalid filters."""
+    row = np.zeros(3, dtype=np.uint8)
+    with pytest.raises(ValueError):
+        png.unfilter(5, row, row, 3)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "LA", "P"])
+@pytest.mark.parametrize("optimize", [False, True])
+def test_reader(pixels: ArrayLike, mode: str, optimize: bool) -> None:
+    """Test that the reader decodes the same pixels as Pillow."""
+    data = encode(pixels, mode, optimize=optimize)
+    reader = png.Reader(data, lazy_limit=pixels.size)
+
+    reader.load(np.prod(reader.shape))
+
+    assert reader.rows == pixels.shape[0]
+    assert reader.shape[2] == (3 if mode == "P" else len(mode))
+    np.testing.assert_array_equal(reader.array, pillow_native(data))
+
+
+def test_reader_lazy(pixels: ArrayLike) -> None:
+    """Test that the reader decodes only the requested rows."""
+    reader = png.Reader(encode(pixels), lazy_limit=pixels.size)
+
+    reader.load(pixels.shape[1] * 3 + 1)
+
+    assert reader.rows == 2
+    assert reader.size == 2 * pixels.shape[1] * 3
+    np.testing.assert_array_equal(reader.array[:2], pixels[:2])
+
+
+def test_reader_load_all(pixels: ArrayLike) -> None:
+    """Test that the reader decodes the whole image beyond the lazy limit."""
+    reader = png.Reader(encode(pixels), lazy_limit=100)
+
+    reader.load(101)
+
+    assert reader.rows == pixels.shape[0]
+    np.testing.assert_array_equal(reader.array, pixels)
+
+
+@pytest.mark.parametrize("filter_type", ["average", "paeth"])
+def test_reader_slow_filter(
+    mocker: MockFixture,
+    pixels: ArrayLike,
+    filter_type: str,
+) -> None:
+    """Test that the reader lets Pillow decode rows with slow filters."""
+    data = b"".join(png.encode(pixels, filter_type=filter_type))
+    reader = png.Reader(data, lazy_limit=pixels.size)
+    unfilter = mocker.spy(png, "unfilter")
+
+    reader.load(1)
+
+    unfilter.assert_not_called()
+    assert reader.rows == pixels.shape[0]
+    np.testing.assert_array_equal(reader.array, pixels)
+
+
+def test_reader_adaptive(mocker: MockFixture, test_image_array) -> None:
+    """Test that images written with the default filter are read lazily."""
+    data = b"".join(png.encode(test_image_array))
+    reader = png.Reader(data, lazy_limit=test_image_array.size)
+    load_all = mocker.spy(reader, "load_all")
+    row_values = test_image_array[0].size
+
+    reader.load(row_values * 10)
+
+    load_all.assert_not_called()
+    assert reader.rows == 10
+    np.testing.assert_array_equal(
+        reader.array[:10],
+        test_image_array[:10],
+    )
+
+
+def test_reader_lazy_limit(monkeypatch, pixels: ArrayLike) -> None:
+    """Test that the default lazy limit is capped."""
+    data = encode(pixels)
+
+    assert png.Reader(data).lazy_limit == pixels.size // png.LAZY_FRACTION
+    monkeypatch.setattr(png, "LAZY_MAX_SIZE", 100)
+    assert png.Reader(data).lazy_limit == 100
+
+
+def test_reader_interlaced(pixels: ArrayLike) -> None:
+    """Test that the reader raises ValueError for interlaced images."""
+    data = bytearray(encode(pixels))
+    data[28] = 1  # interlace method in the IHDR chunk
+
+    with pytest.raises(ValueError):
+        png.Reader(bytes(data))
+
+
+def test_reader_bit_depth(pixels: ArrayLike) -> None:
+    """Test that the reader raises ValueError for 16 bit images."""
+    data = encode(pixels[..., 0].astype(np.uint16) * 257, "I;16")
+
+    with pytest.raises(ValueError):
+        png.Reader(data)
+
+
+def test_reader_truncated(pixels: ArrayLike) -> None:
+    """Test that the reader raises ValueError if the pixel data are missing."""
+    header = encode(pixels)[:33]  # signature and IHDR chunk
+    idat = zlib.compress(b"\0" * 10)
+    chunk = len(idat).to_bytes(4, "big") + b"IDAT" + idat + b"\0" * 4
+    data = header + chunk + b"\0\0\0\0IEND\xaeB`\x82"
+    reader = png.Reader(data, lazy_limit=pixels.size)
+
+    with pytest.raises(ValueError):
+        reader.load(pixels.size)
+
+
+@pytest.mark.parametrize("filter_type", png.FILTERS)
+@pytest.mark.parametrize("level", [0, 1, 9])
+def test_encode(pixels: ArrayLike, filter_type: str, level: int) -> None:
+    """Test that the encoded image holds the same pixels."""
+    data = b"".join(png.encode(pixels, level=level, filter_type=filter_type))
+
+    np.testing.assert_array_equal(pillow_rgb(data), pixels)
+
+
+@pytest.mark.parametrize("channels", [1, 2, 3, 4])
+def test_encode_channels(pixels: ArrayLike, channels: int) -> None:
+    """Test that the color type matches the number of channels."""
+    arr = np.dstack([pixels, pixels[..., :1]])[..., :channels]
+
+    data = b"".join(png.encode(arr))
+
+    header = png.read_header(data)
+    assert png.CHANNELS[header.color_type] == channels
+    with Image.open(BytesIO(data)) as img:
+        np.testing.assert_array_equal(np.asarray(img), arr.squeeze())
+
+
+@pytest.mark.parametrize("filter_type", ["sub", "adaptive"])
+def test_encode_wide(pixels: ArrayLike, filter_type: str) -> None:
+    """Test that 16 bit values are stored as 16 bit grayscale."""
+    arr = pixels[..., 0].astype(np.uint16) * 257 + pixels[..., 1]
+
+    data = b"".join(png.encode(arr, filter_type=filter_type))
+
+    assert png.read_header(data).bit_depth == 16
+    with Image.open(BytesIO(data)) as img:
+        np.testing.assert_array_equal(np.asarray(img), arr)
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4])
+@pytest.mark.parametrize("block_size", [1, 500, 2 ** 18])
+def test_encode_blocks(
+    pixels: ArrayLike, workers: int, block_size: int
+) -> None:
+    """Test that rows compressed in separate groups form one zlib stream."""
+    data = b"".join(png.encode(pixels, workers=workers, block_size=block_size))
+
+    idat = b"".join(
+        chunk for kind, chunk in png.chunks(data) if kind == b"IDAT"
+    )
+    rows = np.frombuffer(zlib.decompress(idat), dtype=np.uint8)
+    assert rows.size == pixels.shape[0] * (pixels.shape[1] * 3 + 1)
+
+    reader = png.Reader(data, lazy_limit=pixels.size)
+    reader.load(pixels.size)
+    np.testing.assert_array_equal(reader.array, pixels)
+
+
+def test_encode_same_stream(pixels: ArrayLike) -> None:
+    """Test that the number of workers does not change the image data."""
+    single = b"".join(png.encode(pixels, block_size=500))
+    multiple = b"".join(png.encode(pixels, block_size=500, workers=3))
+
+    assert single == multiple
+
+
+@pytest.mark.parametrize(
+    "shape, params",
+    [
+        ((4, 4, 5), {}),
+        ((0, 4, 3), {}),
+        ((4, 4, 3), {"level": 10}),
+        ((4, 4, 3), {"filter_type": "fake"}),
+    ],
+)
+def test_encode_raises(shape: tuple[int, ...], params) -> None:
+    """Test that the encode function raises ValueError for invalid arguments."""
+    with pytest.raises(ValueError):
+        next(png.encode(np.zeros(shape, dtype=np.uint8), **params))
+
+
+def test_encode_progress(pixels: ArrayLike) -> None:
+    """Test that the fraction of compressed rows is reported."""
+    events: list[tuple[str, float]] = []
+
+    for _ in png.encode(
+        pixels,
+        block_size=500,
+        progress=lambda *event: events.append(event),
+    ):
+        pass
+
+    assert len(events) > 1
+    assert {stage for stage, _ in events} == {"compress"}
+    fractions = [fraction for _, fraction in events]
+    assert fractions == sorted(fractions)
+    assert fractions[-1] == 1
@@ -46,3 +46,17 @@ async def test_startup(mocker: MockFixture, async_context_manager):
             continue
 
         await func()
+
+
+@pytest.mark.asyncio
+async def test_upgrade(mocker: MockFixture):
+    from imagesecrets.database import base
+
+    conn = mocker.Mock()
+    conn.execute = mocker.AsyncMock()
+
+    await base.upgrade(conn)
+
+    statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+    assert statements == list(base.UPGRADES)
+    assert all("DROP NOT NULL" in statement for statement in statements)
@@ -94,3 +94,79 @@ async def test_service_create_encoded(image_service):
 
     image_service._session.add.assert_called_once_with(result)
     assert isinstance(result, EncodedImage)
+
+
+def compile_(stmt) -> str:
+    """Return the SQL of a statement in the PostgreSQL dialect."""
+    from sqlalchemy.dialects import postgresql
+
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.asyncio
+async def test_service_reference(mocker: MockFixture, image_service):
+    result = mocker.Mock()
+    result.scalar_one = mocker.Mock(return_value=2)
+    image_service._session.execute.return_value = result
+
+    references = await image_service.reference(key="test key")
+
+    assert references == 2
+    sql = compile_(image_service._session.execute.call_args[1]["statement"])
+    assert sql.startswith("INSERT INTO blob")
+    assert "ON CONFLICT (key) DO UPDATE" in sql
+    assert "RETURNING blob.refcount" in sql
+
+
+@pytest.mark.asyncio
+async def test_service_release(mocker: MockFixture, image_service):
+    result = mocker.Mock()
+    result.scalars = mocker.Mock(return_value=["b"])
+    image_service._session.execute.return_value = result
+
+    unused = await image_service.release(["a", "b", "a", "c"])
+
+    assert unused == ["b"]
+    statements = [
+        call[1]["statement"]
+        for call in image_service._session.execute.call_args_list
+    ]
+    # one update per number of removed references, then a single delete
+    assert len(statements) == 3
+    updates = {
+        tuple(stmt.whereclause.right.value): compile_(stmt)
+        for stmt in statements[:2]
+    }
+    assert set(updates) == {("a",), ("b", "c")}
+    assert (
+        "refcount=(blob.refcount - "
+        in updates[
+            "a",
+        ]
+    )
+    assert compile_(statements[2]).startswith("DELETE FROM blob")
+
+
+@pytest.mark.asyncio
+async def test_service_release_empty(image_service):
+    unused = await image_service.release([])
+
+    assert unused == []
+    image_service._session.execute.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_service_delete(mocker: MockFixture, image_service):
+    result = mocker.Mock()
+    result.scalars = mocker.Mock(side_effect=[["a", None], ["a", "b"]])
+    image_service._session.execute.return_value = result
+    release = mocker.patch(
+        "imagesecrets.database.image.services.ImageService.release",
+        return_value=["b"],
+    )
+
+    unused = await image_service.delete(user_id=0)
+
+    assert unused == ["b"]
+    release.assert_called_once_with(["a", "a", "b"])
+    assert image_service._session.execute.call_count == 2
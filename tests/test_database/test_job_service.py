@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+import pytest
+from pytest_mock import MockFixture
+
+
+def compile_(stmt) -> str:
+    """Return the SQL of a statement in the PostgreSQL dialect."""
+    from sqlalchemy.dialects import postgresql
+
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.asyncio
+async def test_service_create(job_service):
+    from imagesecrets.database.job.models import Job
+
+    result = await job_service.create(
+        user_id=0,
+        kind="decode",
+        image_name="test image name",
+        input_key="test key",
+        params={"delimiter": "test delimiter"},
+    )
+
+    job_service._session.begin_nested.assert_called_once_with()
+    job_service._session.add.assert_called_once_with(result)
+    assert isinstance(result, Job)
+    assert result.input_key == "test key"
+
+
+@pytest.mark.asyncio
+async def test_service_get(mocker: MockFixture, job_service):
+    result = mocker.Mock()
+    result.scalar_one_or_none = mocker.Mock(return_value="test job")
+    job_service._session.execute.return_value = result
+
+    job = await job_service.get(job_id=1, user_id=0)
+
+    assert job == "test job"
+    stmt = job_service._session.execute.call_args[1]["statement"]
+    assert stmt.get_execution_options()["populate_existing"]
+
+
+@pytest.mark.asyncio
+async def test_service_claim(mocker: MockFixture, job_service):
+    from imagesecrets.database.job.models import Job
+
+    job = Job(status="queued", attempts=1)
+    result = mocker.Mock()
+    result.scalar_one_or_none = mocker.Mock(return_value=job)
+    job_service._session.execute.return_value = result
+    job_service._session.flush = mocker.AsyncMock()
+
+    claimed = await job_service.claim(timeout=60, max_attempts=3)
+
+    assert claimed is job
+    assert job.status == "running"
+    assert job.attempts == 2
+    assert job.started >= datetime.now() - timedelta(seconds=1)
+    job_service._session.flush.assert_called_once_with()
+    sql = compile_(job_service._session.execute.call_args[1]["statement"])
+    assert "ORDER BY job.id" in sql
+    assert sql.endswith("FOR UPDATE SKIP LOCKED")
+
+
+@pytest.mark.asyncio
+async def test_service_claim_none(mocker: MockFixture, job_service):
+    result = mocker.Mock()
+    result.scalar_one_or_none = mocker.Mock(return_value=None)
+    job_service._session.execute.return_value = result
+    job_service._session.flush = mocker.AsyncMock()
+
+    assert await job_service.claim(timeout=60, max_attempts=3) is None
+    job_service._session.flush.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("failed, status", [(False, "done"), (True, "failed")])
+async def test_service_finish(
+    mocker: MockFixture,
+    job_service,
+    failed: bool,
+    status: str,
+):
+    result = mocker.Mock()
+    result.scalar_one_or_none = mocker.Mock(return_value=1)
+    job_service._session.execute.return_value = result
+
+    assert await job_service.finish(
+        job_id=1,
+        attempt=2,
+        result={"detail": "test detail"},
+        failed=failed,
+    )
+
+    stmt = job_service._session.execute.call_args[1]["statement"]
+    params = stmt.compile().params
+    assert params["status"] == status
+    assert params["result"] == {"detail": "test detail"}
+    assert params["attempts_1"] == 2
+    sql = compile_(stmt)
+    assert "job.status = " in sql
+    assert sql.endswith("RETURNING job.id")
+
+
+@pytest.mark.asyncio
+async def test_service_finish_claimed_again(mocker: MockFixture, job_service):
+    result = mocker.Mock()
+    result.scalar_one_or_none = mocker.Mock(return_value=None)
+    job_service._session.execute.return_value = result
+
+    assert not await job_service.finish(job_id=1, attempt=1)
+
+
+@pytest.mark.asyncio
+async def test_service_fail_abandoned(mocker: MockFixture, job_service):
+    result = mocker.Mock()
+    result.scalars = mocker.Mock(return_value=[1, 2])
+    job_service._session.execute.return_value = result
+
+    failed = await job_service.fail_abandoned(timeout=60, max_attempts=3)
+
+    assert failed == [1, 2]
+    sql = compile_(job_service._session.execute.call_args[1]["statement"])
+    assert sql.startswith("UPDATE job SET status=")
+    assert "job.attempts >= " in sql
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "method, kwargs",
+    [
+        ("clear", {"older_than": timedelta(days=1)}),
+        ("delete", {"user_id": 0}),
+    ],
+)
+async def test_service_delete(job_service, method: str, kwargs):
+    job_service._session.execute.return_value = [("a", None), ("b", "c")]
+
+    keys = await getattr(job_service, method)(**kwargs)
+
+    assert keys == ["a", "b", "c"]
+    sql = compile_(job_service._session.execute.call_args[1]["statement"])
+    assert sql.startswith("DELETE FROM job")
+    assert sql.endswith("RETURNING job.input_key, job.result_key")
+
+
+@pytest.mark.asyncio
+async def test_service_report(job_service):
+    await job_service.report(job_id=1, progress={"stage": "embed"})
+
+    stmt = job_service._session.execute.call_args[1]["statement"]
+    assert stmt.compile().params["progress"] == {"stage": "embed"}
+    # progress of a finished job is never stored
+    assert "job.status = " in compile_(stmt)
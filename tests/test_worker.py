@@ -0,0 +1,369 @@
+"""Test the worker running the background jobs."""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+from typing import TYPE_CHECKING
+
+import pytest
+
+from imagesecrets.core.decode import Message
+from imagesecrets.core.executor import TaskStopped
+
+if TYPE_CHECKING:
+    from unittest.mock import Mock
+
+    from pytest_mock import MockFixture
+
+    from imagesecrets.core.storage import LocalStorage
+    from imagesecrets.database.job.models import Job
+
+ENCODE_PARAMS = {
+    "message": "test message",
+    "delimiter": "dlm",
+    "lsb_n": 2,
+    "reverse": False,
+    "header": False,
+    "save": True,
+}
+DECODE_PARAMS = {
+    "delimiter": "dlm",
+    "lsb_n": None,
+    "reverse": None,
+    "storage": "original",
+}
+
+
+def new_job(kind: str, params: dict) -> Job:
+    """Return a claimed job."""
+    from imagesecrets.database.job.models import Job
+
+    return Job(
+        id=1,
+        user_id=0,
+        kind=kind,
+        status="running",
+        image_name="test.png",
+        params=params,
+        input_key="input.png",
+        attempts=1,
+    )
+
+
+@pytest.fixture()
+def executor(mocker: MockFixture) -> Mock:
+    """Return executor which returns without running anything."""
+    executor = mocker.Mock()
+    executor.run = mocker.AsyncMock()
+    return executor
+
+
+@pytest.fixture()
+def storage(api_storage: LocalStorage) -> LocalStorage:
+    """Return storage with an uploaded image."""
+    api_storage.path("input.png").write_bytes(b"input")
+    return api_storage
+
+
+@pytest.fixture()
+def services(mocker: MockFixture, database_session) -> dict[str, Mock]:
+    """Patch the session of the worker and return the service methods."""
+    from imagesecrets.database.image.services import ImageService
+    from imagesecrets.database.job.services import JobService
+
+    @contextlib.asynccontextmanager
+    async def get_session():
+        yield database_session
+
+    mocker.patch("imagesecrets.worker.base.get_session", get_session)
+    return {
+        name: mocker.patch.object(service, name)
+        for service, names in (
+            (
+                ImageService,
+                ("reference", "create_encoded", "create_decoded"),
+            ),
+            (JobService, ("claim", "finish", "fail_abandoned", "report")),
+        )
+        for name in names
+    }
+
+
+@pytest.mark.asyncio
+async def test_process_encode(executor: Mock, storage: LocalStorage):
+    from imagesecrets import worker
+    from imagesecrets.core import encode
+
+    executor.run.return_value = b"encoded"
+
+    outcome = await worker.process(
+        new_job("encode", ENCODE_PARAMS),
+        executor,
+        storage,
+    )
+
+    assert outcome == worker.Outcome(data=b"encoded")
+    args, kwargs = executor.run.call_args
+    assert args == (encode.api,)
+    assert kwargs["file"] == b"input"
+    assert kwargs["lsb_n"] == 2
+
+
+@pytest.mark.asyncio
+async def test_process_encode_error(executor: Mock, storage: LocalStorage):
+    from imagesecrets import worker
+
+    executor.run.side_effect = ValueError("test error")
+
+    outcome = await worker.process(
+        new_job("encode", ENCODE_PARAMS),
+        executor,
+        storage,
+    )
+
+    assert outcome == worker.Outcome(
+        result={"detail": "test error"},
+        failed=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_decode(executor: Mock, storage: LocalStorage):
+    from imagesecrets import worker
+
+    message = Message("decoded", 3, True)
+    executor.run.return_value = message
+
+    outcome = await worker.process(
+        new_job("decode", DECODE_PARAMS),
+        executor,
+        storage,
+    )
+
+    assert outcome.result == {
+        "message": "decoded",
+        "lsb_amount": 3,
+        "reverse": True,
+    }
+    assert outcome.message == message
+    assert executor.run.call_args[1]["lsb_n"] is None
+
+
+@pytest.mark.asyncio
+async def test_process_decode_nothing(executor: Mock, storage: LocalStorage):
+    from imagesecrets import worker
+
+    executor.run.side_effect = TaskStopped("no message found")
+
+    outcome = await worker.process(
+        new_job("decode", DECODE_PARAMS),
+        executor,
+        storage,
+    )
+
+    assert outcome == worker.Outcome(result={"detail": "no message found"})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("save", [True, False])
+async def test_complete_encode(
+    storage: LocalStorage,
+    services: dict[str, Mock],
+    save: bool,
+):
+    from imagesecrets import worker
+
+    services["reference"].return_value = 1
+    key = f"{hashlib.sha256(b'encoded').hexdigest()}.png"
+
+    await worker.complete(
+        new_job("encode", ENCODE_PARAMS | {"save": save}),
+        worker.Outcome(data=b"encoded"),
+        storage,
+    )
+
+    assert storage.path(key).read_bytes() == b"encoded"
+    # the job and the history record hold a reference each
+    assert services["reference"].call_count == 1 + save
+    assert services["create_encoded"].called is save
+    if save:
+        data = services["create_encoded"].call_args[1]["data"]
+        assert data.filename == key
+        assert data.lsb_amount == 2
+    services["finish"].assert_called_once_with(
+        1,
+        1,
+        result=None,
+        result_key=key,
+        failed=False,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "storage_mode, references, history",
+    [("original", 1, True), ("history", 0, True), ("ephemeral", 0, False)],
+)
+async def test_complete_decode(
+    storage: LocalStorage,
+    services: dict[str, Mock],
+    storage_mode: str,
+    references: int,
+    history: bool,
+):
+    from imagesecrets import worker
+
+    outcome = worker.Outcome(
+        result={"message": "decoded"},
+        message=Message("decoded", 3, True),
+    )
+
+    await worker.complete(
+        new_job("decode", DECODE_PARAMS | {"storage": storage_mode}),
+        outcome,
+        storage,
+    )
+
+    assert services["reference"].call_count == references
+    assert services["create_decoded"].called is history
+    if history:
+        data = services["create_decoded"].call_args[1]["data"]
+        assert data.lsb_amount == 3
+        assert data.filename == ("input.png" if references else None)
+    services["finish"].assert_called_once_with(
+        1,
+        1,
+        result={"message": "decoded"},
+        result_key=None,
+        failed=False,
+    )
+
+
+@pytest.mark.asyncio
+async def test_complete_dropped(
+    storage: LocalStorage,
+    services: dict[str, Mock],
+):
+    from imagesecrets import worker
+
+    services["finish"].return_value = False
+
+    await worker.complete(
+        new_job("encode", ENCODE_PARAMS),
+        worker.Outcome(data=b"encoded"),
+        storage,
+    )
+
+    # the job was claimed again, its blob and history are not stored
+    assert not services["reference"].called
+    assert not services["create_encoded"].called
+    assert list(storage.directory.iterdir()) == [storage.path("input.png")]
+
+
+@pytest.mark.asyncio
+async def test_run_progress(
+    mocker: MockFixture,
+    api_settings,
+    executor: Mock,
+    storage: LocalStorage,
+    services: dict[str, Mock],
+):
+    from imagesecrets import worker
+
+    mocker.patch.object(api_settings, "job_poll_interval", 0)
+
+    async def run(func, **kwargs):
+        kwargs["progress"]("header", 1.0)
+        # the published progress is stored before the job is completed
+        while not services["report"].called:
+            await asyncio.sleep(0)
+        return b"encoded"
+
+    executor.run.side_effect = run
+    services["reference"].return_value = 2
+
+    await worker.run(new_job("encode", ENCODE_PARAMS), executor, storage)
+
+    services["report"].assert_called_once_with(
+        1,
+        {"stage": "header", "fraction": 1.0},
+    )
+    assert services["finish"].call_args[1]["failed"] is False
+
+
+@pytest.mark.asyncio
+async def test_publish_exception(
+    mocker: MockFixture,
+    services: dict[str, Mock],
+):
+    from imagesecrets import worker
+    from imagesecrets.core.progress import Progress
+
+    services["report"].side_effect = OSError
+    log = mocker.patch.object(worker.logger, "exception")
+    progress = Progress()
+    progress("pixels", 0.5)
+    await asyncio.sleep(0)
+
+    await worker.publish(1, progress)
+
+    log.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_exception(
+    mocker: MockFixture,
+    executor: Mock,
+    storage: LocalStorage,
+    services: dict[str, Mock],
+):
+    from imagesecrets import worker
+
+    mocker.patch("imagesecrets.worker.process", side_effect=OSError)
+
+    await worker.run(new_job("decode", DECODE_PARAMS), executor, storage)
+
+    services["finish"].assert_called_once_with(
+        1,
+        1,
+        result={"detail": "the job could not be processed"},
+        result_key=None,
+        failed=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_work(
+    mocker: MockFixture,
+    executor: Mock,
+    storage: LocalStorage,
+    services: dict[str, Mock],
+):
+    from imagesecrets import worker
+
+    jobs = [new_job("encode", ENCODE_PARAMS), new_job("decode", {})]
+    services["claim"].side_effect = [*jobs, None]
+    run = mocker.patch("imagesecrets.worker.run")
+
+    await worker.work(executor, storage, once=True)
+
+    assert [call.args[0] for call in run.call_args_list] == jobs
+    assert services["claim"].call_count == 3
+    services["fail_abandoned"].assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_main(mocker: MockFixture, api_settings):
+    from imagesecrets import worker
+
+    mocker.patch.object(api_settings, "job_concurrency", 3)
+    work = mocker.patch("imagesecrets.worker.work")
+    executor = mocker.patch("imagesecrets.api.dependencies.get_executor")
+    storage = mocker.patch("imagesecrets.api.dependencies.get_storage")
+
+    await worker.main()
+
+    assert work.call_count == 3
+    executor.return_value.shutdown.assert_called_once_with()
+    storage.return_value.shutdown.assert_called_once_with()